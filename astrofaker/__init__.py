@@ -30,6 +30,7 @@ add_instrument('niri')
 
 create = AstroFaker.create
 open = AstroFaker.open
+from_template = AstroFaker.from_template
 
 try:
     __version__ = version('astrofaker')
@@ -5,6 +5,7 @@ import abc
 
 import astrodata
 from astrodata import wcs as adwcs
+from astrodata.fits import ad_to_hdulist
 
 import numpy as np
 from scipy.ndimage import gaussian_filter
@@ -12,10 +13,15 @@ import datetime
 import astropy.units as u
 from astropy.modeling import models
 from astropy.wcs import WCS
-from astropy.io.fits import Header, PrimaryHDU
+from astropy.io import fits
+from astropy.io.fits import CompImageHDU, Header, ImageHDU, PrimaryHDU
+import os
+import tempfile
 from functools import wraps
 from types import MethodType
 
+from . import defects, fastwcs, kernels
+
 
 def cosd(angle):
     return np.cos(np.radians(angle))
@@ -27,13 +33,111 @@ def sind(angle):
 
 @models.custom_model
 def Sersic(x, y, amplitude=1.0, r_e=1.0, n=4.0):
-    m = 1.0 / n
-    # This approximation is from Ciotti & Bertin (1999; A&A, 352, 447)
-    b = 2. * n - 1. / 3. + 4. * m / 405. + 46. * m ** 2 / 25515.
+    b = kernels.sersic_b(n)
     r = np.sqrt(x * x + y * y)
+    m = 1.0 / n
     return amplitude * np.exp(-b * (r / r_e) ** m)
 
 
+def _image_dtype(header):
+    """Return the datatype of the (scaled) data described by a FITS header"""
+    bitpix = header['BITPIX']
+    bscale, bzero = header.get('BSCALE', 1), header.get('BZERO', 0)
+    if bitpix > 0 and bscale == 1 and bzero == 2 ** (bitpix - 1):
+        return np.dtype('uint{}'.format(bitpix))
+    if bitpix < 0:
+        return np.dtype('float{}'.format(-bitpix))
+    if bscale != 1 or bzero != 0:
+        return np.dtype(np.float32)
+    return np.dtype('uint8' if bitpix == 8 else 'int{}'.format(bitpix))
+
+
+def _zeros(shape, dtype, allocate=True):
+    """Return an array of zeros, or a read-only view of a single zero"""
+    if allocate:
+        return np.zeros(shape, dtype=dtype)
+    return np.broadcast_to(np.zeros((), dtype=dtype), shape)
+
+
+# Big-endian datatypes of the pixels stored in a FITS file, by BITPIX
+FITS_DTYPES = {8: 'u1', 16: '>i2', 32: '>i4', 64: '>i8',
+               -32: '>f4', -64: '>f8'}
+
+
+def _map_pixels(path, hdu, chunk_rows=256):
+    """
+    Return the pixels of an image HDU of a file as a copy-on-write memory
+    map. Pixels stored without scaling are mapped straight from the file,
+    in its big-endian byte order, so they are only read when accessed.
+    Scaled pixels, such as unsigned integers stored with BZERO, cannot be
+    viewed in place: they are converted chunk_rows rows at a time into an
+    unlinked temporary file, which is mapped instead, so they are read
+    once but never all held in memory.
+    """
+    header = hdu.header
+    shape = tuple(header['NAXIS{}'.format(i)]
+                  for i in range(header['NAXIS'], 0, -1))
+    raw = np.memmap(path, dtype=FITS_DTYPES[header['BITPIX']], mode='c',
+                    offset=hdu.fileinfo()['datLoc'], shape=shape)
+    bscale, bzero = header.get('BSCALE', 1), header.get('BZERO', 0)
+    if bscale == 1 and bzero == 0:
+        return raw
+
+    dtype = _image_dtype(header)
+    with tempfile.TemporaryFile() as f:
+        # The mapping keeps the file alive after it is closed
+        data = np.memmap(f, dtype=dtype, mode='w+', shape=shape)
+    blank = header.get('BLANK')
+    for start in range(0, shape[0], chunk_rows):
+        block = raw[start:start+chunk_rows]
+        if dtype.kind == 'u':
+            # Adding the offset wraps around, i.e., flips the sign bit
+            data[start:start+chunk_rows] = (block.astype(dtype) +
+                                            dtype.type(bzero))
+        else:
+            scaled = block * bscale + bzero
+            if blank is not None:
+                scaled[block == blank] = np.nan
+            data[start:start+chunk_rows] = scaled
+    return data
+
+
+def _row_blocks(data, variance, chunk_rows):
+    """
+    Yield corresponding blocks of chunk_rows rows of a .data plane and a
+    .variance plane (or None), with any leading axes folded into the rows,
+    or the whole planes if chunk_rows is None or they are not contiguous.
+    The blocks are views, so they can be modified in place, and random
+    numbers drawn for each block in turn follow the same sequence as those
+    drawn for the whole plane.
+    """
+    if (chunk_rows is None or not data.flags.c_contiguous or
+            not (variance is None or variance.flags.c_contiguous)):
+        yield data, variance
+        return
+    rows = data.reshape(-1, data.shape[-1])
+    var_rows = None if variance is None else variance.reshape(rows.shape)
+    for start in range(0, len(rows), chunk_rows):
+        yield (rows[start:start+chunk_rows],
+               None if var_rows is None else var_rows[start:start+chunk_rows])
+
+
+def _parse_section(value):
+    """Return (x1, x2, y1, y2) from a FITS section string "[x1:x2,y1:y2]\""""
+    (x1, x2), (y1, y2) = [[int(v) for v in axis.split(':')]
+                          for axis in value.strip()[1:-1].split(',')]
+    return x1, x2, y1, y2
+
+
+def _format_section(x1, x2, y1, y2):
+    return '[{}:{},{}:{}]'.format(x1, x2, y1, y2)
+
+
+def _single(value):
+    """Return the first element of a list-valued descriptor return"""
+    return value[0] if isinstance(value, list) else value
+
+
 def sliceable(fn):
     """Used to decorate functions that can operate on full AD instances or
     slices. If a full AD is sent, then the function being decorated
@@ -86,49 +190,151 @@ def convert_rd2xy(fn):
     """Most methods take (x,y) pixel values as parameters. This descriptor
     will look for (ra, dec) parameters and convert them to (x,y) using the
     WCS and send those values to the function being decorated. If the AD
-    has more than one extension, only the extension on which the celestial
-    coordinates lie will be passed to the decorated function.
-
-    TODO: Cope with objects that cross extension boundaries"""
+    has more than one extension, (x,y) are in the focal-plane frame (see
+    AstroFaker._mosaic_offsets()), which is the pixel frame of the first
+    extension."""
 
     @wraps(fn)
     def gn(self, *args, **kwargs):
         ra = kwargs.get("ra")
         dec = kwargs.get("dec")
         if not (ra is None or dec is None):
-            if self.is_single:
-                wcs = WCS(self[0].hdr)
-                x, y = wcs.all_world2pix(ra, dec, 0)
-                slice = self
-            else:
-                for index in range(len(self)):
-                    wcs = WCS(self[index].hdr)
-                    x, y = wcs.all_world2pix(ra, dec, 0)
-                    nypix, nxpix = self[index].data.shape
-                    if x > -0.5 and y > -0.5 and y < nypix - 0.5 and x < nxpix - 0.5:
-                        slice = self[index]
-                        break
-                else:
-                    print("Location not on any extensions")
-                    return
+            x, y = (self if self.is_single else self[0]).world2pix(ra, dec)
             del kwargs["ra"], kwargs["dec"]
             kwargs.update({"x": x, "y": y})
-            ret_value = fn(slice, *args, **kwargs)
-        else:
-            ret_value = fn(self, *args, **kwargs)  # unchanged
-        return ret_value
+        return fn(self, *args, **kwargs)
 
     return gn
 
 
+########################## DESCRIPTOR CACHING ##############################
+# Descriptor values are cached against the state of the headers they are
+# calculated from. The headers are given a class that counts the changes
+# made to them through the Header API (but not by editing Card objects).
+class _TrackingHeader(Header):
+    _change_count = 0
+
+
+def _tracked(method):
+    @wraps(method)
+    def fn(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._change_count += 1
+    return fn
+
+
+for _name in ('__setitem__', '__delitem__', '_update', '_relativeinsert',
+              'append', 'clear', 'extend', 'insert', 'pop', 'popitem',
+              'remove', 'rename_keyword', 'set', 'setdefault', 'strip',
+              'update'):
+    setattr(_TrackingHeader, _name, _tracked(getattr(Header, _name)))
+
+_header_tokens = iter(range(1, 2 ** 63))
+MAX_CACHED_DESCRIPTORS = 256
+
+
+def _header_state(header):
+    """Return a tuple that changes whenever the header is modified"""
+    if type(header) is Header:
+        header.__class__ = _TrackingHeader
+    elif not isinstance(header, _TrackingHeader):
+        return None  # can't track changes so never cache
+    try:
+        token = header._token
+    except AttributeError:
+        token = header._token = next(_header_tokens)
+    return token, header._change_count
+
+
+def cached_descriptor(name, fn):
+    """Wrap a descriptor method so that its return value is cached until
+    one of the headers (or gWCS objects) of the AD instance is changed.
+    Since the value may depend on other descriptors and on the tags, the
+    overrides of descriptors and any tags set by hand are part of the
+    cache key. Nothing is cached while an override is callable."""
+
+    @wraps(fn)
+    def gn(self, *args, **kwargs):
+        overrides = self._descriptor_dict
+        if (not self.cache_descriptors or name in overrides or
+                any(callable(value) for value in overrides.values())):
+            return fn(self, *args, **kwargs)
+
+        nddatas = [self.nddata] if self.is_single else self.nddata
+        wcs_list = [nd.wcs for nd in nddatas]
+        hdr_states = [_header_state(self.phu)] + [
+            _header_state(nd.meta['header']) for nd in nddatas]
+        if None in hdr_states:
+            return fn(self, *args, **kwargs)
+        tags = self.__dict__.get('_tags')
+        state = (tuple(hdr_states), tuple(id(wcs) for wcs in wcs_list),
+                 tuple(nd.shape for nd in nddatas),
+                 tuple(sorted((k, repr(v)) for k, v in overrides.items())),
+                 None if tags is None else tuple(sorted(tags)))
+
+        # A single extension's cache persists between slicings
+        if self.is_single:
+            cache = self.nddata.meta.setdefault('_descriptor_cache', {})
+        else:
+            cache = self._descriptor_cache
+        try:
+            key = (name, args, tuple(sorted(kwargs.items())), state)
+            value = cache[key][0]
+        except TypeError:  # unhashable arguments
+            return fn(self, *args, **kwargs)
+        except KeyError:
+            value = fn(self, *args, **kwargs)
+            if len(cache) >= MAX_CACHED_DESCRIPTORS:
+                cache.clear()
+            # Keep the gWCS objects alive so their ids can't be reused
+            cache[key] = (value, wcs_list)
+        return list(value) if isinstance(value, list) else value
+
+    gn.cached_descriptor = True
+    return gn
+
+
+# Maximum discrepancy (in pixels) between the WCS of an extension and a
+# pure translation of the WCS of the first extension for the extension to
+# be positioned in the focal-plane frame by an offset
+MOSAIC_TOLERANCE = 0.01
+# Descriptors that determine the offsets returned by _mosaic_offsets()
+MOSAIC_DESCRIPTORS = ('data_section', 'detector_section', 'detector_x_bin',
+                      'detector_y_bin')
+
+
 ############################ ASTROFAKER CLASS ###############################
 class AstroFaker(with_metaclass(abc.ABCMeta, object)):
+    # Cache descriptor return values until the headers change?
+    cache_descriptors = True
+    # Use polynomial approximations to the WCS to convert coordinates?
+    fast_wcs = False
+    fast_wcs_tolerance = fastwcs.DEFAULT_TOLERANCE
+    # Allocate the pixel planes created by add_extension()? If not, they are
+    # read-only views of a single zero, for inspecting the structure that
+    # init_default_extensions() creates (see planner.plan())
+    allocate_pixels = True
+
+    def __init_subclass__(cls, **kwargs):
+        """Wrap the descriptors of AstroFaker<Instrument> classes so that
+        their return values are cached"""
+        super().__init_subclass__(**kwargs)
+        for name in dir(cls):
+            fn = getattr(cls, name, None)
+            if (callable(fn) and getattr(fn, 'descriptor_method', False)
+                    and not getattr(fn, 'cached_descriptor', False)):
+                setattr(cls, name, cached_descriptor(name, fn))
+
     def __new__(cls, *args, **kwargs):
         """Since we never call an AstroFakerInstrument's __init__(), we set
         up the the internal attributes here"""
         instance = object.__new__(cls)
         instance._seeing = 0.8
         instance._descriptor_dict = {}
+        instance._descriptor_cache = {}
+        instance._mosaic_cache = None
         return instance
 
     def __setattr__(self, name, value):
@@ -266,19 +472,149 @@ class AstroFaker(with_metaclass(abc.ABCMeta, object)):
 
     def __getitem__(self, slicing):
         """
-        Override the standard AD slicing to propagate the _tags attribute
+        Override the standard AD slicing to propagate the _tags attribute,
+        any options set on this instance, and any descriptor overrides. An
+        override that is a list with one element per extension is sliced
+        along with the AD.
         """
         sliced = super().__getitem__(slicing)
         try:
             sliced._tags = self._tags
         except AttributeError:
             pass
+        for name in ('cache_descriptors', 'fast_wcs', 'fast_wcs_tolerance',
+                     'allocate_pixels'):
+            if name in self.__dict__:
+                setattr(sliced, name, self.__dict__[name])
+        for name, value in self._descriptor_dict.items():
+            if (isinstance(value, list) and len(value) == len(self) and
+                    isinstance(slicing, (int, np.integer, slice))):
+                value = value[slicing]
+            setattr(sliced, name, value)
         return sliced
 
     @staticmethod
     def open(source):
         return astrodata.open(source)
 
+    def write(self, filename=None, overwrite=False, compression=None,
+              quantize_level=16.):
+        """
+        Write the object to disk, optionally as tile-compressed image HDUs
+        which astrodata (via astropy) reads back transparently. Integer
+        planes (raw data, DQ) are always compressed losslessly; floating-point
+        planes are quantized unless quantize_level is zero.
+
+        Parameters
+        ----------
+        filename: str/None
+            name of the file (if None, use the object's path)
+        overwrite: bool
+            overwrite an existing file?
+        compression: str/None
+            None for an uncompressed file, or the tile-compression algorithm
+            ('RICE_1', 'GZIP_1', 'GZIP_2', 'HCOMPRESS_1', 'PLIO_1')
+        quantize_level: float
+            quantization level for floating-point planes (see the
+            astropy.io.fits.CompImageHDU documentation). Zero means lossless
+            compression, which is only possible with the GZIP algorithms, so
+            GZIP_2 is used for lossless floating-point planes.
+        """
+        if compression is None:
+            return super().write(filename=filename, overwrite=overwrite)
+
+        if filename is None:
+            filename = self.path
+        hdulist = ad_to_hdulist(self)
+        for i, hdu in enumerate(hdulist):
+            if type(hdu) is not ImageHDU or hdu.data is None:
+                continue
+            compression_type = compression
+            if (np.issubdtype(hdu.data.dtype, np.floating) and
+                    quantize_level == 0):
+                compression_type = 'GZIP_2'
+            hdulist[i] = CompImageHDU(data=hdu.data, header=hdu.header,
+                                      compression_type=compression_type,
+                                      quantize_level=quantize_level)
+        hdulist.writeto(filename, overwrite=overwrite)
+
+    @staticmethod
+    def from_template(path, keep_pixels=False):
+        """
+        Create an AstroFaker<Instrument> object with the headers of an
+        existing file, e.g., to start from a real observation. Only the
+        headers are read. Unless keep_pixels is True, each SCI plane is an
+        array of zeros, for which the operating system only provides memory
+        when it is written to. Otherwise, the pixels are memory-mapped from
+        the file copy-on-write, so the file is never modified. Unscaled
+        pixels keep the big-endian byte order of the file and are only read
+        when accessed; scaled ones, like raw unsigned 16-bit data stored
+        with BZERO=32768, have to be converted, so they are read once into
+        a temporary memory-mapped file. VAR, DQ and table extensions are
+        ignored.
+
+        Parameters
+        ----------
+        path: str
+            name of the template file
+        keep_pixels: bool
+            map the pixels of the file rather than using zeros?
+        """
+        extensions = []
+        with fits.open(path, mode='copyonwrite',
+                       lazy_load_hdus=True) as hdulist:
+            phu = hdulist[0].header.copy()
+            for hdu in hdulist[1:]:
+                if (not isinstance(hdu, ImageHDU) or
+                        hdu.header.get('EXTNAME', 'SCI') != 'SCI'):
+                    continue
+                header = Header(hdu.header.cards)
+                if keep_pixels:
+                    data = _map_pixels(path, hdu)
+                else:
+                    shape = tuple(header['NAXIS{}'.format(i)]
+                                  for i in range(header['NAXIS'], 0, -1))
+                    data = np.zeros(shape, dtype=_image_dtype(header))
+                # The scaling is determined by the datatype of the new array
+                for kw in ('BSCALE', 'BZERO', 'BLANK', 'CHECKSUM', 'DATASUM'):
+                    header.remove(kw, ignore_missing=True)
+                extensions.append((header, data, None, None))
+        return AstroFaker._assemble(phu, extensions,
+                                    filename=os.path.basename(path))
+
+    @staticmethod
+    def _assemble(phu, extensions=(), filename=None, wcs=True):
+        """
+        Construct an AstroFaker<Instrument> object from a PHU and existing
+        pixel planes, without copying the arrays. The gWCS of each extension
+        is constructed from its header unless wcs is False.
+
+        Parameters
+        ----------
+        phu: Header
+            primary header (which determines the class of the object)
+        extensions: iterable
+            (header, data, variance, mask) tuples describing each extension;
+            variance and mask may be None
+        filename: str/None
+            filename to give to the object
+        wcs: bool
+            construct the gWCS objects?
+        """
+        ad = astrodata.create(phu)
+        for header, data, variance, mask in extensions:
+            ad.append(data, header=header)
+            ext = ad[-1]
+            if variance is not None:
+                ext.variance = variance
+            if mask is not None:
+                ext.mask = mask
+            if wcs:
+                ext.wcs = adwcs.fitswcs_to_gwcs(ext.hdr)
+        if filename is not None:
+            ad.filename = filename
+        return ad
+
     @abc.abstractmethod
     def _add_required_phu_keywords(self, mode):
         """
@@ -297,6 +633,68 @@ class AstroFaker(with_metaclass(abc.ABCMeta, object)):
         for ext in self:
             ext.wcs = astrodata.wcs.fitswcs_to_gwcs(ext.hdr)
 
+    @sliceonly
+    def _fast_transform(self):
+        """
+        Return the FastTransform for this extension, which is cached until
+        the header is changed (e.g., by sky_offset() or rotate())
+        """
+        state = (_header_state(self.hdr), self.data.shape,
+                 self.fast_wcs_tolerance)
+        try:
+            cached_state, transform = self.nddata.meta['_fast_transform']
+        except KeyError:
+            pass
+        else:
+            if cached_state == state and None not in state:
+                return transform
+        transform = fastwcs.FastTransform(self.hdr, self.data.shape,
+                                          tolerance=self.fast_wcs_tolerance)
+        self.nddata.meta['_fast_transform'] = (state, transform)
+        return transform
+
+    @sliceonly
+    def world2pix(self, ra, dec):
+        """
+        Convert celestial coordinates to 0-indexed pixel coordinates using
+        the FITS WCS in the header, or a polynomial approximation to it if
+        the fast_wcs attribute is True.
+
+        Parameters
+        ----------
+        ra, dec: float/array
+            celestial coordinates (degrees)
+
+        Returns
+        -------
+        x, y: float/array
+            pixel coordinates
+        """
+        if self.fast_wcs:
+            return self._fast_transform().world2pix(ra, dec)
+        return tuple(WCS(self.hdr).all_world2pix(ra, dec, 0))
+
+    @sliceonly
+    def pix2world(self, x, y):
+        """
+        Convert 0-indexed pixel coordinates to celestial coordinates using
+        the FITS WCS in the header, or a polynomial approximation to it if
+        the fast_wcs attribute is True.
+
+        Parameters
+        ----------
+        x, y: float/array
+            pixel coordinates
+
+        Returns
+        -------
+        ra, dec: float/array
+            celestial coordinates (degrees)
+        """
+        if self.fast_wcs:
+            return self._fast_transform().pix2world(x, y)
+        return tuple(WCS(self.hdr).all_pix2world(x, y, 0))
+
     ########################## SEEING DEFINITION ############################
     @property
     def seeing(self):
@@ -315,7 +713,8 @@ class AstroFaker(with_metaclass(abc.ABCMeta, object)):
     ##################### DATA INITIALIZATION METHODS #######################
     @noslice
     def add_extension(self, data=None, shape=None, dtype=np.float32,
-                      pixel_scale=None, flip=False, extra_keywords={}):
+                      pixel_scale=None, flip=False, extra_keywords={},
+                      variance=False):
         """
         Add an extension to the existing AD, with some basic header keywords.
 
@@ -334,6 +733,9 @@ class AstroFaker(with_metaclass(abc.ABCMeta, object)):
             if True, flip the WCS (so East is to the right if North is up)
         extra_keywords: dict
             extra keywords to put in this extension's Header
+        variance: bool
+            add (zero-filled) VAR and DQ planes, which the noise methods can
+            keep up to date?
         """
         # If no shape is provided, use the first extension's shape
         if data is None:
@@ -341,47 +743,104 @@ class AstroFaker(with_metaclass(abc.ABCMeta, object)):
                 shape = self[0].nddata.shape
             elif shape is None:
                 raise ValueError("Must specify a shape if data is None")
-            self.append(np.zeros(shape, dtype=dtype))
+            data = _zeros(shape, dtype, self.allocate_pixels)
         else:
-            self.append(data)
             shape = data.shape
-        extver = len(self)
+        extver = len(self) + 1
+
+        # The keywords are collected first and the Header is constructed in
+        # one go, since each update of an astropy Header is slow
         shape_fmt_str = '['+','.join(['1:{}'] * len(shape))+']'
         shape_value = shape_fmt_str.format(*shape[::-1])
-        self[-1].hdr.update({'EXTNAME': 'SCI',
-                             'EXTVER': extver,
-                             'BUNIT': 'adu',
-                             self._keyword_for('data_section'): shape_value,
-                             self._keyword_for('detector_section'): shape_value,
-                             self._keyword_for('array_section'): shape_value})
-        self[-1].hdr.update(extra_keywords)
+        keywords = {'EXTNAME': 'SCI',
+                    'EXTVER': extver,
+                    'BUNIT': 'adu',
+                    self._keyword_for('data_section'): shape_value,
+                    self._keyword_for('detector_section'): shape_value,
+                    self._keyword_for('array_section'): shape_value}
+        keywords.update(extra_keywords)
 
         # For instruments with multiple extensions, the relationship between
         # the WCS keywords on the extenstions has to be handled at the
         # instrument level. Here we just deal with the case of creating the
         # first extension and put the fiducial point in the middle.
-        if len(self) == 1 and 'IMAGE' in self.tags and 'RA' in self.phu and 'DEC' in self.phu:
-            self[-1].hdr.update({'CRVAL1': self.phu['RA'],
-                                 'CRVAL2': self.phu['DEC'],
-                                 'CTYPE1': 'RA---TAN',
-                                 'CTYPE2': 'DEC--TAN',
-                                 'CRPIX1': 0.5 * (shape[-1] + 1),
-                                 'CRPIX2': 0.5 * (shape[-2] + 1)})
+        if extver == 1 and 'IMAGE' in self.tags and 'RA' in self.phu and 'DEC' in self.phu:
+            keywords.update({'CRVAL1': self.phu['RA'],
+                             'CRVAL2': self.phu['DEC'],
+                             'CTYPE1': 'RA---TAN',
+                             'CTYPE2': 'DEC--TAN',
+                             'CRPIX1': 0.5 * (shape[-1] + 1),
+                             'CRPIX2': 0.5 * (shape[-2] + 1)})
+        if pixel_scale is not None:
+            keywords.update(self._cd_keywords(pixel_scale, flip))
+        self._update_extension_keywords(keywords, shape)
+        self.append(data, header=Header(
+            [(k,) + v if isinstance(v, tuple) else (k, v)
+             for k, v in keywords.items()]))
+
+        if variance:
+            self[-1].variance = _zeros(shape, np.float32, self.allocate_pixels)
+            self[-1].mask = _zeros(shape, defects.datatype,
+                                   self.allocate_pixels)
+        # The descriptor may need the new extension to exist
         if pixel_scale is None:
             pixel_scale = self.pixel_scale()
-        pa = self.phu.get('PA', 0)
-        if pixel_scale is not None and 'IMAGE' in self.tags:
-            cd_matrix = models.Rotation2D(angle=pa)(
-                *np.array([[pixel_scale if flip else -pixel_scale, 0],
-                           [0, pixel_scale]]) / 3600.0)
-            self[-1].hdr.update({'CD{}_{}'.format(i + 1, j + 1): cd_matrix[i][j]
-                                 for i in (0, 1) for j in (0, 1)})
+            if pixel_scale is not None:
+                self[-1].hdr.update(self._cd_keywords(pixel_scale, flip))
         self[-1].wcs = adwcs.fitswcs_to_gwcs(self[-1].hdr)
 
+    def _cd_keywords(self, pixel_scale, flip=False):
+        """
+        Return the CD matrix keywords for an image with the given pixel
+        scale (in arcseconds) at the position angle in the PHU, or an empty
+        dict if this is not an image.
+        """
+        if 'IMAGE' not in self.tags:
+            return {}
+        pa = self.phu.get('PA', 0)
+        cd_matrix = models.Rotation2D(angle=pa)(
+            *np.array([[pixel_scale if flip else -pixel_scale, 0],
+                       [0, pixel_scale]]) / 3600.0)
+        return {'CD{}_{}'.format(i + 1, j + 1): cd_matrix[i][j]
+                for i in (0, 1) for j in (0, 1)}
+
+    def _update_extension_keywords(self, keywords, shape):
+        """
+        Modify (in place) the dict of keywords from which add_extension()
+        constructs the header of a new extension. Subclasses can override
+        this to add or remove instrument-specific keywords.
+
+        Parameters
+        ----------
+        keywords: dict
+            the keywords
+        shape: tuple
+            shape of the .data plane
+        """
+        pass
+
     @abc.abstractmethod
     def init_default_extensions(self):
         pass
 
+    @staticmethod
+    def _scaled(scale, *sizes):
+        """
+        Return detector dimensions shrunk by a factor of scale, for making
+        miniature versions of an instrument (the pixel scale should be
+        increased by the same factor to preserve the sky coverage)
+
+        Parameters
+        ----------
+        scale: int
+            factor by which to shrink the detector
+        sizes: ints
+            full-size dimensions, which must be divisible by scale
+        """
+        if int(scale) != scale or scale < 1 or any(size % scale for size in sizes):
+            raise ValueError("Invalid scale {}".format(scale))
+        return tuple(size // int(scale) for size in sizes)
+
     ######################## HEADER FAKING METHODS ##########################
     @noslice
     def sky_offset(self, ra_offset, dec_offset):
@@ -409,8 +868,9 @@ class AstroFaker(with_metaclass(abc.ABCMeta, object)):
         self.phu['QOFFSET'] += qoffset
 
         # WCS matrix
+        cosdec = cosd(self.dec())
         for ext in self:
-            ext.hdr['CRVAL1'] += ra_offset / (3600. * cosd(self.dec()))
+            ext.hdr['CRVAL1'] += ra_offset / (3600. * cosdec)
             ext.hdr['CRVAL2'] += dec_offset / 3600.
             ext.wcs = adwcs.fitswcs_to_gwcs(ext.hdr)
 
@@ -482,39 +942,455 @@ class AstroFaker(with_metaclass(abc.ABCMeta, object)):
         dtype = self.data.dtype
         self.reset(data=np.zeros(shape, dtype=dtype), mask=None, variance=None)
 
+    @noslice
+    def rebin(self, xbin, ybin=None, average=False):
+        """
+        Bin the pixels of every extension further, as if the detector had
+        been read out with a coarser binning, so that binned and unbinned
+        versions of the same scene can be made without rendering it twice.
+        The pixels of each block are summed (or averaged) in the SCI and VAR
+        planes and combined with a bitwise OR in the DQ plane. Incomplete
+        blocks at the ends of each axis are discarded.
+
+        The CCDSUM keyword, the data and overscan sections (in binned
+        pixels), the detector and array sections (in unbinned pixels), and
+        the CRPIXi and CD matrix are updated, and a descriptor override of
+        the pixel scale is multiplied by sqrt(xbin * ybin). The data and
+        overscan sections must start and end at block boundaries.
+
+        Since the values are summed, this should be done before noise is
+        added or the data are converted to raw ADU (which would sum the
+        noise and bias level of each pixel).
+
+        Parameters
+        ----------
+        xbin: int
+            binning factor along the x (column) axis
+        ybin: int/None
+            binning factor along the y (row) axis (if None, same as xbin)
+        average: bool
+            average the pixels of each block, rather than summing them?
+        """
+        if ybin is None:
+            ybin = xbin
+        if int(xbin) != xbin or int(ybin) != ybin or xbin < 1 or ybin < 1:
+            raise ValueError("Invalid binning {}x{}".format(xbin, ybin))
+        xbin, ybin = int(xbin), int(ybin)
+        npix = xbin * ybin
+
+        sections = {}
+        for desc in ('data_section', 'overscan_section', 'detector_section',
+                     'array_section'):
+            try:
+                sections[desc] = self._keyword_for(desc)
+            except AttributeError:  # not defined for this instrument
+                pass
+
+        # Calculate all the new headers first, so nothing is changed if
+        # any extension cannot be rebinned
+        updates = []
+        for ext in self:
+            ny, nx = ext.data.shape[-2] // ybin, ext.data.shape[-1] // xbin
+            old_xbin, old_ybin = ext._binning()
+            keywords = {}
+            if 'CCDSUM' in ext.hdr:
+                keywords['CCDSUM'] = '{} {}'.format(old_xbin * xbin,
+                                                    old_ybin * ybin)
+            lost = (0, 0)
+            for desc in ('data_section', 'overscan_section'):
+                keyword = sections.get(desc)
+                if keyword is None or keyword not in ext.hdr:
+                    continue
+                x1, x2, y1, y2 = _parse_section(ext.hdr[keyword])
+                new = []
+                for start, end, nbin, length in ((x1, x2, xbin, nx),
+                                                 (y1, y2, ybin, ny)):
+                    if (start - 1) % nbin or (end % nbin and
+                                              end <= length * nbin):
+                        raise ValueError("{} {} does not align with {}x{} "
+                                         "binning".format(keyword,
+                                                          ext.hdr[keyword],
+                                                          xbin, ybin))
+                    new += [(start - 1) // nbin + 1, min(end // nbin, length)]
+                keywords[keyword] = _format_section(*new)
+                if desc == 'data_section':
+                    # Unbinned pixels of the data section that are discarded
+                    lost = ((x2 - x1 + 1 - (new[1] - new[0] + 1) * xbin) *
+                            old_xbin,
+                            (y2 - y1 + 1 - (new[3] - new[2] + 1) * ybin) *
+                            old_ybin)
+            for desc in ('detector_section', 'array_section'):
+                keyword = sections.get(desc)
+                if keyword is not None and keyword in ext.hdr and any(lost):
+                    x1, x2, y1, y2 = _parse_section(ext.hdr[keyword])
+                    keywords[keyword] = _format_section(x1, x2 - lost[0],
+                                                        y1, y2 - lost[1])
+            # Pixel p of the old grid is at (p - 0.5) / nbin + 0.5
+            for axis, nbin in ((1, xbin), (2, ybin)):
+                crpix = 'CRPIX{}'.format(axis)
+                if crpix in ext.hdr:
+                    keywords[crpix] = (ext.hdr[crpix] - 0.5) / nbin + 0.5
+                for i in (1, 2):
+                    cd = 'CD{}_{}'.format(i, axis)
+                    if cd in ext.hdr:
+                        keywords[cd] = ext.hdr[cd] * nbin
+            updates.append(keywords)
+
+        for ext, keywords in zip(self, updates):
+            dtype = ext.data.dtype
+            data = kernels.block_reduce(ext.data, xbin, ybin, dtype=np.float64)
+            variance = (None if ext.variance is None else
+                        kernels.block_reduce(ext.variance, xbin, ybin,
+                                             dtype=np.float64))
+            if average:
+                data /= npix
+                if variance is not None:
+                    variance /= npix * npix
+            if np.issubdtype(dtype, np.integer):
+                data = kernels.quantize(data, dtype=dtype)
+            else:
+                data = data.astype(dtype)
+            ext.reset(data=data,
+                      variance=(None if variance is None else
+                                variance.astype(ext.variance.dtype)),
+                      mask=(None if ext.mask is None else
+                            kernels.block_reduce(ext.mask, xbin, ybin,
+                                                 np.bitwise_or)))
+            ext.hdr.update(keywords)
+            ext.wcs = adwcs.fitswcs_to_gwcs(ext.hdr)
+
+        pixel_scale = self._descriptor_dict.get('pixel_scale')
+        if pixel_scale is not None and not callable(pixel_scale):
+            factor = np.sqrt(npix)
+            self.pixel_scale = ([value * factor for value in pixel_scale]
+                                if isinstance(pixel_scale, list) else
+                                pixel_scale * factor)
+
+    @sliceonly
+    def _variance_plane(self):
+        """Return the .variance plane, creating it if necessary"""
+        if self.variance is None:
+            self.variance = np.zeros(self.data.shape, dtype=np.float32)
+        return self.variance
+
+    @sliceonly
+    def _flag_levels(self, saturation_level=None):
+        """
+        Set the saturated and non_linear DQ bits for pixels at or above the
+        levels given by the descriptors (or the saturation level given),
+        creating the mask if necessary
+        """
+        if self.mask is None:
+            self.mask = np.zeros(self.data.shape, dtype=defects.datatype)
+        if saturation_level is None:
+            saturation_level = self.saturation_level()
+        defects.flag_levels(self.data, self.mask,
+                            saturation_level=saturation_level,
+                            non_linear_level=self.non_linear_level())
+
     @sliceable
-    def add_poisson_noise(self, scale=1.0):
+    def add_poisson_noise(self, scale=1.0, update_variance=False,
+                          chunk_rows=None):
         """
         Add Poisson-like noise (Normal distribution is used) to pixel data.
-        This does not affect the .variance plane.
+        By default, this does not affect the .variance plane.
 
         Parameters
         ----------
         scale: float
             Factor by which to scale the calculated noise
+        update_variance: bool
+            Add the variance of the noise to the .variance plane (which is
+            computed from the same intermediate values as the noise), and
+            flag saturated and non-linear pixels in the .mask plane?
+        chunk_rows: int/None
+            If not None, draw the random numbers for this many rows at a
+            time, to limit the size of the temporary arrays (floating-point
+            data only). The noise is the same.
         """
-        noise = (scale * np.sqrt(np.where(self.data > 0, self.data, 0)) *
-                 np.random.randn(*self.data.shape))
         if self.hdr.get('BUNIT', 'ADU').upper() == 'ADU':
-            noise /= np.sqrt(self.gain())
-        self.add(noise)
+            scale /= np.sqrt(self.gain())
+        variance = self._variance_plane() if update_variance else None
+        if np.issubdtype(self.data.dtype, np.floating):
+            for data, var in _row_blocks(self.data, variance, chunk_rows):
+                z = np.random.randn(*data.shape)
+                kernels.add_poisson_noise(data, scale, z, variance=var)
+        else:
+            z = np.random.randn(*self.data.shape)
+            counts = np.where(self.data > 0, self.data, 0)
+            if variance is not None:
+                variance += scale * scale * counts
+            self.add(scale * np.sqrt(counts) * z)
+        if update_variance:
+            self._flag_levels()
 
     @sliceable
-    def add_read_noise(self, scale=1.0):
+    def add_read_noise(self, scale=1.0, update_variance=False,
+                       chunk_rows=None):
         """
-        Add read noise (Normal distribution is used) to pixel data. This
-        does not affect the .variance plane.
+        Add read noise (Normal distribution is used) to pixel data. By
+        default, this does not affect the .variance plane.
 
         Parameters
         ----------
         scale: float
             Factor by which to scale the calculated noise
+        update_variance: bool
+            Add the variance of the noise to the .variance plane, and flag
+            saturated and non-linear pixels in the .mask plane?
+        chunk_rows: int/None
+            If not None, draw the random numbers for this many rows at a
+            time, to limit the size of the temporary arrays (floating-point
+            data only). The noise is the same.
+        """
+        sigma = scale * self.read_noise()
+        if self.hdr.get('BUNIT', 'ADU').upper() == 'ADU':
+            sigma /= self.gain()
+        variance = self._variance_plane() if update_variance else None
+        if np.issubdtype(self.data.dtype, np.floating):
+            for data, var in _row_blocks(self.data, variance, chunk_rows):
+                z = np.random.randn(*data.shape).astype(np.float32)
+                kernels.add_read_noise(data, sigma, z, variance=var)
+        else:
+            z = np.random.randn(*self.data.shape).astype(np.float32)
+            self.add(sigma * z)
+            if variance is not None:
+                variance += sigma * sigma
+        if update_variance:
+            self._flag_levels()
+
+    @sliceable
+    def make_working_buffer(self):
         """
-        noise = (scale * self.read_noise() *
-                 np.random.randn(*self.data.shape).astype(np.float32))
+        Replace the .data plane with a float32 working buffer in electrons,
+        so that pixel values can be added in place (rather than by
+        AstroData arithmetic on an integer array). The quantize() method
+        converts the buffer back to raw ADU. The buffer takes twice the
+        memory of a raw uint16 plane, so a peak of 1.5 times the raw frame
+        is not attainable while the whole plane is held as float32.
+        """
+        data = self.data.astype(np.float32)
         if self.hdr.get('BUNIT', 'ADU').upper() == 'ADU':
-            noise /= self.gain()
-        self.add(noise)
+            data *= self.gain()
+            if self.variance is not None:
+                self.variance *= self.gain() ** 2
+            self.hdr['BUNIT'] = 'electron'
+        self.data = data
+
+    @sliceable
+    def quantize(self, bias_level=0., nonlinearity=None, saturation_level=None,
+                 dtype=np.uint16, chunk_rows=kernels.QUANTIZE_CHUNK_ROWS,
+                 update_mask=False):
+        """
+        Convert the .data plane to raw integer ADU. The conversion from
+        electrons, addition of the bias level, non-linearity, saturation,
+        and rounding are performed in a single pass over chunks of rows,
+        so the only full-size array created is the output. For a float32
+        working buffer and uint16 output, the peak memory is about three
+        times that of the raw frame (buffer plus output) until the buffer
+        is released when the output replaces it.
+
+        Parameters
+        ----------
+        bias_level: float
+            bias level to add to every pixel (ADU)
+        nonlinearity: callable/None
+            function that takes an array of (bias-subtracted) ADU values and
+            returns the values actually recorded
+        saturation_level: float/None
+            maximum raw value (if None, use the saturation_level descriptor)
+        dtype: integer datatype
+            datatype of the raw data
+        chunk_rows: int
+            number of rows to convert at a time
+        update_mask: bool
+            set the saturated and non_linear bits of the DQ plane?
+        """
+        scale = 1.
+        if self.hdr.get('BUNIT', 'ADU').upper() != 'ADU':
+            scale /= self.gain()
+        if saturation_level is None:
+            saturation_level = self.saturation_level()
+        data = kernels.quantize(self.data, dtype=dtype, scale=scale,
+                                offset=bias_level, nonlinearity=nonlinearity,
+                                saturation=saturation_level,
+                                chunk_rows=chunk_rows)
+        if self.variance is not None:
+            self.variance *= scale * scale
+        self.data = data
+        self.hdr['BUNIT'] = 'adu'
+        if update_mask:
+            # Flag the pixels at the level to which they were clipped
+            info = np.iinfo(dtype)
+            self._flag_levels(saturation_level=(
+                info.max if saturation_level is None else
+                min(saturation_level, info.max)))
+
+    @noslice
+    def freeze(self, poisson_scale=1.0, read_noise_scale=1.0):
+        """
+        Return a frozen copy of this (noiseless) object, from which many
+        noisy realisations can be made without re-rendering it.
+
+        Parameters
+        ----------
+        poisson_scale: float
+            factor by which to scale the Poisson noise
+        read_noise_scale: float
+            factor by which to scale the read noise
+
+        Returns
+        -------
+        NoiselessModel
+        """
+        from .realizations import NoiselessModel
+        return NoiselessModel(self, poisson_scale=poisson_scale,
+                              read_noise_scale=read_noise_scale)
+
+    @sliceonly
+    def _render(self, render):
+        """
+        Add pixel values to the .data plane. This is done in place if the
+        data are floating-point, to avoid creating a full-frame temporary.
+        Otherwise, the values are rendered into a full-frame array which is
+        added using AstroData arithmetic, as add_object() does.
+
+        Parameters
+        ----------
+        render: callable
+            function that adds values in place to the array it is given,
+            which has the shape of the .data plane
+        """
+        if np.issubdtype(self.data.dtype, np.floating):
+            render(self.data)
+        else:
+            obj_data = np.zeros(self.data.shape, dtype=np.float32)
+            render(obj_data)
+            self.add(obj_data)
+
+    @sliceonly
+    def _add_stamp(self, stamp, slices):
+        """
+        Add a small array to a region of the .data plane (of every plane,
+        if the data have more than two dimensions).
+
+        Parameters
+        ----------
+        stamp: array
+            values to add
+        slices: tuple of slices
+            region of the last two axes of the .data plane to which stamp
+            corresponds
+        """
+        def render(data):
+            data[(Ellipsis,) + tuple(slices)] += stamp
+
+        self._render(render)
+
+    @noslice
+    def _mosaic_offsets(self):
+        """
+        Return, for each extension, the (x, y) offset of its pixel grid in
+        the focal-plane frame, which is the (0-indexed) pixel frame of the
+        first extension extended across the whole mosaic: a point at (X, Y)
+        in this frame lies at (X-dx, Y-dy) on the extension. The offsets are
+        determined from the WCS, and replaced by the exact offsets implied
+        by the detector sections if these agree (i.e., for amplifiers on the
+        same CCD but not across chip gaps). The offset is None for an
+        extension whose WCS is not a translation of that of the first
+        extension. The offsets are cached until a header, or an override of
+        one of the MOSAIC_DESCRIPTORS, is changed.
+        """
+        nddatas = self.nddata
+        # Only overrides of the descriptors used here affect the offsets
+        overrides = [self._descriptor_dict.get(name) for name in
+                     MOSAIC_DESCRIPTORS]
+        state = (tuple([_header_state(self.phu)] +
+                       [_header_state(nd.meta['header']) for nd in nddatas]),
+                 tuple(nd.shape for nd in nddatas),
+                 tuple(repr(value) for value in overrides))
+        cacheable = (self.cache_descriptors and None not in state[0] and
+                     not any(callable(value) for value in overrides))
+        if (cacheable and self._mosaic_cache is not None and
+                self._mosaic_cache[0] == state):
+            return self._mosaic_cache[1]
+
+        ref_wcs = WCS(self[0].hdr)
+        ref_datsec, ref_detsec = self[0].data_section(), self[0].detector_section()
+        offsets = []
+        for ext in self:
+            ny, nx = ext.data.shape[-2:]
+            x = np.array([0, nx - 1, 0, nx - 1, 0.5 * (nx - 1)])
+            y = np.array([0, 0, ny - 1, ny - 1, 0.5 * (ny - 1)])
+            xref, yref = ref_wcs.all_world2pix(
+                *WCS(ext.hdr).all_pix2world(x, y, 0), 0)
+            dx, dy = xref - x, yref - y
+            if max(np.ptp(dx), np.ptp(dy)) > MOSAIC_TOLERANCE:
+                offsets.append(None)
+                continue
+            offset = (dx.mean(), dy.mean())
+            datsec, detsec = ext.data_section(), ext.detector_section()
+            if ref_datsec and ref_detsec and datsec and detsec:
+                xbin, ybin = ext._binning()
+                detector_offset = (
+                    ref_datsec[0] - datsec[0] + (detsec[0] - ref_detsec[0]) // xbin,
+                    ref_datsec[2] - datsec[2] + (detsec[2] - ref_detsec[2]) // ybin)
+                if all(abs(a - b) <= MOSAIC_TOLERANCE
+                       for a, b in zip(offset, detector_offset)):
+                    offset = detector_offset
+            offsets.append(tuple(float(a) for a in offset))
+
+        if cacheable:
+            self._mosaic_cache = (state, offsets)
+        return offsets
+
+    @noslice
+    def _render_mosaic(self, x, y, radius, render):
+        """
+        Add a source to every extension that its footprint overlaps,
+        including sources that straddle amplifier boundaries or lie in chip
+        gaps. The source is rendered only once for all the extensions that
+        share a pixel grid (e.g., the amplifiers of a CCD) and the stamp is
+        split between them.
+
+        Parameters
+        ----------
+        x, y: float
+            location of the centre of the source in the focal-plane frame
+            (see _mosaic_offsets())
+        radius: float
+            distance from the centre (pixels) beyond which the source is
+            negligible
+        render: callable
+            function that takes a shape and the location of the centre of
+            the source relative to the first pixel, and returns a stamp of
+            that shape
+        """
+        stamps = {}
+        for index, (ext, offset) in enumerate(zip(self,
+                                                  self._mosaic_offsets())):
+            if offset is None:
+                xext, yext = [float(a) for a in ext.world2pix(
+                    *self[0].pix2world(x, y))]
+            else:
+                xext, yext = x - offset[0], y - offset[1]
+            shape = ext.data.shape[-2:]
+            slices = kernels._bounding_slices(shape, xext, yext, radius)
+            if slices is None:
+                continue
+            # The full footprint, on the extension's pixel grid
+            ix1, iy1 = int(np.floor(xext - radius)), int(np.floor(yext - radius))
+            nx = int(np.ceil(xext + radius)) + 1 - ix1
+            ny = int(np.ceil(yext + radius)) + 1 - iy1
+            # Extensions share a stamp if their grids coincide in the frame
+            key = (index if offset is None else
+                   (round(ix1 + offset[0], 6), round(iy1 + offset[1], 6)))
+            if key not in stamps:
+                stamps[key] = render((ny, nx), xext - ix1, yext - iy1)
+            stamp = stamps[key]
+            ext._add_stamp(stamp[slices[0].start - iy1:slices[0].stop - iy1,
+                                 slices[1].start - ix1:slices[1].stop - ix1],
+                           slices)
 
     @sliceonly
     def add_object(self, obj):
@@ -531,11 +1407,11 @@ class AstroFaker(with_metaclass(abc.ABCMeta, object)):
         self.add(obj_data)
 
     @convert_rd2xy
-    @sliceonly
     def add_star(self, amplitude=None, flux=None, fwhm=None, x=None, y=None):
         """
-        Add a star (Gaussian2D object) at the specified location.
-        Decorated by convert_rd2xy so (ra,dec) can be given.
+        Add a star (Gaussian2D object) at the specified location. If called
+        on an unsliced object, the star is added to every extension that it
+        overlaps. Decorated by convert_rd2xy so (ra,dec) can be given.
 
         Parameters
         ----------
@@ -546,25 +1422,17 @@ class AstroFaker(with_metaclass(abc.ABCMeta, object)):
         fwhm: float/None
             FWHM in arcseconds (if None, use seeing attribute)
         x, y: float
-            location of centre of star in pixels [0-indexed]
+            location of centre of star in pixels [0-indexed], in the
+            focal-plane frame if called on an unsliced object
             (Decorated by @convert_rd2xy so ra, dec can be specified)
         """
-        sigma = 0.42466 * (fwhm or self.seeing) / self.pixel_scale()
-        if amplitude is None:
-            if flux is None:
-                raise ValueError("Need to specify amplitude or flux")
-            else:
-                amplitude = flux / (2 * np.pi * sigma * sigma)
-        obj = models.Gaussian2D(amplitude=amplitude, x_mean=x, y_mean=y,
-                                x_stddev=sigma, y_stddev=sigma)
-        self.add_object(obj)
+        self.add_stars(amplitude=amplitude, flux=flux, fwhm=fwhm, x=x, y=y)
 
-    @sliceonly
     def add_stars(self, amplitude=None, flux=None, fwhm=None, x=0, y=0,
                   n_models=1):
         """
         Add multiple stars (Gaussian2D) at the specified locations. Same as
-        add_star but using model set for better performance.
+        add_star but renders all the stars in a single call.
 
         Parameters
         ----------
@@ -575,47 +1443,47 @@ class AstroFaker(with_metaclass(abc.ABCMeta, object)):
         fwhm: float or list of float, optional
             FWHM in arcseconds (if None, use seeing attribute)
         x, y: float or list of float, optional
-            Location of centre of star in pixels [0-indexed]
+            Location of centre of star in pixels [0-indexed], in the
+            focal-plane frame if called on an unsliced object
         n_models : int
             The number of stars.
 
         """
-        sigma = 0.42466 * (fwhm or self.seeing) / self.pixel_scale()
+        sigma = 0.42466 * (fwhm or self.seeing) / _single(self.pixel_scale())
         if amplitude is None:
             if flux is None:
                 raise ValueError("Need to specify amplitude or flux")
             else:
                 amplitude = flux / (2 * np.pi * sigma * sigma)
 
-        def _ensure_list(param):
-            if isinstance(param, list):
-                return param
-            elif isinstance(param, np.ndarray):
-                return list(param)
-            else:
-                return [param] * n_models
-
-        x = _ensure_list(x)
-        y = _ensure_list(y)
-        sigma = _ensure_list(sigma)
-        amplitude = _ensure_list(amplitude)
-        theta = [0] * n_models
+        # kernels.add_gaussians() broadcasts its arguments, so there's no
+        # need to construct lists of parameters as a model set requires
+        x, y, amplitude, sigma = [np.broadcast_to(param, (n_models,))
+                                  for param in (x, y, amplitude, sigma)]
+        if self.is_single:
+            self._render(lambda data: kernels.add_gaussians(
+                data, x, y, amplitude, sigma))
+            return
 
-        obj = models.Gaussian2D(amplitude=amplitude, x_mean=x, y_mean=y,
-                                x_stddev=sigma, y_stddev=sigma, theta=theta,
-                                n_models=n_models)
+        for xstar, ystar, amp, sig in zip(x, y, amplitude, sigma):
+            def render(shape, xc, yc, amp=amp, sig=sig):
+                stamp = np.zeros(shape)
+                kernels.add_gaussians(stamp, xc, yc, amp, sig)
+                return stamp
 
-        ygrid, xgrid = np.mgrid[:self.data.shape[-2], :self.data.shape[-1]]
-        obj_data = obj(xgrid, ygrid, model_set_axis=False).astype(np.float32)
-        self.add(obj_data.sum(axis=0))
+            self._render_mosaic(xstar, ystar,
+                                kernels.GAUSSIAN_TRUNCATION * sig, render)
 
     @convert_rd2xy
-    @sliceonly
     def add_galaxy(self, amplitude=None, n=4.0, r_e=1.0, axis_ratio=1.0,
                    pa=0.0, x=None, y=None):
         """
         Adds a Sersic profile galaxy, convolved with the seeing, at the
-        specified location.
+        specified location. The profile is rendered from a cached table
+        (see kernels.sersic_table) only in the region of the image where
+        it is non-negligible, and only that region is convolved. If called
+        on an unsliced object, the galaxy is added to every extension that
+        it overlaps.
 
         Parameters
         ----------
@@ -630,15 +1498,473 @@ class AstroFaker(with_metaclass(abc.ABCMeta, object)):
         pa: float
             position angle of major axis
         x, y: float [0-indexed]
-            location of centre of star in pixels
+            location of centre of star in pixels, in the focal-plane frame
+            if called on an unsliced object
             (Decorated by @convert_rd2xy so ra, dec can be specified)
         """
-        obj = ((models.Shift(-x) & models.Shift(-y)) |
-               models.Rotation2D(self.phu.get('PA', 0) - pa) |
-               (models.Scale(axis_ratio) & models.Identity(1)) |
-               Sersic(amplitude=amplitude, r_e=r_e / self.pixel_scale(), n=n))
-        ygrid, xgrid = np.mgrid[:self.data.shape[-2], :self.data.shape[-1]]
-        obj_data = obj(xgrid, ygrid)
-        sigma = 0.42466 * self.seeing / self.pixel_scale()
-        convolved_data = gaussian_filter(obj_data, sigma=sigma, mode='constant')
-        self.add(convolved_data)
+        if amplitude is None:
+            raise ValueError("Need to specify amplitude")
+        pixel_scale = _single(self.pixel_scale())
+        sigma = 0.42466 * self.seeing / pixel_scale
+        # Pad the stamp by the radius of gaussian_filter's kernel so that the
+        # convolution is identical to that of the full frame
+        border = int(4 * sigma + 0.5)
+        sersic_args = dict(amplitude=amplitude, r_e=r_e / pixel_scale, n=n,
+                           axis_ratio=axis_ratio,
+                           angle=self.phu.get('PA', 0) - pa, border=border)
+        if self.is_single:
+            stamp, slices = kernels.sersic_stamp(self.data.shape[-2:], x, y,
+                                                 **sersic_args)
+            if stamp is not None:
+                self._add_stamp(gaussian_filter(stamp, sigma=sigma,
+                                                mode='constant'), slices)
+            return
+
+        def render(shape, xc, yc):
+            stamp, _ = kernels.sersic_stamp(shape, xc, yc, **sersic_args)
+            return gaussian_filter(stamp, sigma=sigma, mode='constant')
+
+        radius = kernels.sersic_radius(r_e / pixel_scale, n=n,
+                                       axis_ratio=axis_ratio) + border
+        self._render_mosaic(x, y, radius, render)
+
+    def add_sky(self, level=0., gradient=(0., 0.), vignetting=0., model=None,
+                fringe=None, fringe_scale=1., grid_step=kernels.SKY_GRID_STEP):
+        """
+        Add a smooth sky background to the data sections. The smooth
+        components are evaluated on a coarse grid of points and interpolated
+        bilinearly to every pixel (see kernels.add_upsampled()), so their
+        cost hardly depends on the size of the detector. If called on an
+        unsliced object, the background is continuous across the extensions
+        in the focal-plane frame (see add_star()).
+
+        Parameters
+        ----------
+        level: float
+            counts per pixel at the centre of the field
+        gradient: 2-tuple
+            change in the level per pixel along the x and y axes
+        vignetting: float
+            fractional decrease of the background at the corners of the
+            field, which depends on the square of the distance from the
+            centre
+        model: callable/None
+            function of the focal-plane (x, y) coordinates returning
+            additional counts (e.g., scattered light)
+        fringe: AstroFaker/callable/None
+            fringe frame with the same number of extensions, whose data
+            planes or data sections have the same shape, or an analytic
+            model like the model parameter
+        fringe_scale: float
+            factor by which to multiply the fringe pattern
+        grid_step: float
+            maximum spacing (pixels) of the coarse grid, which must be small
+            compared to the scale of any structure in model and fringe
+        """
+        exts = [self] if self.is_single else list(self)
+        offsets = [(0., 0.)] if self.is_single else self._mosaic_offsets()
+        if not (fringe is None or callable(fringe)):
+            fringes = [fringe] if fringe.is_single else list(fringe)
+            if len(fringes) != len(exts):
+                raise ValueError("The fringe frame has {} extensions, not "
+                                 "{}".format(len(fringes), len(exts)))
+
+        # The focal-plane coordinates of the grid points on each data section
+        grids = []
+        for ext, offset in zip(exts, offsets):
+            ny, nx = ext.data.shape[-2:]
+            datsec = ext.data_section()
+            x1, x2, y1, y2 = datsec[:4] if datsec else (0, nx, 0, ny)
+            xcoarse = kernels.coarse_grid(x2 - x1, grid_step)
+            ycoarse = kernels.coarse_grid(y2 - y1, grid_step)
+            x, y = np.meshgrid(xcoarse + x1, ycoarse + y1)
+            if offset is None:
+                x, y = self[0].world2pix(*ext.pix2world(x, y))
+            else:
+                x, y = x + offset[0], y + offset[1]
+            grids.append(((slice(y1, y2), slice(x1, x2)), xcoarse, ycoarse,
+                          x, y))
+        xmin, xmax = (min(grid[3].min() for grid in grids),
+                      max(grid[3].max() for grid in grids))
+        ymin, ymax = (min(grid[4].min() for grid in grids),
+                      max(grid[4].max() for grid in grids))
+        xcentre, ycentre = 0.5 * (xmin + xmax), 0.5 * (ymin + ymax)
+        r2max = (0.25 * ((xmax - xmin) ** 2 + (ymax - ymin) ** 2)) or 1.
+
+        for ext, (slices, xcoarse, ycoarse, x, y) in zip(exts, grids):
+            dx, dy = x - xcentre, y - ycentre
+            values = ((level + gradient[0] * dx + gradient[1] * dy) *
+                      (1 - vignetting * (dx * dx + dy * dy) / r2max))
+            if model is not None:
+                values = values + model(x, y)
+            if callable(fringe):
+                values = values + fringe_scale * fringe(x, y)
+
+            def render(data, slices=slices, values=values, xcoarse=xcoarse,
+                       ycoarse=ycoarse):
+                kernels.add_upsampled(data[(Ellipsis,) + slices], values,
+                                      xcoarse, ycoarse)
+
+            ext._render(render)
+
+        if not (fringe is None or callable(fringe)):
+            for ext, fringe_ext, (slices, _, _, _, _) in zip(exts, fringes,
+                                                             grids):
+                if fringe_ext.data.shape == ext.data.shape:
+                    region = (Ellipsis,)
+                elif (fringe_ext.data.shape ==
+                      ext.data[(Ellipsis,) + slices].shape):
+                    region = (Ellipsis,) + slices
+                else:
+                    raise ValueError("The fringe frame does not match the "
+                                     "data")
+
+                def render(data, region=region, fringe_data=fringe_ext.data):
+                    data[region] += fringe_scale * fringe_data
+
+                ext._render(render)
+
+    ###################### SPECTRUM FAKING METHODS ##########################
+    def _detector_layout(self):
+        """
+        Return, for each extension, the slices of the .data plane containing
+        the data section and the detector coordinates (0-indexed, in binned
+        pixels) of the data section's pixels along the x and y axes. Chip
+        gaps are ignored, so the extensions abut on a single pixel grid.
+        """
+        layout = []
+        for ext in self:
+            ny, nx = ext.data.shape[-2:]
+            datsec = ext.data_section()
+            x1, x2, y1, y2 = datsec[:4] if datsec else (0, nx, 0, ny)
+            xbin, ybin = ext._binning()
+            detsec = ext.detector_section()
+            xdet = np.arange(x2 - x1) + (detsec[0] // xbin if detsec else 0)
+            ydet = np.arange(y2 - y1) + (detsec[2] // ybin if detsec else 0)
+            layout.append(((slice(y1, y2), slice(x1, x2)), xdet, ydet))
+        return layout
+
+    def _spectral_layout(self, dispersion_axis=None):
+        """
+        Return the dispersion axis (1 or 2, in the FITS sense) and, for each
+        extension, the slices of the .data plane containing the data section
+        and the detector coordinates of its pixels along the spatial and
+        spectral axes (see _detector_layout).
+
+        Parameters
+        ----------
+        dispersion_axis: int/None
+            dispersion axis (if None, use the descriptor value, or 1 if that
+            is not defined)
+        """
+        if dispersion_axis is None:
+            dispersion_axis = _single(self.dispersion_axis()) or 1
+        if dispersion_axis not in (1, 2):
+            raise ValueError("Dispersion axis must be 1 or 2")
+        layout = [(slices, ydet, xdet) if dispersion_axis == 1 else
+                  (slices, xdet, ydet)
+                  for slices, xdet, ydet in self._detector_layout()]
+        return dispersion_axis, layout
+
+    def _wavelength_solution(self, wavelengths, spectral):
+        """
+        Return a function that converts spectral (detector) pixel
+        coordinates to wavelengths in nm.
+
+        Parameters
+        ----------
+        wavelengths: callable/tuple/None
+            a function of spectral pixel, or (central wavelength, dispersion)
+            in nm and nm/pixel; if None, use the descriptor values
+        spectral: array
+            all the spectral pixel coordinates of the data
+        """
+        if callable(wavelengths):
+            return wavelengths
+        if wavelengths is None:
+            wavelengths = (_single(self.central_wavelength(asNanometers=True)),
+                           _single(self.dispersion(asNanometers=True)))
+        central_wavelength, dispersion = wavelengths
+        if central_wavelength is None or dispersion is None:
+            raise ValueError("Cannot determine the wavelength solution")
+        centre = 0.5 * (spectral.min() + spectral.max())
+        return lambda pixels: central_wavelength + dispersion * (pixels - centre)
+
+    def _model_spectrum(self, continuum, lines, line_fwhm, wavelengths,
+                        spectral):
+        """
+        Return a 1D spectrum (continuum plus emission lines) covering the
+        range of spectral pixel coordinates, and the first coordinate.
+        """
+        start, end = spectral.min(), spectral.max() + 1
+        solution = self._wavelength_solution(wavelengths, spectral)
+        pixels = np.arange(start, end)
+        spectrum = np.zeros(pixels.size)
+        spectrum += continuum(solution(pixels)) if callable(continuum) else continuum
+        if lines is not None and len(lines) > 0:
+            line_wavelengths, line_fluxes = np.asarray(lines, dtype=float).T
+            # Lines just beyond the ends of the spectrum contribute their wings
+            pad = int(np.ceil(kernels.GAUSSIAN_TRUNCATION * line_fwhm))
+            grid = np.arange(start - pad, end + pad)
+            grid_wavelengths = solution(grid)
+            if grid_wavelengths[-1] < grid_wavelengths[0]:
+                grid, grid_wavelengths = grid[::-1], grid_wavelengths[::-1]
+            positions = np.interp(line_wavelengths, grid_wavelengths, grid,
+                                  left=np.nan, right=np.nan)
+            good = ~np.isnan(positions)
+            spectrum += kernels.line_spectrum(
+                pixels.size, positions[good] - start, line_fluxes[good],
+                0.42466 * line_fwhm)
+        return spectrum, start
+
+    def add_spectrum(self, continuum=1000., lines=None, trace=None, fwhm=None,
+                     line_fwhm=2., wavelengths=None, dispersion_axis=None):
+        """
+        Add the spectrum of a point source along a (possibly curved) trace.
+        The spectrum is evaluated once on the detector's pixel grid and each
+        column (or row) is spread over the spatial direction with a Gaussian
+        profile. If called on an unsliced object, the spectrum continues
+        across all the extensions, which are positioned using their
+        detector sections.
+
+        Parameters
+        ----------
+        continuum: float/callable
+            total counts per pixel along the dispersion direction, or a
+            function of wavelength (nm) returning this
+        lines: array-like/None
+            (wavelength [nm], flux) of each emission line in the spectrum
+        trace: float/callable/sequence/None
+            spatial location of the trace (detector pixel, 0-indexed) as a
+            constant, a function of spectral pixel, or the coefficients
+            (lowest order first) of a polynomial in the spectral pixel
+            offset from the centre of the detector; if None, the trace runs
+            along the centre of the detector
+        fwhm: float/None
+            FWHM of the spatial profile in arcseconds (if None, use seeing)
+        line_fwhm: float
+            FWHM of the emission lines (pixels)
+        wavelengths: callable/tuple/None
+            wavelength (nm) as a function of spectral pixel, or a tuple of
+            (central wavelength [nm], dispersion [nm/pixel]); if None, use
+            the central_wavelength and dispersion descriptors
+        dispersion_axis: int/None
+            1 or 2 (if None, use the dispersion_axis descriptor)
+        """
+        dispersion_axis, layout = self._spectral_layout(dispersion_axis)
+        spatial = np.concatenate([spat for _, spat, _ in layout])
+        spectral = np.concatenate([spec for _, _, spec in layout])
+        spectrum, start = self._model_spectrum(continuum, lines, line_fwhm,
+                                               wavelengths, spectral)
+        spectral_centre = 0.5 * (spectral.min() + spectral.max())
+        if trace is None:
+            trace = 0.5 * (spatial.min() + spatial.max())
+        if not callable(trace):
+            coeffs = np.atleast_1d(trace)
+            trace = lambda pixels: np.polynomial.polynomial.polyval(
+                pixels - spectral_centre, coeffs)
+        sigma = 0.42466 * (fwhm or self.seeing) / _single(self.pixel_scale())
+
+        for ext, (slices, spat, spec) in zip(self, layout):
+            def render(data, slices=slices, spat=spat, spec=spec):
+                image = data[(Ellipsis,) + slices]
+                if dispersion_axis == 2:
+                    image = np.swapaxes(image, -1, -2)
+                kernels.add_trace(image, trace(spec) - spat[0],
+                                  spectrum[spec - start], sigma)
+
+            ext._render(render)
+
+    def add_sky_lines(self, lines, continuum=0., line_fwhm=2., wavelengths=None,
+                      dispersion_axis=None):
+        """
+        Add an emission-line spectrum (e.g., sky lines or an arc lamp) that
+        uniformly fills the slit, plus an optional continuum. If called on
+        an unsliced object, the spectrum continues across all the
+        extensions, which are positioned using their detector sections.
+
+        Parameters
+        ----------
+        lines: array-like
+            (wavelength [nm], flux per pixel along the slit) of each line
+        continuum: float/callable
+            counts per pixel, or a function of wavelength (nm) returning this
+        line_fwhm: float
+            FWHM of the emission lines (pixels)
+        wavelengths: callable/tuple/None
+            wavelength (nm) as a function of spectral pixel, or a tuple of
+            (central wavelength [nm], dispersion [nm/pixel]); if None, use
+            the central_wavelength and dispersion descriptors
+        dispersion_axis: int/None
+            1 or 2 (if None, use the dispersion_axis descriptor)
+        """
+        dispersion_axis, layout = self._spectral_layout(dispersion_axis)
+        spectral = np.concatenate([spec for _, _, spec in layout])
+        spectrum, start = self._model_spectrum(continuum, lines, line_fwhm,
+                                               wavelengths, spectral)
+
+        for ext, (slices, spat, spec) in zip(self, layout):
+            values = spectrum[spec - start]
+            if dispersion_axis == 2:
+                values = values[:, np.newaxis]
+
+            def render(data, slices=slices, values=values):
+                data[(Ellipsis,) + slices] += values
+
+            ext._render(render)
+
+    ######################### DEFECT FAKING METHODS #########################
+    @sliceonly
+    def _flag_pixels(self, iy, ix, bit):
+        """Set a DQ bit for a set of pixels, creating the mask if necessary"""
+        if self.mask is None:
+            self.mask = np.zeros(self.data.shape, dtype=defects.datatype)
+        defects.flag(self.mask, iy, ix, bit)
+
+    @sliceonly
+    def _binning(self):
+        """Return the (x, y) binning, which is 1 if not defined"""
+        return self.detector_x_bin() or 1, self.detector_y_bin() or 1
+
+    @sliceable
+    def add_cosmic_rays(self, rate=0.025, pixel_size=15., energy=1000.,
+                        max_length=20., update_mask=False):
+        """
+        Add cosmic-ray tracks to the pixel data. The number of tracks is
+        drawn from a Poisson distribution with a mean determined by the
+        rate, the exposure time, and the area of the detector. Each track
+        starts at a random location and has a random direction and a length
+        distributed uniformly between 0 and max_length.
+
+        Parameters
+        ----------
+        rate: float
+            number of events per square centimetre per second
+        pixel_size: float
+            size of an unbinned pixel (microns)
+        energy: float
+            counts deposited per unbinned pixel crossed
+        max_length: float
+            maximum length of a track (unbinned pixels)
+        update_mask: bool
+            set the cosmic_ray bit of the DQ plane for affected pixels?
+        """
+        xbin, ybin = self._binning()
+        shape = self.data.shape
+        area = shape[-2] * shape[-1] * xbin * ybin * (pixel_size * 1e-4) ** 2
+        ntracks = np.random.poisson(rate * self.exposure_time() * area)
+        x = np.random.rand(ntracks) * shape[-1] - 0.5
+        y = np.random.rand(ntracks) * shape[-2] - 0.5
+        angle = np.random.rand(ntracks) * np.pi
+        length = np.random.rand(ntracks) * max_length
+        iy, ix, track, nsamples = defects.line_pixels(
+            shape, x, y, length * np.cos(angle) / xbin,
+            length * np.sin(angle) / ybin)
+        # Share the energy of each track between its samples
+        deposit = energy * np.maximum(length, 1) / nsamples
+        defects.scatter_add(self.data, iy, ix, deposit[track])
+        if update_mask:
+            self._flag_pixels(iy, ix, defects.cosmic_ray)
+
+    @sliceable
+    def add_hot_pixels(self, fraction=1e-4, rate=10., update_mask=False):
+        """
+        Add hot pixels (with a high dark current) at random locations.
+
+        Parameters
+        ----------
+        fraction: float
+            fraction of pixels that are hot
+        rate: float
+            dark current of each hot pixel (counts per second)
+        update_mask: bool
+            set the bad_pixel bit of the DQ plane for affected pixels?
+        """
+        iy, ix = defects.random_pixels(self.data.shape,
+                                       fraction * self.data.shape[-2] *
+                                       self.data.shape[-1])
+        defects.scatter_add(self.data, iy, ix, rate * self.exposure_time())
+        if update_mask:
+            self._flag_pixels(iy, ix, defects.bad_pixel)
+
+    @sliceable
+    def add_dead_pixels(self, fraction=1e-4, response=0., update_mask=False):
+        """
+        Add dead (or insensitive) pixels at random locations.
+
+        Parameters
+        ----------
+        fraction: float
+            fraction of pixels that are dead
+        response: float
+            factor by which the values of dead pixels are multiplied
+        update_mask: bool
+            set the bad_pixel bit of the DQ plane for affected pixels?
+        """
+        iy, ix = defects.random_pixels(self.data.shape,
+                                       fraction * self.data.shape[-2] *
+                                       self.data.shape[-1])
+        defects.scatter_multiply(self.data, iy, ix, response)
+        if update_mask:
+            self._flag_pixels(iy, ix, defects.bad_pixel)
+
+    @sliceable
+    def add_bad_columns(self, columns=1, value=0., update_mask=False):
+        """
+        Set entire columns to a fixed value.
+
+        Parameters
+        ----------
+        columns: int/list
+            number of columns to choose at random, or a list of the
+            (0-indexed) columns
+        value: float
+            value of the pixels in the bad columns
+        update_mask: bool
+            set the bad_pixel bit of the DQ plane for affected pixels?
+        """
+        ny, nx = self.data.shape[-2:]
+        if isinstance(columns, (int, np.integer)):
+            columns = np.random.choice(nx, size=min(columns, nx), replace=False)
+        columns = np.asarray(columns, dtype=int)
+        iy = np.tile(np.arange(ny), columns.size)
+        ix = np.repeat(columns, ny)
+        defects.scatter_set(self.data, iy, ix, value)
+        if update_mask:
+            self._flag_pixels(iy, ix, defects.bad_pixel)
+
+    @sliceable
+    def add_saturated_trails(self, ntrails=1, length=50, level=None, x=None,
+                             y=None, update_mask=False):
+        """
+        Add saturated bleed trails, which run along columns and are centred
+        on random locations (or the locations given).
+
+        Parameters
+        ----------
+        ntrails: int
+            number of trails (ignored if x and y are given)
+        length: float/array
+            length of each trail (pixels)
+        level: float/None
+            value of the saturated pixels (if None, use the value of the
+            saturation_level descriptor)
+        x, y: float/array/None
+            (0-indexed) centres of the trails
+        update_mask: bool
+            set the saturated bit of the DQ plane for affected pixels?
+        """
+        shape = self.data.shape
+        if x is None or y is None:
+            x = np.random.rand(ntrails) * shape[-1] - 0.5
+            y = np.random.rand(ntrails) * shape[-2] - 0.5
+        x, y, length = np.broadcast_arrays(np.atleast_1d(x), y, length)
+        if level is None:
+            level = self.saturation_level()
+            if level is None:
+                level = 65535
+        iy, ix, _, _ = defects.line_pixels(shape, x, y - 0.5 * (length - 1),
+                                           0, length - 1)
+        defects.scatter_set(self.data, iy, ix, level)
+        if update_mask:
+            self._flag_pixels(iy, ix, defects.saturated)
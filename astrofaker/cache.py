@@ -0,0 +1,306 @@
+# This module provides an on-disk cache of generated datasets, so that test
+# suites which create the same fake data on every run only have to read (or
+# memory-map) FITS files after the first. Each entry is keyed by a hash of
+# the astrofaker version, the function that creates the data, and its
+# arguments, which are put in a canonical form first. Entries are written
+# atomically, concurrent processes creating the same entry are serialized
+# with file locks, and the least recently used entries are deleted when the
+# cache grows beyond a maximum size.
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, where locking is skipped
+    fcntl = None
+
+from . import __version__
+from .astrofaker import AstroFaker
+
+CACHE_DIR_ENV = 'ASTROFAKER_CACHE_DIR'
+DEFAULT_MAX_SIZE = 5 * 2 ** 30
+ENTRY_FILENAME = 'entry.json'
+# Version of the layout of an entry, which is part of every key so that
+# entries written in an older layout are never read
+ENTRY_FORMAT = 2
+
+
+def default_cache_dir():
+    """Return the directory given by $ASTROFAKER_CACHE_DIR, or the default"""
+    return os.environ.get(CACHE_DIR_ENV, os.path.join(
+        os.path.expanduser('~'), '.cache', 'astrofaker'))
+
+
+def _canonical(value):
+    """
+    Convert a value to a form that can be serialized to JSON in a unique
+    way, raising a TypeError if this is not possible.
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        digest = hashlib.sha256(np.ascontiguousarray(value)).hexdigest()
+        return {'ndarray': digest, 'dtype': value.dtype.str,
+                'shape': list(value.shape)}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(x) for x in value]
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in value.items()}
+    if isinstance(value, AstroFaker):
+        return {'phu': value.phu.tostring(),
+                'extensions': [[ext.hdr.tostring(), _canonical(ext.data)]
+                               for ext in value]}
+    # Functions are identified by name, which is not unique for closures
+    if callable(value) and '<locals>' not in getattr(value, '__qualname__',
+                                                     '<locals>'):
+        return {'callable': '{}.{}'.format(value.__module__,
+                                           value.__qualname__)}
+    raise TypeError("Cannot construct a cache key from {!r}".format(value))
+
+
+def _json_overrides(descriptors):
+    """
+    Return the descriptor overrides (a dict of name: value) whose values can
+    be stored as JSON, with NumPy scalars converted to Python types.
+    Callable overrides, and any others that cannot be stored, are omitted.
+    """
+    overrides = {}
+    for name, value in descriptors.items():
+        if isinstance(value, np.generic):
+            value = value.item()
+        try:
+            json.dumps(value)
+        except TypeError:
+            continue
+        overrides[name] = value
+    return overrides
+
+
+def cache_key(func, *args, **kwargs):
+    """
+    Return the key identifying the data created by calling func with the
+    given arguments: a SHA-256 hash of the astrofaker version, the layout
+    of the entries, the name of the function, and the canonical form of the
+    arguments.
+    """
+    description = [__version__, ENTRY_FORMAT, _canonical(func),
+                   _canonical(list(args)), _canonical(kwargs)]
+    text = json.dumps(description, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+@contextmanager
+def _locked(path):
+    """
+    Hold an exclusive lock on a file (if locking is supported). Since the
+    holder of the lock may delete the file while other processes are
+    waiting for it, the lock only counts once it has been obtained on the
+    file that is currently at the path.
+    """
+    while True:
+        with open(path, 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    current = (os.stat(path).st_ino ==
+                               os.fstat(f.fileno()).st_ino)
+                except FileNotFoundError:
+                    current = False
+                if not current:
+                    continue  # closing the file releases the lock
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+            return
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:  # e.g., still open elsewhere on Windows
+        pass
+
+
+class GenerationCache(object):
+    """
+    An on-disk cache of the AstroFaker objects (or lists or tuples of them)
+    returned by functions. The headers and pixel planes are stored, together
+    with the filename, seeing, tags (if set by hand), and descriptor
+    overrides of each object; overrides that cannot be stored as JSON
+    (e.g., callables) are not.
+    """
+    def __init__(self, directory=None, max_size=DEFAULT_MAX_SIZE):
+        """
+        Parameters
+        ----------
+        directory: str/None
+            cache directory (if None, use default_cache_dir())
+        max_size: int/None
+            maximum total size of the entries (bytes), or None for no limit
+        """
+        self.directory = directory or default_cache_dir()
+        self.max_size = max_size
+        os.makedirs(os.path.join(self.directory, 'locks'), exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _lock_path(self, key):
+        return os.path.join(self.directory, 'locks', key)
+
+    def __call__(self, func, *args, **kwargs):
+        """
+        Return the result of calling func with the given arguments, reading
+        it from the cache if possible and storing it there otherwise.
+        Concurrent calls with the same key (in any process) wait while the
+        first one creates the data.
+
+        Parameters
+        ----------
+        func: callable
+            function that returns an AstroFaker object or a list of them
+        args, kwargs:
+            arguments passed to func, which must describe the data
+            completely (so closures, for example, cannot be passed)
+
+        Returns
+        -------
+        AstroFaker/list/tuple
+        """
+        key = cache_key(func, *args, **kwargs)
+        with _locked(self._lock_path(key)):
+            result = self.load(key)
+            if result is None:
+                result = func(*args, **kwargs)
+                self.store(key, result)
+        self.evict(keep=key)
+        return result
+
+    def load(self, key):
+        """
+        Return the objects stored under a key (with the pixel planes
+        memory-mapped), or None if there is no such entry.
+        """
+        path = self._path(key)
+        try:
+            with open(os.path.join(path, ENTRY_FILENAME)) as f:
+                entry = json.load(f)
+            adinputs = [AstroFaker.open(os.path.join(path, '{}.fits'.format(i)))
+                        for i in range(len(entry['filenames']))]
+            # Record the use of this entry for the LRU eviction
+            os.utime(path)
+        except FileNotFoundError:  # including an entry evicted while reading
+            return None
+        for ad, filename, seeing, tags, descriptors in zip(
+                adinputs, entry['filenames'], entry['seeing'], entry['tags'],
+                entry['descriptors']):
+            ad.filename = filename
+            ad.seeing = seeing
+            if tags is not None:
+                ad.tags = tags
+            for name, value in descriptors.items():
+                setattr(ad, name, value)
+        if entry['type'] == 'tuple':
+            return tuple(adinputs)
+        return adinputs if entry['type'] == 'list' else adinputs[0]
+
+    def store(self, key, result):
+        """
+        Write the objects to an entry, which only appears in the cache once
+        it is complete.
+        """
+        adinputs = result if isinstance(result, (list, tuple)) else [result]
+        tmpdir = tempfile.mkdtemp(dir=self.directory, prefix='.tmp')
+        try:
+            for i, ad in enumerate(adinputs):
+                ad.write(os.path.join(tmpdir, '{}.fits'.format(i)))
+            with open(os.path.join(tmpdir, ENTRY_FILENAME), 'w') as f:
+                json.dump({
+                    'type': ('single' if adinputs is not result else
+                             'tuple' if isinstance(result, tuple) else
+                             'list'),
+                    'filenames': [ad.filename for ad in adinputs],
+                    'seeing': [ad.seeing for ad in adinputs],
+                    'tags': [None if getattr(ad, '_tags', None) is None
+                             else sorted(ad._tags) for ad in adinputs],
+                    'descriptors': [_json_overrides(ad._descriptor_dict)
+                                    for ad in adinputs]}, f)
+            os.rename(tmpdir, self._path(key))
+        except BaseException:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            raise
+
+    def entries(self):
+        """
+        Return the (key, size in bytes, time of last use) of each entry,
+        from the least to the most recently used
+        """
+        entries = []
+        for key in os.listdir(self.directory):
+            path = self._path(key)
+            if key.startswith('.') or key == 'locks' or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(path, f))
+                           for f in os.listdir(path))
+                entries.append((key, size, os.path.getmtime(path)))
+            except FileNotFoundError:  # deleted by another process
+                pass
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def delete(self, key):
+        """Delete an entry and its lock file"""
+        lock_path = self._lock_path(key)
+        with _locked(lock_path):
+            shutil.rmtree(self._path(key), ignore_errors=True)
+            _remove(lock_path)
+
+    def evict(self, keep=None):
+        """
+        Delete the least recently used entries (and their lock files) until
+        the total size of the cache is no larger than max_size.
+
+        Parameters
+        ----------
+        keep: str/None
+            key of an entry that should not be deleted
+        """
+        if self.max_size is None:
+            return
+        with _locked(self._lock_path('evict')):
+            entries = self.entries()
+            total = sum(size for _, size, _ in entries)
+            for key, size, _ in entries:
+                if total <= self.max_size:
+                    break
+                if key != keep:
+                    self.delete(key)
+                    total -= size
+
+    def clear(self):
+        """Delete all the entries and lock files"""
+        for key, _, _ in self.entries():
+            self.delete(key)
+        # Including those of entries that were never stored
+        for key in os.listdir(os.path.join(self.directory, 'locks')):
+            lock_path = self._lock_path(key)
+            with _locked(lock_path):
+                _remove(lock_path)
+
+
+def cached(func, *args, **kwargs):
+    """
+    Return the result of calling func with the given arguments, using the
+    default GenerationCache (see GenerationCache.__call__())
+    """
+    return GenerationCache()(func, *args, **kwargs)
@@ -0,0 +1,306 @@
+# This module provides the "astrofaker" command. Its "generate" subcommand
+# reads a JSON (or YAML) specification of a set of datasets, creates them in
+# a pool of worker processes, and writes them to disk. A manifest records
+# the parameters, checksums of the output files, and timings of each
+# dataset, so that an interrupted run can be resumed and datasets whose
+# specification has not changed are not created again.
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+try:
+    import yaml
+except ImportError:  # YAML specifications are optional
+    yaml = None
+
+from . import cache, fake_it, planner
+from .astrofaker import AstroFaker
+
+MANIFEST_FILENAME = 'manifest.json'
+
+
+def iter_dataset(instrument, mode='IMAGE', filename=None, extensions={},
+                 stars=None, dither=None, calibration=None, noise=True,
+                 seed=None, chunk_rows=None):
+    """
+    Generate the frames of a dataset described by a specification one at a
+    time (except for calibrations, which are created together), so that
+    only the current frame need be kept in memory.
+
+    Parameters
+    ----------
+    instrument: str
+        name of the instrument, as passed to create()
+    mode: str
+        mode of observation, as passed to create()
+    filename: str/None
+        filename of the base frame (if None, use the default of create())
+    extensions: dict
+        arguments passed to init_default_extensions()
+    stars: dict/None
+        arguments passed to fake_it.make_star_function() (if None, no stars
+        are added)
+    dither: dict/None
+        arguments passed to fake_it.iter_dither() (if None, a single frame
+        is created)
+    calibration: dict/None
+        arguments passed to fake_it.calibration_set(), which creates the
+        frames instead of iter_dither() if this is not None
+    noise: bool
+        add read noise and Poisson noise?
+    seed: int/None
+        seed for the random number generator
+    chunk_rows: int/None
+        number of rows for which to draw the random noise at a time (see
+        AstroFaker.add_poisson_noise)
+
+    Yields
+    ------
+    AstroFaker: each frame in turn
+    """
+    ad = AstroFaker.create(instrument, mode,
+                           **({} if filename is None else
+                              {'filename': filename}))
+    ad.init_default_extensions(**extensions)
+    if calibration is not None:
+        yield from fake_it.calibration_set(ad, add_noise=noise, seed=seed,
+                                           **calibration)
+        return
+    add_objects = (None if stars is None else
+                   fake_it.make_star_function(ad, seed=seed, **stars))
+    if dither is not None:
+        yield from fake_it.iter_dither(ad, add_objects=add_objects,
+                                       add_noise=noise, seed=seed,
+                                       chunk_rows=chunk_rows, **dither)
+        return
+    np.random.seed(seed)
+    if add_objects is not None:
+        add_objects(ad)
+    if noise:
+        ad.add_poisson_noise(chunk_rows=chunk_rows)
+        ad.add_read_noise(chunk_rows=chunk_rows)
+    yield ad
+
+
+def generate_dataset(instrument, mode='IMAGE', filename=None, extensions={},
+                     stars=None, dither=None, calibration=None, noise=True,
+                     seed=None):
+    """
+    Create the frames of a dataset described by a specification. The
+    parameters are those of iter_dataset().
+
+    Returns
+    -------
+    list: the AstroFaker objects
+    """
+    return list(iter_dataset(instrument, mode=mode, filename=filename,
+                             extensions=extensions, stars=stars, dither=dither,
+                             calibration=calibration, noise=noise, seed=seed))
+
+
+def checksum(path):
+    """Return the SHA-256 checksum of a file"""
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def _run(directory, params, compression, chunk_rows=None):
+    """
+    Create a dataset and write its frames to a directory (in a worker
+    process), returning the checksums of the files and the time taken
+    """
+    start = time.perf_counter()
+    os.makedirs(directory, exist_ok=True)
+    files = {}
+    for ad in iter_dataset(chunk_rows=chunk_rows, **params):
+        path = os.path.join(directory, ad.filename)
+        ad.write(path, overwrite=True, compression=compression)
+        files[ad.filename] = checksum(path)
+    return files, time.perf_counter() - start
+
+
+def read_spec(path):
+    """
+    Read a specification file (YAML if the filename ends in .yaml or .yml,
+    otherwise JSON) and return the parameters of each dataset, keyed by
+    name, with the defaults applied.
+    """
+    with open(path) as f:
+        if path.endswith(('.yaml', '.yml')):
+            if yaml is None:
+                raise ImportError("Reading YAML specifications requires "
+                                  "PyYAML to be installed")
+            spec = yaml.safe_load(f)
+        else:
+            spec = json.load(f)
+    datasets = {}
+    for dataset in spec['datasets']:
+        params = dict(spec.get('defaults', {}), **dataset)
+        name = params.pop('name')
+        if name in datasets:
+            raise ValueError("Dataset name {} is not unique".format(name))
+        datasets[name] = params
+    return spec, datasets
+
+
+def _up_to_date(entry, key, directory):
+    """Have the files of a manifest entry been created with these
+    parameters, and are they unchanged?"""
+    if entry is None or entry['key'] != key:
+        return False
+    try:
+        return all(checksum(os.path.join(directory, filename)) == value
+                   for filename, value in entry['files'].items())
+    except FileNotFoundError:
+        return False
+
+
+def _write_manifest(manifest, path):
+    """Write the manifest atomically, so an interrupted run can resume"""
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def dry_run(spec_file, memory_budget=None, timings=None, log=print):
+    """
+    Report the estimated resources needed to create each dataset in a
+    specification (see planner.plan()), without creating any.
+
+    Parameters
+    ----------
+    spec_file: str
+        name of the specification file
+    memory_budget: int/None
+        maximum memory to use (bytes)
+    timings: dict/str/None
+        rates measured by planner.calibrate(), or a JSON file of them
+    log: callable
+        function to report the plans
+
+    Returns
+    -------
+    dict: the Plan of each dataset
+    """
+    _, datasets = read_spec(spec_file)
+    plans = {}
+    for name, params in datasets.items():
+        plans[name] = planner.plan(memory_budget=memory_budget,
+                                   timings=timings, write=True, **params)
+        log("{}:".format(name))
+        for line in plans[name].summary():
+            log("  " + line)
+    return plans
+
+
+def generate(spec_file, output=None, processes=None, force=False,
+             log=print, memory_budget=None):
+    """
+    Create the datasets in a specification that are not already up to date
+    according to the manifest in the output directory.
+
+    Parameters
+    ----------
+    spec_file: str
+        name of the specification file
+    output: str/None
+        output directory (if None, use the "output" item of the
+        specification, or the current directory)
+    processes: int/None
+        number of worker processes (None means the number of CPUs)
+    force: bool
+        create all the datasets, even if they are up to date?
+    log: callable
+        function to report progress
+    memory_budget: int/None
+        maximum memory for each worker process to use (bytes), which
+        determines how the noise is drawn (see planner.plan())
+
+    Returns
+    -------
+    dict: the manifest
+    """
+    spec, datasets = read_spec(spec_file)
+    output = output or spec.get('output', os.curdir)
+    compression = spec.get('compression')
+    os.makedirs(output, exist_ok=True)
+    manifest_path = os.path.join(output, MANIFEST_FILENAME)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        manifest = {}
+
+    pending = {}
+    for name, params in datasets.items():
+        key = cache.cache_key(generate_dataset, compression, **params)
+        directory = os.path.join(output, name)
+        if not force and _up_to_date(manifest.get(name), key, directory):
+            log("{}: up to date".format(name))
+        else:
+            pending[name] = key
+
+    chunk_rows = {name: None if memory_budget is None else
+                  planner.plan(memory_budget=memory_budget,
+                               **datasets[name]).chunk_rows
+                  for name in pending}
+    with ProcessPoolExecutor(processes) as executor:
+        futures = {executor.submit(_run, os.path.join(output, name),
+                                   datasets[name], compression,
+                                   chunk_rows[name]): name
+                   for name in pending}
+        for future in as_completed(futures):
+            name = futures[future]
+            files, seconds = future.result()
+            manifest[name] = {'key': pending[name], 'params': datasets[name],
+                              'files': files, 'seconds': round(seconds, 3)}
+            _write_manifest(manifest, manifest_path)
+            log("{}: created {} files in {:.2f}s".format(name, len(files),
+                                                         seconds))
+    return manifest
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog='astrofaker', description="Create simulated Gemini data")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    generate_parser = subparsers.add_parser(
+        'generate', help="create the datasets in a specification file")
+    generate_parser.add_argument('spec', help="JSON or YAML specification")
+    generate_parser.add_argument('-o', '--output',
+                                 help="output directory")
+    generate_parser.add_argument('-j', '--processes', type=int, default=None,
+                                 help="number of worker processes")
+    generate_parser.add_argument('--force', action='store_true',
+                                 help="create datasets that are up to date")
+    generate_parser.add_argument('--dry-run', action='store_true',
+                                 help="report the memory, disk space and "
+                                      "time needed, without creating data")
+    generate_parser.add_argument('--memory-budget', type=float, default=None,
+                                 help="maximum memory per process (GiB)")
+    generate_parser.add_argument('--timings',
+                                 help="JSON file of rates measured by "
+                                      "benchmarks/bench_planner.py, for "
+                                      "--dry-run")
+    args = parser.parse_args(args)
+    memory_budget = (None if args.memory_budget is None else
+                     int(args.memory_budget * 2 ** 30))
+    if args.dry_run:
+        dry_run(args.spec, memory_budget=memory_budget, timings=args.timings)
+    else:
+        generate(args.spec, output=args.output, processes=args.processes,
+                 force=args.force, memory_budget=memory_budget)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
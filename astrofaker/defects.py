@@ -0,0 +1,121 @@
+# This module contains the vectorised functions used to inject detector
+# defects into pixel planes, and the DQ bits used to flag them. All the
+# functions operate on the last two axes of the arrays they are given, and
+# modify only the pixels affected, so the cost scales with the number of
+# defects rather than the size of the array.
+import numpy as np
+
+# Bits of the DQ (.mask) plane, with the values used by DRAGONS
+good = 0
+bad_pixel = 1
+non_linear = 2
+saturated = 4
+cosmic_ray = 8
+no_data = 16
+overlap = 32
+unilluminated = 64
+datatype = np.uint16
+
+
+def random_pixels(shape, npix):
+    """
+    Return the (y, x) indices of up to npix distinct pixels chosen at random
+
+    Parameters
+    ----------
+    shape: tuple
+        shape of the array (only the last two axes are used)
+    npix: int
+        number of pixels to choose
+    """
+    ny, nx = shape[-2:]
+    flat = np.unique(np.random.randint(ny * nx, size=int(npix)))
+    return np.divmod(flat, nx)
+
+
+def line_pixels(shape, x, y, dx, dy):
+    """
+    Return the pixels crossed by a set of straight line segments, sampled
+    at intervals of no more than one pixel along each axis. Samples that
+    lie off the array are discarded.
+
+    Parameters
+    ----------
+    shape: tuple
+        shape of the array (only the last two axes are used)
+    x, y: arrays
+        start points of the segments (0-indexed pixel coordinates)
+    dx, dy: arrays
+        extents of the segments along each axis (pixels)
+
+    Returns
+    -------
+    iy, ix: arrays
+        pixel indices of the samples
+    segment: array
+        the index of the segment to which each sample belongs
+    nsamples: array
+        the total number of samples along each segment, including any
+        that were discarded
+    """
+    x, y, dx, dy = np.broadcast_arrays(*[np.asarray(a, dtype=float)
+                                         for a in (x, y, dx, dy)])
+    nsamples = np.ceil(np.maximum(abs(dx), abs(dy))).astype(int) + 1
+    segment = np.repeat(np.arange(nsamples.size), nsamples)
+    # Position of each sample along its segment, from 0 to 1
+    first = np.cumsum(nsamples) - nsamples
+    step = np.arange(segment.size) - first[segment]
+    frac = step / np.maximum(nsamples - 1, 1)[segment]
+    ix = np.floor(x[segment] + frac * dx[segment] + 0.5).astype(int)
+    iy = np.floor(y[segment] + frac * dy[segment] + 0.5).astype(int)
+    ny, nx = shape[-2:]
+    on_array = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+    return iy[on_array], ix[on_array], segment[on_array], nsamples
+
+
+def _clip(values, dtype):
+    """Round and clip values to fit in an integer datatype"""
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        return np.clip(np.round(values), info.min, info.max)
+    return values
+
+
+def scatter_add(data, iy, ix, values):
+    """
+    Add values to data[..., iy, ix] in place. Values at repeated pixels are
+    summed, and the results are clipped to the range of integer datatypes.
+    """
+    nx = data.shape[-1]
+    flat, inverse = np.unique(np.asarray(iy) * nx + np.asarray(ix),
+                              return_inverse=True)
+    sums = np.bincount(inverse.ravel(), weights=np.broadcast_to(
+        values, inverse.shape).ravel(), minlength=flat.size)
+    iy, ix = np.divmod(flat, nx)
+    data[..., iy, ix] = _clip(data[..., iy, ix] + sums, data.dtype)
+
+
+def scatter_set(data, iy, ix, values):
+    """Set data[..., iy, ix] to values in place"""
+    data[..., iy, ix] = _clip(values, data.dtype)
+
+
+def scatter_multiply(data, iy, ix, factor):
+    """Multiply data[..., iy, ix] by factor in place (pixels must be unique)"""
+    data[..., iy, ix] = _clip(data[..., iy, ix] * factor, data.dtype)
+
+
+def flag(mask, iy, ix, bit):
+    """Set a DQ bit in mask[..., iy, ix] in place"""
+    mask[..., iy, ix] |= datatype(bit)
+
+
+def flag_levels(data, mask, saturation_level=None, non_linear_level=None):
+    """
+    Set the saturated and non_linear bits in mask (in place) for pixels
+    whose values are at or above the respective levels (if not None)
+    """
+    for level, bit in ((non_linear_level, non_linear),
+                       (saturation_level, saturated)):
+        if level is not None:
+            mask[data >= level] |= datatype(bit)
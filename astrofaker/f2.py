@@ -17,8 +17,25 @@ class AstroFakerF2(AstroFaker, AstroDataF2):
 
         if 'IMAGE' in mode:
             self.phu['GRISM'] = 'Open'
+        elif 'SPECT' in mode or 'MOS' in mode:
+            self.phu.update({'GRISM': 'JH_G5801', 'FILTER1': 'JH_G0809'})
+            if 'MOS' in mode:
+                self.phu.update({'DECKER': 'mos', 'MASKNAME': 'GS2018AQ001-01'})
+            else:
+                self.phu.update({'DECKER': 'Long_slit', 'MASKNAME': '2pix-slit'})
 
     @noslice
-    def init_default_extensions(self):
+    def init_default_extensions(self, scale=1):
+        """
+        Parameters
+        ----------
+        scale: int
+            factor by which to shrink the detector while preserving the
+            sky coverage
+        """
         del self[:]
-        self.add_extension(shape=(1, 2048, 2048), pixel_scale=0.179)
+        pixel_scale = 0.179 * scale
+        self.add_extension(shape=(1,) + self._scaled(scale, 2048, 2048),
+                           pixel_scale=pixel_scale)
+        if scale != 1:
+            self.pixel_scale = pixel_scale
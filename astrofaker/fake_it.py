@@ -1,9 +1,16 @@
 # This module contains a series of functions for creating a fake dataset.
+import os
+import warnings
 import numpy as np
 from functools import partial
-from astropy.wcs import WCS
+from astropy.modeling import models
 from copy import deepcopy
 
+from . import kernels
+from .astrofaker import AstroFaker
+
+PATTERNS = ('grid', 'abba', 'random', 'spiral')
+
 def make_star_function(ad_base, nstars=10, border=0, radius=None,
                        fwhm=None, flux=1., seed=None):
     """
@@ -38,30 +45,33 @@ def make_star_function(ad_base, nstars=10, border=0, radius=None,
         Random number seed, to ensure repeatability
     """
     def stars(ad, ra_list, dec_list, flux_list, fwhm_list):
-        for ra, dec, flux, fwhm in zip(ra_list, dec_list, flux_list, fwhm_list):
-            ad.add_star(ra=ra, dec=dec, flux=flux, fwhm=fwhm)
+        # Convert all the coordinates at once, to the focal-plane frame of
+        # an unsliced object, in which add_star() puts each star on every
+        # extension that it overlaps
+        x, y = (ad if ad.is_single else ad[0]).world2pix(ra_list, dec_list)
+        for i in range(len(ra_list)):
+            ad.add_star(x=x[i], y=y[i], flux=flux_list[i], fwhm=fwhm_list[i])
 
-    ra_list, dec_list = [], []
     flux_list = []
     fwhm_list = []
-    wcs = [WCS(h) for h in ad_base.hdr]
 
     if radius is not None:
         try:
             ra_base = ad_base.ra()
             dec_base = ad_base.dec()
             pix_scale = ad_base.pixel_scale()
-            xbase, ybase = wcs[0].all_world2pix(ra_base, dec_base, 0)
+            xbase, ybase = ad_base[0].world2pix(ra_base, dec_base)
         except:
             raise ValueError("Cannot determine WCS info of reference image")
 
     np.random.seed(seed)
-    for i, index in enumerate(np.random.randint(len(ad_base), size=nstars)):
+    indices = np.random.randint(len(ad_base), size=nstars)
+    xlist, ylist = np.zeros(nstars), np.zeros(nstars)
+    for i, index in enumerate(indices):
         if radius is None:
             shape = ad_base[index].data.shape
-            stary, starx = [np.random.rand() * (len_axis-2*border) + border
-                            for len_axis in shape]
-            ra, dec = wcs[index].all_pix2world(starx, stary, 0)
+            ylist[i], xlist[i] = [np.random.rand() * (len_axis-2*border) + border
+                                  for len_axis in shape]
         else:
             # To avoid difficulties with crossing poles, we're going to do this
             # in pixel space
@@ -69,25 +79,33 @@ def make_star_function(ad_base, nstars=10, border=0, radius=None,
                 rx, ry = np.random.rand(2)
                 if rx*rx + ry*ry <= 1.0:
                     break
-            starx = xbase + rx * radius/pix_scale
-            stary = ybase + ry * radius/pix_scale
-            ra, dec = wcs[0].all_pix2world(starx, stary, 0)
+            xlist[i] = xbase + rx * radius/pix_scale
+            ylist[i] = ybase + ry * radius/pix_scale
 
-        ra_list.append(ra)
-        dec_list.append(dec)
         fwhm_list.append(fwhm(i) if callable(fwhm) else fwhm)
         flux_list.append(flux(i) if callable(flux) else flux)
 
+    # Convert the positions on each extension to celestial coordinates
+    ra_list, dec_list = np.zeros(nstars), np.zeros(nstars)
+    if radius is not None:
+        indices[:] = 0
+    for index in np.unique(indices):
+        on_ext = indices == index
+        ra_list[on_ext], dec_list[on_ext] = ad_base[int(index)].pix2world(
+            xlist[on_ext], ylist[on_ext])
+
     return partial(stars, ra_list=ra_list, dec_list=dec_list,
                    flux_list=flux_list, fwhm_list=fwhm_list)
 
-def dither(ad_base, cycles=1, shape=(3,3), offset=10, rms=0, dither_overhead=5.,
-           add_objects=None, add_noise=True, seed=None, write=False):
+def iter_dither(ad_base, cycles=1, shape=(3,3), offset=10, rms=0,
+                dither_overhead=5., add_objects=None, add_noise=True, seed=None,
+                write=False, compression=None, sky=None, chunk_rows=None):
     """
-    This produces a series of AD objects mimicking one or more rectangular
-    dither patterns on the sky. A function to position objects at the same
-    celestial coordinates in each image can be provided. Pointing errors can
-    also be introduced.
+    This generates a series of AD objects mimicking one or more rectangular
+    dither patterns on the sky, one at a time, so that only the current
+    object need be kept in memory (e.g., if each is written to disk). A
+    function to position objects at the same celestial coordinates in each
+    image can be provided. Pointing errors can also be introduced.
     
     Parameters
     ----------
@@ -112,8 +130,22 @@ def dither(ad_base, cycles=1, shape=(3,3), offset=10, rms=0, dither_overhead=5.,
         Random number seed, to ensure repeatability
     write: bool
         Write files to disk?
+    compression: str/None
+        Tile-compression algorithm to use when writing (see AstroFaker.write)
+    sky: dict/callable/None
+        Arguments passed to add_sky() for each image, or a function of the
+        time (in seconds) between the starts of the first exposure and this
+        one that returns them, so the sky can vary through the sequence
+    chunk_rows: int/None
+        Number of rows for which to draw the random noise at a time (see
+        AstroFaker.add_poisson_noise)
+
+    Yields
+    ------
+    AstroFaker: each object in turn. The random number generator must not
+        be used by other code until the generator is exhausted, if the
+        result is to be repeatable.
     """
-    adinputs = []
     exptime = ad_base.exposure_time()
     time_since_start = 0.
     np.random.seed(seed)
@@ -124,6 +156,7 @@ def dither(ad_base, cycles=1, shape=(3,3), offset=10, rms=0, dither_overhead=5.,
                 xoff = (ix - 0.5 * (shape[0]-1)) * offset
                 ad = deepcopy(ad_base)
                 ad.time_offset(seconds=time_since_start)
+                start_time = time_since_start
                 time_since_start += exptime + dither_overhead
                 ad.update_filename(suffix="_{}{}{}".format(cycle if cycles>1 else '',
                                                            ix, iy))
@@ -135,10 +168,443 @@ def dither(ad_base, cycles=1, shape=(3,3), offset=10, rms=0, dither_overhead=5.,
                     add_objects(ad)
                 # Reset the header offsets to the requested values
                 ad.sky_offset(-dx, -dy)
+                if sky is not None:
+                    ad.add_sky(**(sky(start_time) if callable(sky) else sky))
                 if add_noise:
-                    ad.add_poisson_noise()
-                    ad.add_read_noise()
-                adinputs.append(ad)
+                    ad.add_poisson_noise(chunk_rows=chunk_rows)
+                    ad.add_read_noise(chunk_rows=chunk_rows)
                 if write:
-                    ad.write(overwrite=True)
-    return adinputs
\ No newline at end of file
+                    ad.write(overwrite=True, compression=compression)
+                yield ad
+
+
+def dither(ad_base, cycles=1, shape=(3,3), offset=10, rms=0, dither_overhead=5.,
+           add_objects=None, add_noise=True, seed=None, write=False,
+           compression=None, sky=None, chunk_rows=None):
+    """
+    This produces a list of AD objects mimicking one or more rectangular
+    dither patterns on the sky. The parameters are those of iter_dither().
+    """
+    return list(iter_dither(ad_base, cycles=cycles, shape=shape, offset=offset,
+                            rms=rms, dither_overhead=dither_overhead,
+                            add_objects=add_objects, add_noise=add_noise,
+                            seed=seed, write=write, compression=compression,
+                            sky=sky, chunk_rows=chunk_rows))
+
+
+def header_sequence(ad_base, pattern='grid', cycles=1, shape=(3,3), offset=10,
+                    dither_overhead=5., seed=None):
+    """
+    This produces a series of AD objects with the headers of a sequence of
+    observations taken in a pointing pattern, but no real pixel data: each
+    extension's data plane is a read-only zero-strided view of a single
+    zero, and no gWCS objects are constructed (call create_gwcs() on any
+    frame that needs them). The offsets and observation times of all the
+    frames are calculated together, so large sequences can be made quickly
+    for testing code that only reads the headers.
+
+    Parameters
+    ----------
+    ad_base: AstroData
+        Base AD object from which to construct new fake ADs
+    pattern: str
+        "grid" (like dither()), "abba" (nodding along the slit, with A and B
+        positions separated by offset), "random" (uniformly distributed over
+        the area of the grid), or "spiral" (a square spiral outward from the
+        base position)
+    cycles: int
+        Number of repeats of the pattern
+    shape: tuple
+        Shape of the grid pattern; the "random" and "spiral" patterns have
+        the same number of positions (shape[0]*shape[1]) per cycle, while
+        the "abba" pattern always has four
+    offset: float
+        step (in arcseconds) between positions
+    dither_overhead: float
+        time (in seconds) between exposures
+    seed: int/None
+        Random number seed, to ensure repeatability
+
+    Returns
+    -------
+    list of AstroFaker objects
+    """
+    np.random.seed(seed)
+    ra_offset, dec_offset = _pattern_offsets(pattern, cycles, shape, offset,
+                                             pa=ad_base.phu.get('PA', 0))
+    data = [np.broadcast_to(np.zeros((), dtype=ext.data.dtype),
+                            (ra_offset.size,) + ext.data.shape)
+            for ext in ad_base]
+    return _sequence_frames(ad_base, ra_offset, dec_offset,
+                            ad_base.exposure_time() + dither_overhead, data)
+
+
+def time_series(ad_base, nframes=100, add_objects=None, offsets=None,
+                jitter=0., flux_scale=None, overhead=5., add_noise=True,
+                seed=None, split=True):
+    """
+    This produces a time series of exposures of the same scene, with small
+    pointing offsets and varying fluxes (e.g., for testing variability
+    measurements or stacking). The objects are rendered only once, onto a
+    blank copy of ad_base, and each extension of all the frames is then
+    created as a single 3D array: the rendered scene is shifted by the
+    (sub-pixel) offset of each frame, scaled by its flux factor, and added
+    to the pixels of ad_base (e.g., a sky level), and the noise is added to
+    the whole array at once. The data plane of each frame is a view of this
+    array, and no gWCS objects are constructed (call create_gwcs() on any
+    frame that needs them).
+
+    The shifts are made in Fourier space, so they are exact for a scene that
+    is well sampled, but objects near the edges of an extension are not
+    replaced by those that would be shifted onto it from outside; the
+    offsets are intended to be a few pixels at most. A scene that is not
+    well sampled (e.g., stars with a FWHM below about 2 pixels, or galaxies
+    with cusps) rings when it is shifted, so a warning is issued if its
+    effective FWHM (see kernels.spectral_fwhm()) is too small.
+
+    Parameters
+    ----------
+    ad_base: AstroData
+        Base AD object from which to construct new fake ADs
+    nframes: int
+        Number of frames
+    add_objects: function/None
+        function to call to add objects to the scene
+    offsets: array/None
+        RA and dec offsets (in arcseconds) of each frame, with shape
+        (nframes, 2), or a single pair for all of them (None means none)
+    jitter: float
+        rms of Gaussian-distributed pointing errors (in arcseconds), which
+        move the objects but are not recorded in the headers
+    flux_scale: float/array/callable/None
+        Factor by which the fluxes of the objects in each frame are scaled,
+        or a function that takes an array of the times (in seconds) between
+        the starts of the first exposure and each one, and returns them
+    overhead: float
+        time (in seconds) between exposures
+    add_noise: bool
+        Add read noise and Poisson noise?
+    seed: int/None
+        Random number seed, to ensure repeatability
+    split: bool
+        Return the frames, rather than the 3D arrays?
+
+    Returns
+    -------
+    list of AstroFaker objects (or of arrays of shape (nframes, ny, nx),
+        one for each extension, if split is False)
+    """
+    np.random.seed(seed)
+    interval = ad_base.exposure_time() + overhead
+    ra_offset, dec_offset = (np.zeros((2, nframes)) if offsets is None else
+                             np.broadcast_to(np.asarray(offsets, dtype=float),
+                                             (nframes, 2)).T)
+    ra_error, dec_error = jitter * np.random.randn(2, nframes)
+    if callable(flux_scale):
+        flux_scale = flux_scale(np.arange(nframes) * interval)
+    flux_scale = np.broadcast_to(1. if flux_scale is None else flux_scale,
+                                 (nframes,))
+
+    scene = deepcopy(ad_base)
+    for ext in scene:
+        ext.data = np.zeros(ext.data.shape, dtype=np.float32)
+    if add_objects is not None:
+        add_objects(scene)
+        fwhm = min(kernels.spectral_fwhm(ext.data) for ext in scene)
+        if fwhm < kernels.SHIFT_MIN_FWHM:
+            warnings.warn("The scene is undersampled (effective FWHM {:.2f} "
+                          "pixels), so the shifted frames will show ringing"
+                          .format(fwhm))
+
+    # Objects at fixed celestial coordinates move in the opposite direction
+    # to the pointing, as the CRVALi are changed by sky_offset()
+    cosdec = np.cos(np.radians(ad_base.dec()))
+    dra = (ra_offset + ra_error) / (3600. * cosdec)
+    ddec = (dec_offset + dec_error) / 3600.
+    stacks = []
+    for ext, scene_ext in zip(ad_base, scene):
+        shape = ext.data.shape
+        xc, yc = 0.5 * (shape[1] - 1), 0.5 * (shape[0] - 1)
+        ra, dec = ext.pix2world(xc, yc)
+        x, y = ext.world2pix(ra - dra, dec - ddec)
+        stack = np.empty((nframes,) + shape, dtype=np.float32)
+        stack[:] = ext.data
+        kernels.add_shifted(stack, scene_ext.data, np.asarray(x) - xc,
+                            np.asarray(y) - yc, flux_scale)
+
+        if add_noise:
+            # Coefficients used by add_poisson_noise() and add_read_noise()
+            coeff, sigma = 1., ext.read_noise()
+            if ext.hdr.get('BUNIT', 'ADU').upper() == 'ADU':
+                coeff /= np.sqrt(ext.gain())
+                sigma /= ext.gain()
+            for start in range(0, nframes, kernels.STACK_BATCH):
+                block = stack[start:start+kernels.STACK_BATCH]
+                kernels.add_poisson_noise(block, coeff,
+                                          np.random.randn(*block.shape))
+                kernels.add_read_noise(block, sigma,
+                                       np.random.randn(*block.shape))
+
+        if np.issubdtype(ext.data.dtype, np.integer):
+            stack = kernels.quantize(stack, dtype=ext.data.dtype)
+        stacks.append(stack)
+
+    if not split:
+        return stacks
+    return _sequence_frames(ad_base, ra_offset, dec_offset, interval, stacks)
+
+
+def calibration_set(ad_base, obstype='BIAS', nframes=10, exposure_time=None,
+                    bias_level=1000., amp_scatter=20., bias_drift=1.,
+                    dark_current=0.02, flat_level=10000., illumination=None,
+                    pixel_response_rms=0.01, overhead=5., add_noise=True,
+                    seed=None):
+    """
+    This produces a set of raw calibration frames (biases, darks, or flats)
+    with the same structure as a reference AD object. The pixels of each
+    extension of all the frames are created together as a single 3D array,
+    and the data plane of each frame is a view of this array.
+
+    Every pixel (including the overscan region) has a bias level that is
+    different for each extension (i.e., each amplifier) and varies slightly
+    between frames. The dark current and flat-field illumination are added
+    to the data section only. No gWCS objects are constructed (call
+    create_gwcs() on any frame that needs them). The seeing, tags, and
+    descriptor overrides of ad_base are copied to every frame, except
+    overrides of the keywords set here (e.g., the exposure time).
+
+    Parameters
+    ----------
+    ad_base: AstroData
+        Base AD object from which to construct new fake ADs
+    obstype: str
+        "BIAS", "DARK", or "FLAT"
+    nframes: int
+        Number of frames
+    exposure_time: float/None
+        Exposure time (if None, zero for biases and the exposure time of
+        ad_base otherwise)
+    bias_level: float/sequence
+        Mean bias level (ADU), or a sequence of levels for each extension
+    amp_scatter: float
+        rms of the difference between the bias levels of each extension and
+        bias_level (ignored if bias_level is a sequence)
+    bias_drift: float
+        rms of the variation in the bias level between frames
+    dark_current: float
+        Dark current (electrons per second)
+    flat_level: float
+        Mean illumination of flats (counts)
+    illumination: callable/None
+        Function of the (0-indexed, binned) detector pixel coordinates
+        (x, y) returning the relative illumination of flats; if None, a
+        vignetting pattern falling by 10% from the centre to the corners
+        is used
+    pixel_response_rms: float
+        rms of the pixel-to-pixel variation in response of flats
+    overhead: float
+        time (in seconds) between exposures
+    add_noise: bool
+        Add read noise and Poisson noise?
+    seed: int/None
+        Random number seed, to ensure repeatability
+
+    Returns
+    -------
+    list of AstroFaker objects
+    """
+    obstype = obstype.upper()
+    try:
+        name = {'BIAS': 'Bias', 'DARK': 'Dark', 'FLAT': 'GCALflat'}[obstype]
+    except KeyError:
+        raise ValueError("obstype must be BIAS, DARK, or FLAT")
+    if exposure_time is None:
+        exposure_time = 0. if obstype == 'BIAS' else ad_base.exposure_time()
+
+    np.random.seed(seed)
+    layout = ad_base._detector_layout()
+    xall = np.concatenate([xdet for _, xdet, _ in layout])
+    yall = np.concatenate([ydet for _, _, ydet in layout])
+    xcentre, ycentre = 0.5 * (xall.min() + xall.max()), 0.5 * (yall.min() + yall.max())
+    rmax = np.hypot(xall.max() - xcentre, yall.max() - ycentre) or 1.
+    if illumination is None:
+        illumination = lambda x, y: (1 - 0.1 * ((x - xcentre) ** 2 + (y - ycentre) ** 2)
+                                     / rmax ** 2)
+
+    stacks = []
+    for index, (ext, (slices, xdet, ydet)) in enumerate(zip(ad_base, layout)):
+        shape = ext.data.shape
+        # Counts per electron and the read noise in these units
+        scale = 1. / ext.gain() if ext.hdr.get('BUNIT', 'ADU').upper() == 'ADU' else 1.
+        read_noise = ext.read_noise() * scale
+        level = (bias_level[index] if np.ndim(bias_level) else
+                 bias_level + amp_scatter * np.random.randn())
+
+        stack = np.empty((nframes,) + shape, dtype=np.float32)
+        stack[:] = (level + bias_drift * np.random.randn(nframes)).reshape(
+            (nframes,) + (1,) * len(shape))
+        signal = np.zeros((ydet.size, xdet.size), dtype=np.float32)
+        if obstype != 'BIAS':
+            signal += dark_current * exposure_time * scale
+        if obstype == 'FLAT':
+            response = 1 + pixel_response_rms * np.random.randn(*signal.shape)
+            signal += flat_level * response * illumination(xdet, ydet[:, np.newaxis])
+        stack[(Ellipsis,) + slices] += signal
+
+        if add_noise:
+            sigma = np.full(shape, read_noise ** 2, dtype=np.float32)
+            sigma[(Ellipsis,) + slices] += np.maximum(signal, 0) * scale
+            np.sqrt(sigma, out=sigma)
+            noise = np.random.randn(*stack.shape)
+            noise *= sigma
+            stack += noise
+            del noise
+
+        if np.issubdtype(ext.data.dtype, np.integer):
+            info = np.iinfo(ext.data.dtype)
+            np.rint(stack, out=stack)
+            np.clip(stack, info.min, info.max, out=stack)
+            stack = stack.astype(ext.data.dtype)
+        stacks.append(stack)
+
+    keywords = {'OBSTYPE': obstype, 'OBJECT': name,
+                ad_base._keyword_for('exposure_time'): exposure_time}
+    times = _obs_times(ad_base, nframes, exposure_time + overhead)
+    root, suffix = os.path.splitext(ad_base.filename)
+    width = len(str(nframes - 1))
+    adoutputs = []
+    for i in range(nframes):
+        filename = "{}_{}{:0{}d}{}".format(root, name.lower(), i, width, suffix)
+        phu = ad_base.phu.copy()
+        phu.update(keywords)
+        phu.update({'DATE-OBS': str(times[i]), 'ORIGNAME': filename})
+        extensions = [(header.copy(), planes[i], None, None)
+                      for header, planes in zip(ad_base.hdr, stacks)]
+        ad = AstroFaker._assemble(phu, extensions, filename=filename,
+                                  wcs=False)
+        # The keywords set here take precedence over any overrides
+        _copy_properties(ad, ad_base, exclude=('exposure_time',
+                                               'observation_type', 'object'))
+        if getattr(ad_base, '_tags', None) is not None:
+            ad.tags = ad.tags | {obstype, 'CAL'}
+        adoutputs.append(ad)
+    return adoutputs
+
+
+def _sequence_frames(ad_base, ra_offset, dec_offset, interval, data):
+    """
+    Return AstroFaker objects for a sequence of exposures, starting at the
+    time of ad_base and separated by interval seconds, at pointings offset
+    by the given amounts (arcseconds) from that of ad_base. The header
+    keywords are updated as sky_offset() and time_offset() would update
+    them, and data holds the data planes of all the frames for each
+    extension, as arrays of shape (nframes, ny, nx).
+    """
+    nframes = ra_offset.size
+    keywords = _offset_keywords(ad_base, ra_offset, dec_offset)
+    keywords['DATE-OBS'] = _obs_times(ad_base, nframes, interval)
+
+    # The CRVALi shifts are the same as those made by sky_offset()
+    dec = ad_base.dec()
+    delta_crval1 = ra_offset / (3600. * np.cos(np.radians(dec)))
+    delta_crval2 = dec_offset / 3600.
+    headers = [ext.hdr for ext in ad_base]
+
+    root, ext = os.path.splitext(ad_base.filename)
+    width = len(str(nframes - 1))
+    adoutputs = []
+    for i in range(nframes):
+        filename = "{}_{:0{}d}{}".format(root, i, width, ext)
+        phu = ad_base.phu.copy()
+        phu.update({k: v[i].item() for k, v in keywords.items()})
+        phu['ORIGNAME'] = filename
+        extensions = []
+        for header, planes in zip(headers, data):
+            header = header.copy()
+            if 'CRVAL1' in header:
+                header['CRVAL1'] += delta_crval1[i]
+                header['CRVAL2'] += delta_crval2[i]
+            extensions.append((header, planes[i], None, None))
+        ad = AstroFaker._assemble(phu, extensions, filename=filename, wcs=False)
+        _copy_properties(ad, ad_base)
+        adoutputs.append(ad)
+    return adoutputs
+
+
+def _copy_properties(ad, ad_base, exclude=()):
+    """
+    Give an object constructed from headers and pixel planes the seeing,
+    tags (if they have been set by hand), and descriptor overrides of
+    ad_base, which are not stored in its headers. The overrides of the
+    descriptors in exclude are not copied.
+    """
+    ad.seeing = ad_base.seeing
+    tags = getattr(ad_base, '_tags', None)
+    if tags is not None:
+        ad.tags = tags
+    for name, value in ad_base._descriptor_dict.items():
+        if name not in exclude:
+            setattr(ad, name, value)
+
+
+def _pattern_offsets(pattern, cycles, shape, offset, pa=0):
+    """
+    Return arrays of the RA and dec offsets (in arcseconds) of each position
+    in a pointing pattern. The "abba" pattern nods along the Q direction.
+    """
+    npos = shape[0] * shape[1]
+    if pattern == 'grid':
+        iy, ix = np.divmod(np.arange(npos), shape[0])
+        xoff = (ix - 0.5 * (shape[0] - 1)) * offset
+        yoff = (iy - 0.5 * (shape[1] - 1)) * offset
+    elif pattern == 'abba':
+        qoff = np.array([-0.5, 0.5, 0.5, -0.5]) * offset
+        xoff, yoff = models.Rotation2D(angle=-pa)(np.zeros_like(qoff), qoff)
+    elif pattern == 'random':
+        # Every cycle has different positions
+        xoff, yoff = ((np.random.rand(2, cycles * npos) - 0.5) *
+                      np.array([[shape[0] - 1], [shape[1] - 1]]) * offset)
+        return xoff, yoff
+    elif pattern == 'spiral':
+        # Ring r of the spiral holds positions (2r-1)**2 to (2r+1)**2 - 1,
+        # which run up the right side, then left along the top, down the
+        # left side, and right along the bottom
+        k = np.arange(npos)
+        r = np.floor((np.sqrt(k) + 1) / 2).astype(int)
+        side, t = np.divmod(k - (2 * r - 1) ** 2, np.maximum(2 * r, 1))
+        ix = np.choose(side % 4, [r, r - 1 - t, -r, t + 1 - r])
+        iy = np.choose(side % 4, [t + 1 - r, r, r - 1 - t, -r])
+        xoff = np.where(k > 0, ix, 0) * offset
+        yoff = np.where(k > 0, iy, 0) * offset
+    else:
+        raise ValueError("Unknown pattern {}; must be one of {}".format(
+            pattern, ", ".join(PATTERNS)))
+    return np.tile(xoff, cycles), np.tile(yoff, cycles)
+
+
+def _offset_keywords(ad_base, ra_offset, dec_offset):
+    """
+    Return a dict of arrays of the PHU offset keywords for a set of pointings
+    offset from that of ad_base, as sky_offset() would set them.
+    """
+    ra_offset = np.asarray(ra_offset, dtype=float)
+    dec_offset = np.asarray(dec_offset, dtype=float)
+    xoffset, yoffset = ad_base._xymapping(ra_offset, dec_offset)
+    poffset, qoffset = ad_base._pqmapping(ra_offset, dec_offset)
+    return {'RAOFFSET': ad_base.phu.get('RAOFFSET', 0) + ra_offset,
+            'DECOFFSE': ad_base.phu.get('DECOFFSE', 0) + dec_offset,
+            'XOFFSET': ad_base.phu.get('XOFFSET', 0) + xoffset,
+            'YOFFSET': ad_base.phu.get('YOFFSET', 0) + yoffset,
+            'POFFSET': ad_base.phu.get('POFFSET', 0) + poffset,
+            'QOFFSET': ad_base.phu.get('QOFFSET', 0) + qoffset}
+
+
+def _obs_times(ad_base, nframes, interval):
+    """
+    Return an array of DATE-OBS strings for frames starting at the time of
+    ad_base and separated by interval seconds
+    """
+    start = np.datetime64(ad_base.ut_datetime(), 'us')
+    elapsed = np.arange(nframes) * interval
+    times = start + np.round(elapsed * 1e6).astype('timedelta64[us]')
+    return np.datetime_as_string(times, unit='ms')
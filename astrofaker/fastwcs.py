@@ -0,0 +1,167 @@
+# This module provides a fast approximation to the transformations between
+# celestial and pixel coordinates of an image extension. The (distorted)
+# WCS is evaluated once on a grid of points covering the extension, which
+# are projected onto the tangent plane at its centre, and polynomials in
+# both directions are fitted to them. The polynomial degree is increased
+# until the error, measured on a denser grid, is below a tolerance; if that
+# cannot be achieved, the exact WCS is used. Points outside the fitted
+# region are also transformed with the exact WCS.
+import numpy as np
+from numpy.polynomial.polynomial import polyval2d
+from astropy.wcs import WCS
+
+# Maximum permitted error of the approximation (pixels)
+DEFAULT_TOLERANCE = 0.01
+# Degrees of the polynomials that are tried
+MAX_DEGREE = 7
+# The fitted region extends beyond the edges of the extension by this
+# fraction of its size on each side
+MARGIN = 0.1
+# Number of fitting points along each axis (twice as many are used to
+# measure the error)
+GRID_SIZE = 25
+
+
+def _tangent_plane(ra, dec, ra0, dec0):
+    """Gnomonic projection of (ra, dec) about (ra0, dec0); all in degrees.
+    Points more than 90 degrees from (ra0, dec0) are projected to NaN."""
+    ra, dec, ra0, dec0 = [np.radians(a) for a in (ra, dec, ra0, dec0)]
+    dra = ra - ra0
+    cos_c = (np.sin(dec0) * np.sin(dec) +
+             np.cos(dec0) * np.cos(dec) * np.cos(dra))
+    cos_c = np.where(cos_c > 0, cos_c, np.nan)
+    xi = np.cos(dec) * np.sin(dra) / cos_c
+    eta = (np.cos(dec0) * np.sin(dec) -
+           np.sin(dec0) * np.cos(dec) * np.cos(dra)) / cos_c
+    return np.degrees(xi), np.degrees(eta)
+
+
+def _sky(xi, eta, ra0, dec0):
+    """Inverse of _tangent_plane()"""
+    xi, eta, ra0, dec0 = [np.radians(a) for a in (xi, eta, ra0, dec0)]
+    denominator = np.cos(dec0) - eta * np.sin(dec0)
+    ra = ra0 + np.arctan2(xi, denominator)
+    dec = np.arctan2(np.sin(dec0) + eta * np.cos(dec0),
+                     np.hypot(xi, denominator))
+    return np.degrees(ra) % 360, np.degrees(dec)
+
+
+class _Polynomial2D(object):
+    """A pair of 2D polynomials fitted by least squares to map (u, v) to
+    (p, q), with the inputs normalized for numerical stability"""
+    def __init__(self, u, v, p, q, degree):
+        self.centre = u.mean(), v.mean()
+        self.scale = max(np.ptp(u), np.ptp(v)) / 2 or 1.
+        powers = [(i, j) for i in range(degree + 1)
+                  for j in range(degree + 1 - i)]
+        u, v = self._normalize(u, v)
+        design = np.stack([u ** i * v ** j for i, j in powers], axis=-1)
+        coeffs = np.linalg.lstsq(design, np.stack([p, q], axis=-1),
+                                 rcond=None)[0]
+        # Coefficient matrices for numpy's polyval2d()
+        self.coeffs = np.zeros((2, degree + 1, degree + 1))
+        for (i, j), c in zip(powers, coeffs):
+            self.coeffs[:, i, j] = c
+
+    def _normalize(self, u, v):
+        return (u - self.centre[0]) / self.scale, (v - self.centre[1]) / self.scale
+
+    def __call__(self, u, v):
+        u, v = self._normalize(u, v)
+        return polyval2d(u, v, self.coeffs[0]), polyval2d(u, v, self.coeffs[1])
+
+
+class FastTransform(object):
+    """
+    Polynomial approximation to the transformations between celestial and
+    (0-indexed) pixel coordinates of an image extension. The maximum error
+    over the extension (measured on a grid twice as dense as the fitting
+    grid) is stored as the max_error attribute, in pixels. If no polynomial
+    achieves the tolerance, the exact WCS is used for every point.
+    """
+    def __init__(self, header, shape, tolerance=DEFAULT_TOLERANCE):
+        """
+        Parameters
+        ----------
+        header: Header
+            header with the FITS WCS of the extension
+        shape: tuple
+            shape of the extension (only the last two axes are used)
+        tolerance: float
+            maximum permitted error (pixels)
+        """
+        self.wcs = WCS(header)
+        ny, nx = shape[-2:]
+        self.limits = (-0.5 - MARGIN * nx, nx - 0.5 + MARGIN * nx,
+                       -0.5 - MARGIN * ny, ny - 0.5 + MARGIN * ny)
+        self.centre = [float(c) for c in self.wcs.all_pix2world(
+            0.5 * (nx - 1), 0.5 * (ny - 1), 0)]
+        x, y = self._grid(GRID_SIZE)
+        xtest, ytest = self._grid(2 * GRID_SIZE + 1)
+        xi, eta = _tangent_plane(*self.wcs.all_pix2world(x, y, 0),
+                                 *self.centre)
+        xi_test, eta_test = _tangent_plane(
+            *self.wcs.all_pix2world(xtest, ytest, 0), *self.centre)
+        # Size of a pixel on the tangent plane, to express errors in pixels
+        step = xtest[0, 1] - xtest[0, 0]
+        pixel_size = np.hypot(np.diff(xi_test, axis=1),
+                              np.diff(eta_test, axis=1)).mean() / step
+
+        self.forward = self.inverse = None
+        self.max_error = np.inf
+        for degree in range(1, MAX_DEGREE + 1):
+            forward = _Polynomial2D(xi.ravel(), eta.ravel(), x.ravel(),
+                                    y.ravel(), degree)
+            inverse = _Polynomial2D(x.ravel(), y.ravel(), xi.ravel(),
+                                    eta.ravel(), degree)
+            xfit, yfit = forward(xi_test, eta_test)
+            xi_fit, eta_fit = inverse(xtest, ytest)
+            max_error = max(np.hypot(xfit - xtest, yfit - ytest).max(),
+                            np.hypot(xi_fit - xi_test,
+                                     eta_fit - eta_test).max() / pixel_size)
+            if max_error <= tolerance:
+                self.forward, self.inverse = forward, inverse
+                self.max_error = max_error
+                break
+
+    def _grid(self, npts):
+        x1, x2, y1, y2 = self.limits
+        return np.meshgrid(np.linspace(x1, x2, npts), np.linspace(y1, y2, npts))
+
+    def _inside(self, x, y):
+        x1, x2, y1, y2 = self.limits
+        return (x >= x1) & (x <= x2) & (y >= y1) & (y <= y2)
+
+    def world2pix(self, ra, dec):
+        """
+        Convert celestial coordinates (degrees) to 0-indexed pixel
+        coordinates.
+        """
+        ra, dec = np.broadcast_arrays(np.asarray(ra, dtype=float),
+                                      np.asarray(dec, dtype=float))
+        if self.forward is None:
+            return tuple(self.wcs.all_world2pix(ra, dec, 0))
+        x, y = [np.asarray(a) for a in
+                self.forward(*_tangent_plane(ra, dec, *self.centre))]
+        outside = ~self._inside(x, y)
+        if outside.any():
+            x[outside], y[outside] = self.wcs.all_world2pix(
+                ra[outside], dec[outside], 0)
+        return x, y
+
+    def pix2world(self, x, y):
+        """
+        Convert 0-indexed pixel coordinates to celestial coordinates
+        (degrees).
+        """
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float),
+                                   np.asarray(y, dtype=float))
+        if self.inverse is None:
+            return tuple(self.wcs.all_pix2world(x, y, 0))
+        ra, dec = [np.asarray(a) for a in
+                   _sky(*self.inverse(x, y), *self.centre)]
+        outside = ~self._inside(x, y)
+        if outside.any():
+            ra[outside], dec[outside] = self.wcs.all_pix2world(
+                x[outside], y[outside], 0)
+        return ra, dec
@@ -4,7 +4,6 @@
 """
 
 import numpy as np
-from itertools import product as cart_product
 
 from gemini_instruments.gmos.adclass import AstroDataGmos
 from gemini_instruments.gmos import lookup
@@ -12,10 +11,21 @@ from gemini_instruments.gmos import lookup
 from .astrofaker import AstroFaker, noslice
 
 BIAS_WIDTH = 32
+CCD_WIDTH = 2048
 # TODO: These are only good for Hamamatsu data
 CRPIX2N = (2136.9534, 2136.0563, 2135.6827)
 CRPIX2S = (2136.7972, 2137.6572, 2141.7487)
 
+# Standard Gemini ROIs as detector boxes (x1, x2, y1, y2) in unbinned pixels,
+# 1-indexed and inclusive, for the (Hamamatsu, EEV/e2v) CCDs
+ROIS = {'Full Frame': ((1, 6144, 1, 4224), (1, 6144, 1, 4608)),
+        'CCD2': ((2049, 4096, 1, 4224), (2049, 4096, 1, 4608)),
+        'Central Spectrum': ((1, 6144, 1625, 2648), (1, 6144, 1793, 2816)),
+        'Central Stamp': ((2923, 3222, 1987, 2286), (2923, 3222, 2155, 2454))}
+
+# Names of the amplifiers on each CCD, for each readout configuration
+AMP_NAMES = {12: ("1", "2", "3", "4"), 6: ("left", "right"), 3: ("right",)}
+
 
 class AstroFakerGmos(AstroFaker, AstroDataGmos):
     def _add_required_phu_keywords(self, mode):
@@ -43,71 +53,74 @@ class AstroFakerGmos(AstroFaker, AstroDataGmos):
 
         if 'IMAGE' in mode:
             self.phu['GRATING'] = 'MIRROR'
+        elif 'SPECT' in mode or 'MOS' in mode:
+            self.phu.update({'GRATING': 'R400+_G5325', 'GRORDER': 1,
+                             'GRWLEN': 700., 'CENTWAVE': 700., 'MASKTYP': 1})
+            self.phu['MASKNAME'] = ('GS2018AQ001-01' if 'MOS' in mode
+                                    else '1.0arcsec')
 
     @noslice
     def init_default_extensions(self, num_ext=12, binning=1, overscan=True,
-                                read_speed="slow", gain_setting="low"):
-        if num_ext != 12:
-            raise NotImplementedError("Only tested for full array ROI")
+                                read_speed="slow", gain_setting="low",
+                                roi="Full Frame", scale=1):
+        """
+        Create extensions for each amplifier that reads out part of the
+        region of interest.
+
+        Parameters
+        ----------
+        num_ext: int
+            number of amplifiers used to read out the three CCDs (3, 6, or 12)
+        binning: int
+            pixel binning (1, 2, or 4)
+        overscan: bool
+            add overscan regions (and make uint16 "raw" data)?
+        read_speed: str
+            "slow" or "fast"
+        gain_setting: str
+            "low" or "high"
+        roi: str/tuple
+            name of a standard Gemini ROI (a key of ROIS), or a detector box
+            (x1, x2, y1, y2) in unbinned pixels, 1-indexed and inclusive
+        scale: int
+            factor by which to shrink the detectors (and the ROI, overscan,
+            and chip gaps) while preserving the sky coverage
+        """
+        if num_ext not in AMP_NAMES:
+            raise ValueError("num_ext must be 3, 6, or 12")
         if binning not in (1, 2, 4):
             raise ValueError("Binning must be 1, 2, or 4")
 
         del self[:]
-        shape = ((4224 if self.phu['DETID'].startswith('BI') else 4608) // binning,
-                 512 // binning + (BIAS_WIDTH if overscan else 0))
+        hamamatsu = self.phu['DETID'].startswith('BI')
+        ccd_width, det_height = self._scaled(scale, CCD_WIDTH,
+                                             4224 if hamamatsu else 4608)
+        bias_width = max(BIAS_WIDTH // scale, 1)
+        if isinstance(roi, str):
+            try:
+                x1, x2, y1, y2 = ROIS[roi][0 if hamamatsu else 1]
+            except KeyError:
+                raise ValueError("Unknown ROI {}".format(roi))
+        else:
+            x1, x2, y1, y2 = roi
+        x1, y1 = (x1 - 1) // scale + 1, (y1 - 1) // scale + 1
+        x2, y2 = -(-x2 // scale), -(-y2 // scale)
+        if not (1 <= x1 <= x2 <= 3 * ccd_width and 1 <= y1 <= y2 <= det_height):
+            raise ValueError("ROI {} does not lie on the detector".format(roi))
+        nrows = (y2 - y1 + 1) // binning
+        y2 = y1 + nrows * binning - 1
+
         # If the overscan is present, assume it's raw data
         dtype = np.uint16 if overscan else np.float32
         pixel_scale = lookup.gmosPixelScales[self.instrument(),
-                                             self.phu['DETTYPE']] * binning
+                                             self.phu['DETTYPE']] * binning * scale
 
         north = self.instrument() == 'GMOS-N'
         crpix1 = 3132.69 if north else 3133.5
-        crpix1 = (crpix1 - 0.5) / binning + 0.5
+        crpix1 = (crpix1 - 0.5) / (binning * scale) + 0.5
         crpix2_list = CRPIX2N if north else CRPIX2S
-        chip_gap = 67. if north else 61.
-
-        extra_keywords = {'CRVAL1': self.phu['RA'], 'CRVAL2': self.phu['DEC'],
-                          'CTYPE1': 'RA---TAN', 'CTYPE2': 'DEC--TAN',
-                          'CCDSUM': '{} {}'.format(binning, binning)}
-        self.phu['NAMPS'] = num_ext
-        for i in range(num_ext):
-            ccd = i // 4
-            crpix2 = (crpix2_list[ccd] - 0.5) / binning + 0.5
-
-            detx1 = i * 512
-            detx2 = detx1 + 512
-            detsec = '[{}:{},1:4224]'.format(detx1 + 1, detx2)
-
-            datx1 = BIAS_WIDTH if (overscan and i % 2 == 1) else 0
-            datx2 = datx1 + 512 // binning
-            datasec = '[{}:{},1:{}]'.format(datx1 + 1, datx2, shape[0])
-
-            if overscan:
-                biasx1 = BIAS_WIDTH - datx1
-                biassec = '[{}:{},1:{}]'.format(biasx1 + 1, biasx1 + BIAS_WIDTH, shape[0])
-                extra_keywords[self._keyword_for('overscan_section')] = biassec
-
-            arrx1 = detx1 % 2048
-            arrx2 = arrx1 + 512
-            arraysec = '[{}:{},1:{}]'.format(arrx1 + 1, arrx2, shape[0])
-
-            extra_keywords.update({self._keyword_for('detector_section'): detsec,
-                                   self._keyword_for('data_section'): datasec,
-                                   self._keyword_for('array_section'): arraysec,
-                                   'CRPIX1': crpix1 + datx1, 'CRPIX2': crpix2})
-
-            crpix1 -= (datx2 - datx1)
-            # This isn't entirely right but it'll do
-            if i % 4 == 3:
-                crpix1 -= chip_gap / binning
+        chip_gap = (67. if north else 61.) / scale
 
-            self.add_extension(shape=shape, pixel_scale=pixel_scale,
-                               dtype=dtype, extra_keywords=extra_keywords)
-
-        # GAIN and READNOISE
-        # not the correct values, but makes the descriptors work
-        self.phu['AMPINTEG'] = 10000 if read_speed == "slow" else 1000
-        self.hdr['GAIN'] = 1 if gain_setting == "low" else 5
         ccdnames = self.phu['DETID'].split(",")
         if len(ccdnames) > 1:
             if ccdnames[0].startswith("e2v"):
@@ -115,9 +128,61 @@ class AstroFakerGmos(AstroFaker, AstroDataGmos):
                 ccdnames[2] = "e2v " + ccdnames[2]
         else:
             ccdnames = ["EEV"+x for x in self.phu['DETID'].split("EEV")[1:]]
-        if num_ext == 12:
-            amps = ("1", "2", "3", "4")
-        else:
-            amps = ("left", "right")
-        for i, (ccd, amp) in enumerate(cart_product(ccdnames, amps)):
-            self[i].hdr['AMPNAME'] = f"{ccd}, {amp}"
+
+        # GAIN and READNOISE
+        # not the correct values, but makes the descriptors work
+        self.phu['AMPINTEG'] = 10000 if read_speed == "slow" else 1000
+        gain = 1 if gain_setting == "low" else 5
+
+        self.phu['NAMPS'] = num_ext
+        self.phu.update({'DETNROI': 1, 'DETRO1X': x1, 'DETRO1Y': y1,
+                         'DETRO1XS': (x2 - x1 + 1) // binning,
+                         'DETRO1YS': nrows})
+        amps_per_ccd = num_ext // 3
+        amp_width = ccd_width // amps_per_ccd
+        for amp in range(num_ext):
+            ccd = amp // amps_per_ccd
+            # The part of the ROI read out by this amplifier
+            detx1 = max(x1, amp * amp_width + 1)
+            ncols = (min(x2, (amp + 1) * amp_width) - detx1 + 1) // binning
+            if ncols <= 0:
+                continue
+            detx2 = detx1 + ncols * binning - 1
+            detsec = '[{}:{},{}:{}]'.format(detx1, detx2, y1, y2)
+            arraysec = '[{}:{},{}:{}]'.format(detx1 - ccd * ccd_width,
+                                              detx2 - ccd * ccd_width, y1, y2)
+
+            # Alternate amplifiers on a CCD have their overscan on the left
+            overscan_left = amps_per_ccd > 1 and amp % 2 == 1
+            datx1 = bias_width if (overscan and overscan_left) else 0
+            datasec = '[{}:{},1:{}]'.format(datx1 + 1, datx1 + ncols, nrows)
+
+            extra_keywords = {'CRVAL1': self.phu['RA'], 'CRVAL2': self.phu['DEC'],
+                              'CTYPE1': 'RA---TAN', 'CTYPE2': 'DEC--TAN',
+                              'CCDSUM': '{} {}'.format(binning, binning),
+                              'GAIN': gain,
+                              'AMPNAME': "{}, {}".format(
+                                  ccdnames[ccd],
+                                  AMP_NAMES[num_ext][amp % amps_per_ccd])}
+            if overscan:
+                biasx1 = 0 if overscan_left else ncols
+                biassec = '[{}:{},1:{}]'.format(biasx1 + 1, biasx1 + bias_width,
+                                                nrows)
+                extra_keywords[self._keyword_for('overscan_section')] = biassec
+
+            # This isn't entirely right but it'll do
+            crpix2 = (crpix2_list[ccd] - 0.5) / (binning * scale) + 0.5
+            extra_keywords.update({
+                self._keyword_for('detector_section'): detsec,
+                self._keyword_for('data_section'): datasec,
+                self._keyword_for('array_section'): arraysec,
+                'CRPIX1': (crpix1 + datx1 - (detx1 - 1) / binning -
+                           ccd * chip_gap / binning),
+                'CRPIX2': crpix2 - (y1 - 1) / binning})
+
+            self.add_extension(shape=(nrows, ncols + (bias_width if overscan else 0)),
+                               pixel_scale=pixel_scale, dtype=dtype,
+                               extra_keywords=extra_keywords)
+
+        if scale != 1:
+            self.pixel_scale = pixel_scale
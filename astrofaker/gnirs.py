@@ -24,32 +24,47 @@ class AstroFakerGnirs(AstroFaker, AstroDataGnirs):
         self.phu['ARRAYID'] = 'SN7638228.1.2'
 
     @noslice
-    def init_default_extensions(self):
+    def init_default_extensions(self, scale=1):
+        """
+        Parameters
+        ----------
+        scale: int
+            factor by which to shrink the detector while preserving the
+            sky coverage
+        """
         del self[:]
-        self.add_extension(data=None)
-        pass
+        self.add_extension(data=None, scale=scale)
+        if scale != 1:
+            self.pixel_scale = 0.15 * scale
 
     @noslice
-    def add_extension(self, data=None, extra_keywords={}):
+    def add_extension(self, data=None, extra_keywords={}, scale=1):
         """
         GNIRS-specific method which provides GNIRS-like defaults. Unlike NIRI,
         we demand that GNIRS data have the shape of real data because it's a
         bit of an odd instrument and is only likely to be used in tests for
         GNIRS-specific things, where non-standard data will cause trouble.
 
-        This extends the AstroFaker method to deal with the bizarre way GNIRS
-        describes its sections.
-        """
+        GNIRS's sections are described by _update_extension_keywords().
 
-        if data is not None and data.shape != (1022, 1024):
+        A miniature detector, shrunk by a factor of scale, can be created
+        for quick tests, in which case the data must have the scaled shape.
+        Since the scale must divide both dimensions, it can only be 1 or 2.
+        """
+        shape = self._scaled(scale, 1022, 1024)
+        if data is not None and data.shape != shape:
             raise ValueError("Invalid GNIRS data shape {}".format(data.shape))
 
-        extra_keywords.update({'LOWROW': 0, 'HIROW': 1023,
-                               'LOWCOL': 0, 'HICOL': 1023})
-
         super(self.__class__, self).add_extension(
-            data=data, shape=(1022, 1024), pixel_scale=0.15, flip=False,
+            data=data, shape=shape, pixel_scale=0.15 * scale, flip=False,
             extra_keywords=extra_keywords)
 
+    def _update_extension_keywords(self, keywords, shape):
+        """Deal with the bizarre way GNIRS describes its sections"""
         for sec in ('array', 'data', 'detector'):
-            del self[-1].hdr[self._keyword_for('{}_section'.format(sec))]
+            keywords.pop(self._keyword_for('{}_section'.format(sec)), None)
+        # The rows run over the full (scaled) 1024-row height of the
+        # detector, of which only 1022 rows are read out
+        rows, cols = shape[-2:]
+        keywords.update({'LOWROW': 0, 'HIROW': rows * 1024 // 1022 - 1,
+                         'LOWCOL': 0, 'HICOL': cols - 1})
@@ -13,9 +13,17 @@ class AstroFakerGsaoi(AstroFaker, AstroDataGsaoi):
         self.phu['IAA'] = 0.959  # Value seen in recent headers
 
     @noslice
-    def init_default_extensions(self):
-
+    def init_default_extensions(self, scale=1):
+        """
+        Parameters
+        ----------
+        scale: int
+            factor by which to shrink the detectors while preserving the
+            sky coverage
+        """
         del self[:]
+        shape = self._scaled(scale, 2048, 2048)
+        pixel_scale = 0.0195 * scale
 
         # The WCS of GSAOI is a bit of a mess, with no consistent offsets
         # between the CRPIXi values and random pixel scales
@@ -25,10 +33,13 @@ class AstroFakerGsaoi(AstroFaker, AstroDataGsaoi):
             crpix2 = 3000. if i < 2 else 850.
 
             self.add_extension(
-                shape=(2048, 2048),
-                pixel_scale=0.0195,
+                shape=shape,
+                pixel_scale=pixel_scale,
                 extra_keywords={
-                    'CRPIX1': crpix1,
-                    'CRPIX2': crpix2
+                    'CRPIX1': (crpix1 - 0.5) / scale + 0.5,
+                    'CRPIX2': (crpix2 - 0.5) / scale + 0.5
                 }
             )
+
+        if scale != 1:
+            self.pixel_scale = pixel_scale
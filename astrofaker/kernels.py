@@ -0,0 +1,697 @@
+# This module contains the pixel-level kernels used by the AstroFaker
+# pixel-faking methods. Objects are rendered into the smallest region of the
+# image that contains them, rather than evaluating a model over every pixel.
+#
+# Each kernel has a pure-NumPy implementation, which is the default and the
+# reference, and an optional Numba implementation which compiles a fused,
+# multithreaded loop that avoids full-size temporary arrays. The Numba
+# versions are used only if numba is installed and they have been selected
+# with set_backend('numba') or the ASTROFAKER_BACKEND environment variable.
+import os
+import warnings
+from functools import lru_cache
+
+import numpy as np
+from scipy.special import erf
+
+try:
+    import numba
+except ImportError:  # numba is an optional dependency
+    numba = None
+
+# Number of nodes in each tabulated Sersic profile. With 8192 nodes, linear
+# interpolation reproduces the analytic profile to better than 1e-7 of its
+# peak value for 0.5 <= n <= 6
+SERSIC_TABLE_SIZE = 8192
+# The profile is set to zero where it falls below this fraction of its peak
+SERSIC_TRUNCATION = 1e-8
+# Pixels within this distance of the centre of a profile are evaluated
+# directly on an oversampled grid, since the cusp of high-n profiles cannot
+# be represented by sampling at pixel centres
+SERSIC_CORE_RADIUS = 2
+SERSIC_OVERSAMPLING = 11
+# Gaussians are rendered out to this many standard deviations
+GAUSSIAN_TRUNCATION = 8
+# Number of rows converted at a time by quantize()
+QUANTIZE_CHUNK_ROWS = 256
+# Spacing (pixels) of the coarse grid on which smooth backgrounds are
+# evaluated, and the number of rows that are interpolated at a time
+SKY_GRID_STEP = 32
+UPSAMPLE_CHUNK_ROWS = 256
+# Number of planes of a stack (e.g., frames of a time series) that are
+# processed at a time
+STACK_BATCH = 16
+# Smallest effective FWHM (pixels) of an image that add_shifted() can shift
+# without visible ringing (see spectral_fwhm())
+SHIFT_MIN_FWHM = 2.
+
+BACKENDS = ('numpy', 'numba')
+_backend = 'numpy'
+
+
+def set_backend(name):
+    """
+    Select the implementation of the pixel kernels.
+
+    Parameters
+    ----------
+    name: str
+        'numpy' (the default) or 'numba'
+    """
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError("Unknown backend {}".format(name))
+    if name == 'numba' and numba is None:
+        raise ImportError("The numba backend requires numba to be installed")
+    _backend = name
+
+
+def get_backend():
+    """Return the name of the selected kernel implementation"""
+    return _backend
+
+
+def _use_numba(*arrays):
+    # The compiled kernels assume C-contiguous arrays that they can view
+    # as 2D, and numba cannot handle non-native byte order (e.g., data
+    # memory-mapped from a FITS file)
+    return _backend == 'numba' and all(a.flags.c_contiguous and a.dtype.isnative
+                                       for a in arrays)
+
+
+def _planes(array):
+    # View an array of any dimensionality as a stack of 2D images
+    return array.reshape((-1,) + array.shape[-2:])
+
+
+def sersic_b(n):
+    """
+    Return the b(n) parameter of a Sersic profile, using the approximation
+    of Ciotti & Bertin (1999; A&A, 352, 447)
+    """
+    m = 1.0 / n
+    return 2. * n - 1. / 3. + 4. * m / 405. + 46. * m ** 2 / 25515.
+
+
+@lru_cache(maxsize=None)
+def sersic_table(n):
+    """
+    Tabulate the radial profile of a Sersic model of index n, normalized to
+    a peak value of 1. The profile is tabulated as a function of (r/r_e)**2
+    so that rendering requires neither a square root, a fractional power,
+    nor an exponential per pixel. The nodes are geometrically spaced to
+    resolve the steep inner part of the profile, and the table extends to
+    the radius where the profile drops below SERSIC_TRUNCATION.
+
+    Parameters
+    ----------
+    n: float
+        Sersic index
+
+    Returns
+    -------
+    q: array
+        (r/r_e)**2 at each node (starting at zero)
+    profile: array
+        value of the profile at each node
+    """
+    b = sersic_b(n)
+    q_max = (-np.log(SERSIC_TRUNCATION) / b) ** (2 * n)
+    q = np.concatenate([[0.], np.geomspace(1e-12 * q_max, q_max,
+                                           SERSIC_TABLE_SIZE - 1)])
+    profile = np.exp(-b * q ** (0.5 / n))
+    # These are cached, so make sure nobody can modify them
+    q.flags.writeable = False
+    profile.flags.writeable = False
+    return q, profile
+
+
+def _bounding_slices(shape, x, y, radius, border=0):
+    """
+    Return the slices of an image of the given shape which contain all
+    pixels within radius (plus border) of (x, y), or None if there are none
+    """
+    iy1 = max(int(np.floor(y - radius)) - border, 0)
+    iy2 = min(int(np.ceil(y + radius)) + border + 1, shape[0])
+    ix1 = max(int(np.floor(x - radius)) - border, 0)
+    ix2 = min(int(np.ceil(x + radius)) + border + 1, shape[1])
+    if iy1 >= iy2 or ix1 >= ix2:
+        return None
+    return slice(iy1, iy2), slice(ix1, ix2)
+
+
+def sersic_radius(r_e, n=4.0, axis_ratio=1.0):
+    """
+    Return the distance (pixels) from the centre of an elliptical Sersic
+    profile beyond which it is truncated (see SERSIC_TRUNCATION)
+    """
+    q, _ = sersic_table(n)
+    return np.sqrt(q[-1]) * r_e * max(1., 1. / axis_ratio)
+
+
+def sersic_stamp(shape, x, y, amplitude, r_e, n=4.0, axis_ratio=1.0,
+                 angle=0.0, border=0):
+    """
+    Render an elliptical Sersic profile into the region of an image that
+    contains it. This produces the same values as evaluating the compound
+    model (Shift & Shift | Rotation2D | Scale & Identity | Sersic) used
+    by earlier versions of add_galaxy(), except that the profile is
+    truncated (see SERSIC_TRUNCATION) and that pixels near the centre are
+    the average over the pixel rather than the value at its centre.
+
+    Parameters
+    ----------
+    shape: tuple
+        shape of the full image
+    x, y: float
+        location of the centre of the profile (0-indexed)
+    amplitude: float
+        peak value of the profile
+    r_e: float
+        effective radius (pixels)
+    n: float
+        Sersic index
+    axis_ratio: float
+        ratio of major to minor axis
+    angle: float
+        rotation angle of the profile (degrees)
+    border: int
+        additional pixels to include around the edge of the stamp (e.g., to
+        allow for a subsequent convolution)
+
+    Returns
+    -------
+    stamp: array/None
+        values of the profile in the region (None if no overlap)
+    slices: tuple/None
+        slices of the full image that the stamp corresponds to
+    """
+    q, profile = sersic_table(n)
+    radius = sersic_radius(r_e, n=n, axis_ratio=axis_ratio)
+    slices = _bounding_slices(shape, x, y, radius, border)
+    if slices is None:
+        return None, None
+
+    cosa, sina = np.cos(np.radians(angle)), np.sin(np.radians(angle))
+
+    def r2_grid(dx, dy):
+        xr = axis_ratio * (dx * cosa - dy * sina)
+        yr = dx * sina + dy * cosa
+        return (xr * xr + yr * yr) / (r_e * r_e)
+
+    if _backend == 'numba':
+        stamp = np.empty((slices[0].stop - slices[0].start,
+                          slices[1].stop - slices[1].start))
+        _sersic_numba(stamp, slices[1].start, slices[0].start, x, y, r_e,
+                      axis_ratio, cosa, sina, q, profile)
+    else:
+        dy = np.arange(slices[0].start, slices[0].stop)[:, np.newaxis] - y
+        dx = np.arange(slices[1].start, slices[1].stop) - x
+        stamp = np.interp(r2_grid(dx, dy), q, profile, right=0.)
+
+    # Replace the central pixels with values averaged over an oversampled grid
+    core = _bounding_slices(stamp.shape, x - slices[1].start,
+                            y - slices[0].start, SERSIC_CORE_RADIUS)
+    if core is not None:
+        sub = (np.arange(SERSIC_OVERSAMPLING) + 0.5) / SERSIC_OVERSAMPLING - 0.5
+        cy = (np.arange(core[0].start, core[0].stop) + slices[0].start - y)
+        cx = (np.arange(core[1].start, core[1].stop) + slices[1].start - x)
+        dy = (cy[:, np.newaxis, np.newaxis, np.newaxis] +
+              sub[np.newaxis, np.newaxis, :, np.newaxis])
+        dx = (cx[np.newaxis, :, np.newaxis, np.newaxis] +
+              sub[np.newaxis, np.newaxis, np.newaxis, :])
+        b = sersic_b(n)
+        stamp[core] = np.exp(-b * r2_grid(dx, dy) ** (0.5 / n)).mean(axis=(2, 3))
+
+    return amplitude * stamp, slices
+
+
+def add_gaussians(image, x, y, amplitude, sigma):
+    """
+    Add circular Gaussians to an image in place. Each Gaussian is only
+    evaluated within GAUSSIAN_TRUNCATION standard deviations of its centre.
+    If the image has more than two dimensions, the Gaussians are added to
+    every 2D plane.
+
+    Parameters
+    ----------
+    image: array
+        floating-point array to which the Gaussians are added
+    x, y: float/array
+        locations of the centres (0-indexed)
+    amplitude: float/array
+        peak values
+    sigma: float/array
+        standard deviations (pixels)
+    """
+    x, y, amplitude, sigma = [np.asarray(arr, dtype=np.float64).ravel()
+                              for arr in np.broadcast_arrays(x, y, amplitude,
+                                                             sigma)]
+    radius = GAUSSIAN_TRUNCATION * sigma
+    if _use_numba(image):
+        for plane in _planes(image):
+            _add_gaussians_numba(plane, x, y, amplitude, sigma, radius)
+        return
+
+    shape = image.shape[-2:]
+    for xc, yc, amp, sig, rad in zip(x, y, amplitude, sigma, radius):
+        slices = _bounding_slices(shape, xc, yc, rad)
+        if slices is None:
+            continue
+        # A circular Gaussian is separable, so only evaluate 1D profiles
+        gy = np.exp(-0.5 * ((np.arange(slices[0].start, slices[0].stop) -
+                             yc) / sig) ** 2)
+        gx = np.exp(-0.5 * ((np.arange(slices[1].start, slices[1].stop) -
+                             xc) / sig) ** 2)
+        image[(Ellipsis,) + slices] += amp * np.outer(gy, gx)
+
+
+def integrated_gaussian(pixels, centre, sigma):
+    """
+    Return the integrals of unit-flux Gaussians over pixels of unit width
+    centred on the given (integer) coordinates. The arguments broadcast.
+
+    Parameters
+    ----------
+    pixels: array
+        pixel coordinates
+    centre: float/array
+        centres of the Gaussians
+    sigma: float/array
+        standard deviations (pixels)
+    """
+    scale = 1. / (np.sqrt(2.) * sigma)
+    return 0.5 * (erf((pixels + 0.5 - centre) * scale) -
+                  erf((pixels - 0.5 - centre) * scale))
+
+
+def line_spectrum(npix, position, flux, sigma):
+    """
+    Return a 1D spectrum of Gaussian emission lines, integrated over each
+    pixel. All the lines are rendered as a single batch of stamps extending
+    GAUSSIAN_TRUNCATION standard deviations from their centres.
+
+    Parameters
+    ----------
+    npix: int
+        length of the spectrum
+    position: float/array
+        locations of the centres of the lines (0-indexed)
+    flux: float/array
+        total flux of each line
+    sigma: float
+        standard deviation of each line (pixels)
+
+    Returns
+    -------
+    array: the spectrum
+    """
+    position, flux = [np.asarray(arr, dtype=np.float64).ravel()
+                      for arr in np.broadcast_arrays(position, flux)]
+    half = int(np.ceil(GAUSSIAN_TRUNCATION * sigma))
+    pixels = (np.floor(position + 0.5).astype(int)[:, np.newaxis] +
+              np.arange(-half, half + 1))
+    values = flux[:, np.newaxis] * integrated_gaussian(
+        pixels, position[:, np.newaxis], sigma)
+    keep = (pixels >= 0) & (pixels < npix)
+    return np.bincount(pixels[keep], weights=values[keep], minlength=npix)
+
+
+def add_trace(image, centre, spectrum, sigma):
+    """
+    Add a spectrum to an image in place, spreading the value for each
+    column over the rows with a Gaussian profile (integrated over each
+    pixel) whose centre may vary from column to column. The profile is only
+    evaluated within GAUSSIAN_TRUNCATION standard deviations of the centre.
+    If the image has more than two dimensions, the spectrum is added to
+    every 2D plane.
+
+    Parameters
+    ----------
+    image: array
+        floating-point array, with the spatial direction along the second
+        last axis and the spectral direction along the last axis
+    centre: array
+        location of the centre of the profile in each column (0-indexed)
+    spectrum: array
+        total value to add to each column
+    sigma: float
+        standard deviation of the profile (pixels)
+    """
+    nrows, ncols = image.shape[-2:]
+    centre = np.broadcast_to(centre, (ncols,))
+    half = int(np.ceil(GAUSSIAN_TRUNCATION * sigma))
+    rows = (np.floor(centre + 0.5).astype(int) +
+            np.arange(-half, half + 1)[:, np.newaxis])
+    cols = np.broadcast_to(np.arange(ncols), rows.shape)
+    values = spectrum * integrated_gaussian(rows, centre, sigma)
+    keep = (rows >= 0) & (rows < nrows)
+    image[..., rows[keep], cols[keep]] += values[keep]
+
+
+def add_poisson_noise(data, coeff, z, variance=None):
+    """
+    Add Poisson-like noise to an array in place, viz.,
+    data += coeff * sqrt(max(data, 0)) * z
+    and, optionally, add the variance of this noise to a variance array.
+
+    Parameters
+    ----------
+    data: array
+        floating-point array to modify
+    coeff: float
+        scaling of the noise (e.g., to convert from electrons to ADU)
+    z: array
+        standard Normal variates, the same shape as data
+    variance: array/None
+        floating-point array to which coeff**2 * max(data, 0) is added
+    """
+    if _use_numba(data, z) and (variance is None or _use_numba(variance)):
+        if variance is None:
+            _add_poisson_noise_numba(data.reshape(-1, data.shape[-1]), coeff,
+                                     z.reshape(-1, z.shape[-1]))
+        else:
+            _add_poisson_noise_variance_numba(
+                data.reshape(-1, data.shape[-1]), coeff,
+                z.reshape(-1, z.shape[-1]),
+                variance.reshape(-1, variance.shape[-1]))
+        return
+    noise = np.maximum(data, 0)
+    if variance is not None:
+        variance += coeff * coeff * noise
+    np.sqrt(noise, out=noise)
+    noise *= z
+    noise *= coeff
+    data += noise
+
+
+def add_read_noise(data, sigma, z, variance=None):
+    """
+    Add Gaussian noise of constant standard deviation to an array in place,
+    viz., data += sigma * z
+    and, optionally, add sigma**2 to a variance array.
+
+    Parameters
+    ----------
+    data: array
+        floating-point array to modify
+    sigma: float
+        standard deviation of the noise
+    z: array
+        standard Normal variates, the same shape as data
+    variance: array/None
+        floating-point array to which the variance of the noise is added
+    """
+    if _use_numba(data, z):
+        _add_read_noise_numba(data.reshape(-1, data.shape[-1]), sigma,
+                              z.reshape(-1, z.shape[-1]))
+    else:
+        data += sigma * z
+    if variance is not None:
+        variance += sigma * sigma
+
+
+def quantize(data, dtype=np.uint16, scale=1., offset=0., nonlinearity=None,
+             saturation=None, chunk_rows=QUANTIZE_CHUNK_ROWS):
+    """
+    Convert an array to integer values, viz.,
+    out = round(clip(nonlinearity(data * scale) + offset, ..., saturation))
+    The conversion is performed a few rows at a time in a single float32
+    buffer (float64 for outputs of 32 or more bits, whose range float32
+    cannot represent exactly), so the only full-size array created is the
+    output.
+
+    Parameters
+    ----------
+    data: array
+        values to convert (e.g., electrons)
+    dtype: integer datatype
+        datatype of the output
+    scale: float
+        factor by which to multiply the data (e.g., 1/gain)
+    offset: float
+        value to add after scaling (e.g., the bias level)
+    nonlinearity: callable/None
+        function that takes an array of scaled values and returns the
+        values actually recorded, before the offset is added
+    saturation: float/None
+        maximum value of the output (the range of dtype is always enforced)
+    chunk_rows: int
+        number of rows to process at a time
+
+    Returns
+    -------
+    array: the converted values, with the same shape as data
+    """
+    info = np.iinfo(dtype)
+    work_dtype = np.float32 if info.bits < 32 else np.float64
+    upper = info.max if saturation is None else min(saturation, info.max)
+    # The limit mustn't round up beyond the range of dtype (e.g., int64)
+    upper = work_dtype(upper)
+    if int(upper) > info.max:
+        upper = np.nextafter(upper, work_dtype(0))
+    out = np.empty(data.shape, dtype=dtype)
+    rows_in = data.reshape(-1, data.shape[-1])
+    rows_out = out.reshape(-1, data.shape[-1])
+    buffer = np.empty((min(chunk_rows, len(rows_in)), data.shape[-1]),
+                      dtype=work_dtype)
+    for start in range(0, len(rows_in), chunk_rows):
+        chunk = buffer[:len(rows_in[start:start+chunk_rows])]
+        np.multiply(rows_in[start:start+chunk_rows], scale, out=chunk,
+                    casting='unsafe')
+        if nonlinearity is not None:
+            chunk[:] = nonlinearity(chunk)
+        chunk += offset
+        np.clip(chunk, info.min, upper, out=chunk)
+        np.rint(chunk, out=chunk)
+        rows_out[start:start+chunk_rows] = chunk
+    return out
+
+
+def coarse_grid(npix, step=SKY_GRID_STEP):
+    """
+    Return the coordinates of a grid of (at least two) equally spaced
+    points, no further than step apart, spanning pixels 0 to npix-1
+    """
+    npts = max(int(np.ceil((npix - 1) / step)) + 1, 2)
+    return np.linspace(0, max(npix - 1, 1), npts)
+
+
+def interpolation_weights(coarse, fine):
+    """
+    Return the matrix that linearly interpolates values at the (increasing)
+    coarse coordinates to the fine coordinates, extrapolating linearly
+    beyond the ends of the coarse grid
+    """
+    index = np.clip(np.searchsorted(coarse, fine, side='right') - 1,
+                    0, len(coarse) - 2)
+    frac = (fine - coarse[index]) / (coarse[index + 1] - coarse[index])
+    weights = np.zeros((len(fine), len(coarse)))
+    rows = np.arange(len(fine))
+    weights[rows, index] = 1 - frac
+    weights[rows, index + 1] = frac
+    return weights
+
+
+def add_upsampled(image, values, xcoarse, ycoarse,
+                  chunk_rows=UPSAMPLE_CHUNK_ROWS):
+    """
+    Add to an image, in place, the values of a function known on a coarse
+    grid, interpolated bilinearly to every pixel. The interpolation is
+    separable, so it is done by multiplying the grid values by the
+    interpolation matrices along each axis, a few rows at a time, and no
+    full-size temporary array is created. If the image has more than two
+    dimensions, the values are added to every 2D plane.
+
+    Parameters
+    ----------
+    image: array
+        floating-point array to which the values are added
+    values: array
+        values of the function at the grid points, with shape
+        (len(ycoarse), len(xcoarse))
+    xcoarse, ycoarse: arrays
+        (increasing) pixel coordinates of the grid points along each axis
+    chunk_rows: int
+        number of rows to process at a time
+    """
+    ny, nx = image.shape[-2:]
+    rows = interpolation_weights(ycoarse, np.arange(ny)).dot(values)
+    xweights = interpolation_weights(xcoarse, np.arange(nx)).T
+    rows, xweights = rows.astype(image.dtype), xweights.astype(image.dtype)
+    for start in range(0, ny, chunk_rows):
+        chunk = rows[start:start+chunk_rows]
+        image[..., start:start+chunk_rows, :] += chunk.dot(xweights)
+
+
+def add_shifted(stack, image, dx, dy, scale=1., batch=STACK_BATCH):
+    """
+    Add to each plane of a stack, in place, a copy of an image that has
+    been shifted by a (generally fractional) number of pixels and scaled.
+    The shifts are made by multiplying the Fourier transform of the image,
+    which is computed only once, by a phase ramp, so a well-sampled image
+    is shifted without any smoothing. The image is padded with zeros so
+    that nothing shifted off one edge reappears at the opposite edge.
+
+    Parameters
+    ----------
+    stack: array
+        floating-point array of shape (N,) + image.shape
+    image: array
+        2D image to shift
+    dx, dy: float/array
+        shifts (pixels) of each of the N copies along each axis
+    scale: float/array
+        factors by which to multiply each copy
+    batch: int
+        number of copies to make at a time
+    """
+    ny, nx = image.shape
+    nplanes = len(stack)
+    dx, dy, scale = [np.broadcast_to(np.asarray(arr, dtype=np.float64),
+                                     (nplanes,))[:, np.newaxis, np.newaxis]
+                     for arr in (dx, dy, scale)]
+    if nplanes == 0:
+        return
+    margin = int(np.ceil(max(abs(dx).max(), abs(dy).max()))) + 1
+    padded = np.zeros((ny + 2 * margin, nx + 2 * margin))
+    padded[margin:margin+ny, margin:margin+nx] = image
+    transform = np.fft.rfft2(padded)
+    u = np.fft.rfftfreq(padded.shape[1])
+    v = np.fft.fftfreq(padded.shape[0])[:, np.newaxis]
+    for start in range(0, nplanes, batch):
+        end = start + batch
+        # The phase ramp is separable, so only 1D ramps are exponentiated
+        phase = (np.exp(-2j * np.pi * u * dx[start:end]) *
+                 np.exp(-2j * np.pi * v * dy[start:end]))
+        phase *= transform * scale[start:end]
+        shifted = np.fft.irfft2(phase, s=padded.shape)
+        stack[start:end] += shifted[:, margin:margin+ny, margin:margin+nx]
+
+
+def spectral_fwhm(image):
+    """
+    Return the FWHM (in pixels) of the Gaussian whose power spectrum has
+    the same mean squared frequency as that of an image, along the axis
+    where this is larger. This measures how well sampled the image is:
+    narrow stars or the cusps of galaxies give a small value, and their
+    power near the Nyquist frequency makes Fourier shifts ring.
+
+    Parameters
+    ----------
+    image: array
+        2D image (e.g., of objects on a zero background)
+
+    Returns
+    -------
+    float: effective FWHM (infinite for an image of zeros)
+    """
+    power = np.abs(np.fft.fft2(image)) ** 2
+    total = power.sum()
+    if total == 0:
+        return np.inf
+    v = np.fft.fftfreq(image.shape[0])[:, np.newaxis]
+    u = np.fft.fftfreq(image.shape[1])
+    mean_k2 = max((power * u ** 2).sum(), (power * v ** 2).sum()) / total
+    # A Gaussian of sigma s has a power spectrum with <k^2> = 1/(8 pi^2 s^2)
+    return np.sqrt(8 * np.log(2)) / (2 * np.pi * np.sqrt(2 * mean_k2))
+
+
+def block_reduce(array, xbin, ybin, ufunc=np.add, dtype=None):
+    """
+    Combine blocks of ybin x xbin pixels of an array (along its last two
+    axes) with a ufunc, e.g., np.add to sum them or np.bitwise_or to combine
+    bitmasks. The array is reshaped so that each block lies along two new
+    axes (without copying, unless incomplete blocks at the ends of the axes
+    have to be discarded) and reduced along both in a single call.
+
+    Parameters
+    ----------
+    array: array
+        values to combine
+    xbin, ybin: int
+        size of the blocks along the last and second-last axes
+    ufunc: numpy.ufunc
+        function with which to combine the values
+    dtype: datatype/None
+        datatype in which to combine the values (if None, ufunc's default)
+
+    Returns
+    -------
+    array: the combined values, with the last two axes shrunk by the
+        binning factors
+    """
+    ny, nx = array.shape[-2] // ybin, array.shape[-1] // xbin
+    blocks = array[..., :ny*ybin, :nx*xbin].reshape(
+        array.shape[:-2] + (ny, ybin, nx, xbin))
+    return ufunc.reduce(blocks, axis=(-3, -1), dtype=dtype)
+
+
+if numba is not None:
+    @numba.njit(parallel=True, cache=True)
+    def _add_gaussians_numba(image, x, y, amplitude, sigma, radius):
+        ny, nx = image.shape
+        for iy in numba.prange(ny):
+            for k in range(x.size):
+                # Same pixels as _bounding_slices()
+                if (iy < np.floor(y[k] - radius[k]) or
+                        iy > np.ceil(y[k] + radius[k])):
+                    continue
+                ix1 = max(int(np.floor(x[k] - radius[k])), 0)
+                ix2 = min(int(np.ceil(x[k] + radius[k])) + 1, nx)
+                dy = (iy - y[k]) / sigma[k]
+                gy = amplitude[k] * np.exp(-0.5 * dy * dy)
+                for ix in range(ix1, ix2):
+                    dx = (ix - x[k]) / sigma[k]
+                    image[iy, ix] += gy * np.exp(-0.5 * dx * dx)
+
+    @numba.njit(parallel=True, cache=True)
+    def _sersic_numba(stamp, x0, y0, x, y, r_e, axis_ratio, cosa, sina,
+                      q, profile):
+        ny, nx = stamp.shape
+        nq = q.size
+        for iy in numba.prange(ny):
+            dy = iy + y0 - y
+            for ix in range(nx):
+                dx = ix + x0 - x
+                xr = axis_ratio * (dx * cosa - dy * sina)
+                yr = dx * sina + dy * cosa
+                r2 = (xr * xr + yr * yr) / (r_e * r_e)
+                if r2 > q[nq - 1]:
+                    stamp[iy, ix] = 0.
+                elif r2 == q[nq - 1]:
+                    stamp[iy, ix] = profile[nq - 1]
+                else:
+                    k = np.searchsorted(q, r2, side='right')
+                    stamp[iy, ix] = (profile[k - 1] + (r2 - q[k - 1]) *
+                                     (profile[k] - profile[k - 1]) /
+                                     (q[k] - q[k - 1]))
+
+    @numba.njit(parallel=True, cache=True)
+    def _add_poisson_noise_numba(data, coeff, z):
+        for i in numba.prange(data.shape[0]):
+            for j in range(data.shape[1]):
+                if data[i, j] > 0:
+                    data[i, j] += coeff * np.sqrt(data[i, j]) * z[i, j]
+
+    @numba.njit(parallel=True, cache=True)
+    def _add_poisson_noise_variance_numba(data, coeff, z, variance):
+        for i in numba.prange(data.shape[0]):
+            for j in range(data.shape[1]):
+                if data[i, j] > 0:
+                    variance[i, j] += coeff * coeff * data[i, j]
+                    data[i, j] += coeff * np.sqrt(data[i, j]) * z[i, j]
+
+    @numba.njit(parallel=True, cache=True)
+    def _add_read_noise_numba(data, sigma, z):
+        for i in numba.prange(data.shape[0]):
+            for j in range(data.shape[1]):
+                data[i, j] += sigma * z[i, j]
+
+
+_env_backend = os.environ.get('ASTROFAKER_BACKEND')
+if _env_backend:
+    try:
+        set_backend(_env_backend)
+    except (ValueError, ImportError) as e:
+        warnings.warn("Ignoring ASTROFAKER_BACKEND: {}".format(e))
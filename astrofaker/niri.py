@@ -23,7 +23,7 @@ class AstroFakerNiri(AstroFaker, AstroDataNiri):
             self.phu['A_VDET'] = -2.89
 
     @noslice
-    def init_default_extensions(self, fratio=6, roi_size=1024):
+    def init_default_extensions(self, fratio=6, roi_size=1024, scale=1):
         """
 
         Parameters
@@ -35,6 +35,10 @@ class AstroFakerNiri(AstroFaker, AstroDataNiri):
         roi_size: int
           The linear size of the ROI section
 
+        scale: int
+          The factor by which to shrink the ROI while preserving the sky
+          coverage
+
         Raises a ValueError for inappropriate values/combinations
         """
         del self[:]
@@ -58,13 +62,17 @@ class AstroFakerNiri(AstroFaker, AstroDataNiri):
             raise ValueError("Invalid roi_size")
 
         flip = (self.phu.get('INPORT') == 1 and not self.is_ao())
+        pixel_scale *= scale
 
         self.add_extension(
-            shape=(roi_size, roi_size),
+            shape=self._scaled(scale, roi_size, roi_size),
             pixel_scale=pixel_scale,
             flip=flip
         )
 
+        if scale != 1:
+            self.pixel_scale = pixel_scale
+
     @noslice
     def add_extension(self, data=None, shape=(1024, 1024),
                       pixel_scale=PIXEL_SCALES[6], flip=False,
@@ -74,12 +82,8 @@ class AstroFakerNiri(AstroFaker, AstroDataNiri):
         don't check for valid NIRI data shapes because we may wish to create
         smaller fake data to speed up computation.
 
-        This extends the AstroFaker method to deal with the bizarre way NIRI
-        describes its sections.
+        NIRI's sections are described by _update_extension_keywords().
         """
-        extra_keywords.update({'LOWROW': 0, 'HIROW': shape[0] - 1,
-                               'LOWCOL': 0, 'HICOL': shape[1] - 1})
-
         super(self.__class__, self).add_extension(
             data=data,
             shape=shape,
@@ -88,5 +92,9 @@ class AstroFakerNiri(AstroFaker, AstroDataNiri):
             extra_keywords=extra_keywords
         )
 
+    def _update_extension_keywords(self, keywords, shape):
+        """Deal with the bizarre way NIRI describes its sections"""
         for sec in ('array', 'data', 'detector'):
-            del self[-1].hdr[self._keyword_for('{}_section'.format(sec))]
+            keywords.pop(self._keyword_for('{}_section'.format(sec)), None)
+        keywords.update({'LOWROW': 0, 'HIROW': shape[0] - 1,
+                         'LOWCOL': 0, 'HICOL': shape[1] - 1})
@@ -0,0 +1,340 @@
+# This module estimates the memory, disk space and time needed to create a
+# dataset (described by the arguments of cli.iter_dataset()) without
+# creating any pixels: the base frame is built by init_default_extensions()
+# with unallocated pixel planes, and the sizes of the planes, of the
+# temporary arrays made by each step, and of the output files are
+# calculated from it. Times are estimated from rates per pixel (or per
+# byte, star or extension), which calibrate() measures on the current
+# machine. If a memory budget is given, the plan chooses to stream the
+# frames (keeping only one in memory) and to draw the noise a few rows at
+# a time, as required to keep within it.
+import inspect
+import json
+import os
+import tempfile
+import time
+from copy import deepcopy
+
+import numpy as np
+
+from . import fake_it
+from .astrofaker import AstroFaker
+
+FITS_BLOCK = 2880
+
+# Rough rates (seconds per unit), measured with NumPy on a workstation;
+# calibrate() measures them on the current machine
+DEFAULT_TIMINGS = {
+    'extension': 5e-3,      # per extension made by init_default_extensions()
+    'copy': 2e-10,          # per byte of pixel planes copied
+    'star': 1e-4,           # per star, per extension
+    'sky': 3e-9,            # per pixel
+    'poisson_noise': 3e-8,  # per pixel
+    'read_noise': 3e-8,     # per pixel
+    'write': 1e-9,          # per byte written
+}
+
+# Bytes of temporary arrays per pixel of an extension made by each step,
+# for (floating-point, integer) data. Integer data are modified with
+# AstroData arithmetic, which creates full-frame temporaries.
+TEMPORARY_BYTES = {
+    'stars': (0, 12),
+    'sky': (0, 12),
+    'poisson_noise': (8, 31),
+    'read_noise': (12, 24),
+}
+
+
+def _padded(nbytes):
+    """Size of a FITS header or data unit, padded to whole blocks"""
+    return -(-nbytes // FITS_BLOCK) * FITS_BLOCK
+
+
+def _argument(func, kwargs, name):
+    """Return the value of an argument of func, or its default"""
+    return kwargs.get(name, inspect.signature(func).parameters[name].default)
+
+
+def _format_bytes(nbytes):
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if nbytes < 1024 or unit == 'GiB':
+            return "{:.1f} {}".format(nbytes, unit)
+        nbytes /= 1024.
+
+
+class Plan(object):
+    """
+    The estimated resources needed to create a dataset, and the settings
+    chosen to keep within a memory budget. All sizes are in bytes and the
+    output size is that of uncompressed FITS files.
+
+    Attributes
+    ----------
+    params: dict
+        arguments of cli.iter_dataset() describing the dataset
+    nframes: int
+        number of frames
+    frame_bytes: int
+        size of the pixel planes of each frame
+    output_bytes: int
+        total size of the output files
+    steps: list
+        (name, seconds, bytes of temporary arrays) of each step, where the
+        time is the total for all the frames
+    resident_bytes: int
+        size of the frames held in memory at once (including the base frame)
+    temporary_bytes: int
+        size of the largest temporary arrays made by any step
+    peak_bytes: int
+        estimated peak memory use (resident_bytes + temporary_bytes)
+    within_budget: bool
+        is the peak memory use no larger than the budget?
+    seconds: float
+        estimated time to create (and write, if requested) all the frames
+    stream: bool
+        generate the frames one at a time, rather than as a list?
+    chunk_rows: int/None
+        number of rows for which to draw the noise at a time
+    memory_budget: int/None
+        maximum memory to use
+    """
+    def __init__(self, params, nframes, frame_bytes, output_bytes,
+                 memory_budget=None):
+        self.params = params
+        self.nframes = nframes
+        self.frame_bytes = frame_bytes
+        self.output_bytes = output_bytes
+        self.memory_budget = memory_budget
+        self.stream = False
+        self.chunk_rows = None
+        self.steps = []
+        self.resident_bytes = 0
+
+    @property
+    def temporary_bytes(self):
+        return max([nbytes for _, _, nbytes in self.steps] + [0])
+
+    @property
+    def peak_bytes(self):
+        return self.resident_bytes + self.temporary_bytes
+
+    @property
+    def seconds(self):
+        return sum(seconds for _, seconds, _ in self.steps)
+
+    @property
+    def within_budget(self):
+        return self.memory_budget is None or self.peak_bytes <= self.memory_budget
+
+    def summary(self):
+        """Return lines describing the plan"""
+        lines = ["{} frames of {} ({} of output)".format(
+                     self.nframes, _format_bytes(self.frame_bytes),
+                     _format_bytes(self.output_bytes)),
+                 "peak memory {} ({} of frames, {} of temporaries)".format(
+                     _format_bytes(self.peak_bytes),
+                     _format_bytes(self.resident_bytes),
+                     _format_bytes(self.temporary_bytes)),
+                 "estimated time {:.1f}s".format(self.seconds)]
+        for name, seconds, nbytes in self.steps:
+            lines.append("{:>8.2f}s {:>12}  {}".format(
+                seconds, _format_bytes(nbytes), name))
+        settings = ["streaming" if self.stream else "all frames in memory"]
+        if self.chunk_rows is not None:
+            settings.append("noise in blocks of {} rows".format(self.chunk_rows))
+        lines.append("; ".join(settings))
+        if not self.within_budget:
+            lines.append("WARNING: exceeds the memory budget of {}".format(
+                _format_bytes(self.memory_budget)))
+        return lines
+
+    def frames(self):
+        """
+        Create the frames with the chosen settings, returning a generator
+        if the plan streams them and a list otherwise
+        """
+        from .cli import iter_dataset
+        frames = iter_dataset(chunk_rows=self.chunk_rows, **self.params)
+        return frames if self.stream else list(frames)
+
+
+def plan(instrument, mode='IMAGE', filename=None, extensions={}, stars=None,
+         dither=None, calibration=None, noise=True, seed=None,
+         memory_budget=None, timings=None, write=False):
+    """
+    Estimate the resources needed to create a dataset. The structure of the
+    frames is determined by calling init_default_extensions() without
+    allocating the pixels, so this is fast even for the largest detectors.
+
+    Parameters
+    ----------
+    instrument, mode, filename, extensions, stars, dither, calibration,
+    noise, seed:
+        the arguments of cli.iter_dataset()
+    memory_budget: int/None
+        maximum memory to use (bytes); if the frames would need more, they
+        are streamed, and the noise is drawn a few rows at a time if even
+        that is not enough
+    timings: dict/str/None
+        rates returned by calibrate(), or the name of a JSON file containing
+        them (if None, use DEFAULT_TIMINGS)
+    write: bool
+        include the time taken to write the frames to disk?
+
+    Returns
+    -------
+    Plan
+    """
+    if isinstance(timings, str):
+        with open(timings) as f:
+            timings = json.load(f)
+    timings = dict(DEFAULT_TIMINGS, **(timings or {}))
+    params = {'instrument': instrument, 'mode': mode, 'filename': filename,
+              'extensions': extensions, 'stars': stars, 'dither': dither,
+              'calibration': calibration, 'noise': noise, 'seed': seed}
+
+    ad = AstroFaker.create(instrument, mode,
+                           **({} if filename is None else
+                              {'filename': filename}))
+    ad.allocate_pixels = False
+    ad.init_default_extensions(**extensions)
+
+    planes = []  # size of each pixel plane
+    output_bytes = _padded(len(ad.phu.tostring()))
+    for ext in ad:
+        header_bytes = _padded(len(ext.hdr.tostring()))
+        for plane in (ext.data, ext.variance, ext.mask):
+            if plane is not None:
+                planes.append(plane.nbytes)
+                output_bytes += header_bytes + _padded(plane.nbytes)
+    frame_bytes = sum(nbytes for nbytes in planes)
+    shapes = [ext.data.shape for ext in ad]
+    pixels = sum(int(np.prod(shape)) for shape in shapes)
+    max_pixels = max(int(np.prod(shape)) for shape in shapes)
+    integer = not all(np.issubdtype(ext.data.dtype, np.floating) for ext in ad)
+
+    if calibration is not None:
+        nframes = _argument(fake_it.calibration_set, calibration, 'nframes')
+    elif dither is not None:
+        nframes = (_argument(fake_it.iter_dither, dither, 'cycles') *
+                   int(np.prod(_argument(fake_it.iter_dither, dither, 'shape'))))
+    else:
+        nframes = 1
+    result = Plan(params, nframes, frame_bytes, nframes * output_bytes,
+                  memory_budget=memory_budget)
+
+    def estimate():
+        """Fill in the steps and memory of the plan for its settings"""
+        steps = [('init_default_extensions', len(ad) * timings['extension'], 0)]
+        if calibration is not None:
+            # The frames of each extension are made as one float32 array,
+            # to which float64 noise is added, and then converted
+            itemsize = max(ext.data.dtype.itemsize for ext in ad)
+            steps.append(('calibration_set', nframes * (
+                frame_bytes * timings['copy'] +
+                (pixels * timings['read_noise'] if noise else 0)),
+                nframes * max_pixels * (4 + itemsize + (8 if noise else 0))))
+            resident = (nframes + 1) * frame_bytes
+        else:
+            def temporary(name):
+                float_bytes, integer_bytes = TEMPORARY_BYTES[name]
+                if integer:
+                    return integer_bytes * max_pixels
+                if result.chunk_rows is None or name not in ('poisson_noise',
+                                                             'read_noise'):
+                    return float_bytes * max_pixels
+                return float_bytes * min(result.chunk_rows * max(
+                    shape[-1] for shape in shapes), max_pixels)
+
+            if dither is not None:
+                steps.append(('copy', nframes * frame_bytes * timings['copy'],
+                              0))
+            if stars is not None:
+                nstars = _argument(fake_it.make_star_function, stars, 'nstars')
+                steps.append(('stars', nframes * nstars * len(ad) *
+                              timings['star'], temporary('stars')))
+            if dither is not None and dither.get('sky') is not None:
+                steps.append(('sky', nframes * pixels * timings['sky'],
+                              temporary('sky')))
+            if noise:
+                for name in ('poisson_noise', 'read_noise'):
+                    steps.append((name, nframes * pixels * timings[name],
+                                  temporary(name)))
+            if dither is None:
+                resident = frame_bytes
+            else:
+                resident = (2 if result.stream else nframes + 1) * frame_bytes
+        if write:
+            steps.append(('write', result.output_bytes * timings['write'], 0))
+        result.steps = steps
+        result.resident_bytes = resident
+
+    estimate()
+    if result.within_budget:
+        return result
+    # Keep only one frame in memory at a time (calibrations cannot stream)
+    if calibration is None and nframes > 1:
+        result.stream = True
+        estimate()
+    # Draw the noise in blocks of rows small enough to fit in the budget
+    # (integer data are modified by AstroData arithmetic on whole planes)
+    if (noise and calibration is None and not integer and
+            not result.within_budget):
+        row_bytes = (max(TEMPORARY_BYTES[name][0]
+                         for name in ('poisson_noise', 'read_noise')) *
+                     max(shape[-1] for shape in shapes))
+        result.chunk_rows = max(int((memory_budget - result.resident_bytes) //
+                                    row_bytes), 1)
+        estimate()
+    return result
+
+
+def calibrate(repeat=3):
+    """
+    Measure the rates in DEFAULT_TIMINGS on this machine, using small frames.
+    The result can be passed to plan(), or saved as a JSON file.
+
+    Parameters
+    ----------
+    repeat: int
+        number of times to time each step (the fastest is used)
+
+    Returns
+    -------
+    dict: seconds per unit of each step
+    """
+    def best_time(fn):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    timings = {}
+    gmos = AstroFaker.create('GMOS-S', 'IMAGE')
+    seconds = best_time(lambda: gmos.init_default_extensions(num_ext=12,
+                                                            scale=16))
+    timings['extension'] = seconds / len(gmos)
+
+    gmos.init_default_extensions(num_ext=12, overscan=False, scale=4)
+    nstars = 20
+    width = sum(ext.data.shape[1] for ext in gmos)
+    x = np.linspace(0, width, nstars)
+    y = np.full(nstars, 0.5 * gmos[0].data.shape[0])
+    seconds = best_time(lambda: gmos.add_stars(flux=1000., x=x, y=y,
+                                               n_models=nstars))
+    timings['star'] = seconds / (nstars * len(gmos))
+
+    niri = AstroFaker.create('NIRI', 'IMAGE')
+    niri.init_default_extensions()
+    npix, nbytes = niri[0].data.size, niri[0].data.nbytes
+    timings['copy'] = best_time(lambda: deepcopy(niri)) / nbytes
+    timings['sky'] = best_time(lambda: niri.add_sky(level=100.)) / npix
+    timings['poisson_noise'] = best_time(niri.add_poisson_noise) / npix
+    timings['read_noise'] = best_time(niri.add_read_noise) / npix
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, niri.filename)
+        seconds = best_time(lambda: niri.write(path, overwrite=True))
+        timings['write'] = seconds / os.path.getsize(path)
+    return timings
@@ -0,0 +1,200 @@
+# This module is a pytest plugin (registered through the pytest11 entry
+# point) providing fixtures for tests that use fake data. Each distinct
+# configuration requested through the astrofaker_frame fixture is built once
+# per session (i.e., once per worker with pytest-xdist), and every test gets
+# its own copy, so tests are free to modify their inputs. The time spent
+# building and copying the frames is reported in the terminal summary (and
+# with pytest-xdist, the times of all the workers are combined there).
+import copy
+import time
+
+import numpy as np
+import pytest
+
+from . import cache, fake_it
+from .astrofaker import AstroFaker
+
+
+def build_frame(instrument, mode='IMAGE', stars=0, seed=None, noise=True,
+                **kwargs):
+    """
+    Create an AstroFaker object with default extensions, stars at random
+    locations, and noise.
+
+    Parameters
+    ----------
+    instrument: str
+        name of the instrument, as passed to create()
+    mode: str
+        mode of observation, as passed to create()
+    stars: int
+        number of stars to add
+    seed: int/None
+        seed for the random number generator
+    noise: bool
+        add read noise and Poisson noise?
+    kwargs: dict
+        arguments passed to init_default_extensions()
+
+    Returns
+    -------
+    AstroFaker: the new object
+    """
+    ad = AstroFaker.create(instrument, mode)
+    ad.init_default_extensions(**kwargs)
+    if stars:
+        fake_it.make_star_function(ad, nstars=stars, seed=seed)(ad)
+    if noise:
+        if seed is not None:
+            np.random.seed(seed)
+        ad.add_read_noise()
+        ad.add_poisson_noise()
+    return ad
+
+
+def copy_frame(ad):
+    """
+    Return an independent copy of the headers, pixel planes, gWCS objects,
+    seeing, tags, and descriptor overrides of an AstroFaker object. Unlike
+    copy.deepcopy(), this does not copy the descriptor and mosaic caches,
+    which the copy rebuilds as it needs them.
+
+    Parameters
+    ----------
+    ad: AstroFaker
+        object to copy
+
+    Returns
+    -------
+    AstroFaker: the copy
+    """
+    extensions = [(ext.hdr.copy(),
+                   *[None if plane is None else np.array(plane)
+                     for plane in (ext.data, ext.variance, ext.mask)])
+                  for ext in ad]
+    new_ad = AstroFaker._assemble(ad.phu.copy(), extensions,
+                                  filename=ad.filename, wcs=False)
+    for ext, new_ext in zip(ad, new_ad):
+        if ext.wcs is not None:
+            new_ext.wcs = copy.deepcopy(ext.wcs)
+    fake_it._copy_properties(new_ad, ad)
+    return new_ad
+
+
+class FrameFactory(object):
+    """
+    Callable that returns a copy of the object created by build_frame()
+    with the given arguments, building each distinct configuration only
+    once. If use_cache is True, the objects are also read from, and
+    written to, the on-disk cache (see cache.cached()).
+    """
+    def __init__(self, use_cache=False):
+        self.use_cache = use_cache
+        self.frames = {}
+        self.build_times = []
+        self.ncopies = 0
+        self.copy_time = 0.
+
+    def __call__(self, instrument, mode='IMAGE', stars=0, seed=None,
+                 noise=True, **kwargs):
+        """
+        Return a copy of a (possibly previously built) frame. The arguments
+        are those of build_frame().
+        """
+        args = (instrument, mode, stars, seed, noise)
+        key = cache.cache_key(build_frame, *args, **kwargs)
+        if key not in self.frames:
+            start = time.perf_counter()
+            if self.use_cache:
+                self.frames[key] = cache.cached(build_frame, *args, **kwargs)
+            else:
+                self.frames[key] = build_frame(*args, **kwargs)
+            description = ', '.join([repr(arg) for arg in args] +
+                                    ['{}={!r}'.format(k, v)
+                                     for k, v in sorted(kwargs.items())])
+            self.build_times.append((description,
+                                     time.perf_counter() - start))
+        start = time.perf_counter()
+        ad = copy_frame(self.frames[key])
+        self.copy_time += time.perf_counter() - start
+        self.ncopies += 1
+        return ad
+
+    def merge(self, build_times, ncopies, copy_time):
+        """
+        Add the times recorded by another FrameFactory (e.g., that of a
+        pytest-xdist worker) to those of this one.
+        """
+        self.build_times.extend(tuple(x) for x in build_times)
+        self.ncopies += ncopies
+        self.copy_time += copy_time
+
+    def summary(self, nslowest=5):
+        """
+        Return lines describing the time spent building and copying frames,
+        including the nslowest configurations to build.
+        """
+        lines = ["built {} configurations in {:.2f}s; made {} copies in "
+                 "{:.2f}s".format(len(self.build_times),
+                                  sum(t for _, t in self.build_times),
+                                  self.ncopies, self.copy_time)]
+        for description, seconds in sorted(self.build_times,
+                                           key=lambda x: -x[1])[:nslowest]:
+            lines.append("{:8.2f}s  {}".format(seconds, description))
+        return lines
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('astrofaker')
+    group.addoption('--astrofaker-cache', action='store_true', default=False,
+                    help="read the frames built by the astrofaker_frame "
+                         "fixture from the on-disk cache (and write them "
+                         "to it)")
+
+
+def pytest_configure(config):
+    config._astrofaker_factory = FrameFactory(
+        use_cache=config.getoption('astrofaker_cache'))
+
+
+def pytest_sessionfinish(session):
+    # A pytest-xdist worker sends its times to the controller
+    workeroutput = getattr(session.config, 'workeroutput', None)
+    factory = getattr(session.config, '_astrofaker_factory', None)
+    if workeroutput is not None and factory is not None:
+        workeroutput['astrofaker'] = {
+            'build_times': [list(x) for x in factory.build_times],
+            'ncopies': factory.ncopies, 'copy_time': factory.copy_time}
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_testnodedown(node, error):
+    # Called on the pytest-xdist controller when a worker finishes
+    output = getattr(node, 'workeroutput', {}).get('astrofaker')
+    factory = getattr(node.config, '_astrofaker_factory', None)
+    if output is not None and factory is not None:
+        factory.merge(**output)
+
+
+def pytest_terminal_summary(terminalreporter):
+    factory = getattr(terminalreporter.config, '_astrofaker_factory', None)
+    if factory is not None and factory.build_times:
+        terminalreporter.write_sep('-', 'astrofaker fixtures')
+        for line in factory.summary():
+            terminalreporter.write_line(line)
+
+
+@pytest.fixture(scope='session')
+def astrofaker_factory(pytestconfig):
+    """The session's FrameFactory, which holds the frames it has built"""
+    return pytestconfig._astrofaker_factory
+
+
+@pytest.fixture
+def astrofaker_frame(astrofaker_factory):
+    """
+    Factory fixture returning an independent copy of a frame, e.g.,
+    astrofaker_frame("GMOS-S", binning=2, stars=50, seed=1). Each distinct
+    configuration is only built once per session.
+    """
+    return astrofaker_factory
@@ -0,0 +1,251 @@
+# This module allows many noisy realisations of the same scene to be made
+# without re-rendering it. The noiseless pixel planes and headers of an
+# AstroFaker object are frozen (in memory, or in a directory of .npy files
+# that is memory-mapped when loaded), together with the noise properties of
+# each extension, and each realisation only has to copy the model and add
+# noise to it, using its own random number generator.
+import json
+import os
+
+import numpy as np
+from astropy.io.fits import Header
+
+from . import cache, kernels
+from .astrofaker import AstroFaker
+
+MODEL_FILENAME = 'model.json'
+
+
+def _is_adu(header):
+    return header.get('BUNIT', 'ADU').upper() == 'ADU'
+
+
+class NoiselessModel(object):
+    """
+    A frozen copy of a (noiseless) AstroFaker object, from which noisy
+    realisations can be produced. The pixel planes are stored as float32
+    arrays, and realisations of integer data are rounded back to the
+    original datatype.
+
+    Only the headers, pixel planes, seeing, tags, and non-callable
+    descriptor overrides are frozen; tables are not. The gWCS objects of
+    the realisations are constructed from the headers.
+    """
+    def __init__(self, ad=None, poisson_scale=1.0, read_noise_scale=1.0):
+        """
+        Parameters
+        ----------
+        ad: AstroFaker/None
+            object to freeze (if None, the attributes must be set by load())
+        poisson_scale: float
+            factor by which to scale the Poisson noise
+        read_noise_scale: float
+            factor by which to scale the read noise
+        """
+        if ad is None:
+            return
+        self.phu = ad.phu.copy()
+        self.filename = ad.filename
+        self.seeing = ad.seeing
+        self.tags = getattr(ad, '_tags', None)
+        self.descriptors = {k: v for k, v in ad._descriptor_dict.items()
+                            if not callable(v)}
+        self.headers, self.planes, self.dtypes, self.noise = [], [], [], []
+        for ext in ad:
+            self.headers.append(ext.hdr.copy())
+            self.planes.append(tuple(
+                None if plane is None else np.array(plane, dtype=dtype)
+                for plane, dtype in ((ext.data, np.float32),
+                                     (ext.variance, np.float32),
+                                     (ext.mask, None))))
+            self.dtypes.append(ext.data.dtype.str)
+            # Coefficients used by add_poisson_noise() and add_read_noise()
+            coeff, sigma = poisson_scale, read_noise_scale * ext.read_noise()
+            if _is_adu(ext.hdr):
+                coeff /= np.sqrt(ext.gain())
+                sigma /= ext.gain()
+            self.noise.append((float(coeff), float(sigma)))
+
+    def __len__(self):
+        return len(self.planes)
+
+    def realize(self, rng=None, poisson=True, read_noise=True,
+                update_variance=False):
+        """
+        Return a noisy realisation of the model.
+
+        Parameters
+        ----------
+        rng: numpy.random.Generator/int/None
+            random number generator (or seed for one)
+        poisson: bool
+            add Poisson noise?
+        read_noise: bool
+            add read noise?
+        update_variance: bool
+            add the variance of the noise (computed from the noiseless
+            model) to the .variance plane, creating it if necessary?
+
+        Returns
+        -------
+        AstroFaker: the realisation
+        """
+        rng = np.random.default_rng(rng)
+        extensions = []
+        for header, (data, variance, mask), dtype, (coeff, sigma) in zip(
+                self.headers, self.planes, self.dtypes, self.noise):
+            noisy = np.array(data)
+            if update_variance:
+                variance = (np.zeros_like(noisy) if variance is None
+                            else np.array(variance))
+                if poisson:
+                    variance += coeff * coeff * np.maximum(data, 0)
+                if read_noise:
+                    variance += sigma * sigma
+            elif variance is not None:
+                variance = np.array(variance)
+            # One buffer of Normal variates is reused for both noise sources
+            z = np.empty_like(noisy)
+            if poisson:
+                kernels.add_poisson_noise(
+                    noisy, coeff, rng.standard_normal(out=z, dtype=np.float32))
+            if read_noise:
+                kernels.add_read_noise(
+                    noisy, sigma, rng.standard_normal(out=z, dtype=np.float32))
+            del z
+            if np.issubdtype(dtype, np.integer):
+                noisy = kernels.quantize(noisy, dtype=dtype)
+            extensions.append((header.copy(), noisy, variance,
+                               None if mask is None else np.array(mask)))
+        ad = AstroFaker._assemble(self.phu.copy(), extensions,
+                                  filename=self.filename)
+        ad.seeing = self.seeing
+        if self.tags is not None:
+            ad.tags = self.tags
+        for name, value in self.descriptors.items():
+            setattr(ad, name, value)
+        return ad
+
+    def realizations(self, nrealizations, seed=None, **kwargs):
+        """
+        Generate noisy realisations of the model one at a time, each with an
+        independent random number generator spawned from a single seed, so
+        that realisation i is the same however many are requested.
+
+        Parameters
+        ----------
+        nrealizations: int
+            number of realisations
+        seed: int/numpy.random.SeedSequence/None
+            seed from which the generators are spawned
+        kwargs: dict
+            arguments passed to realize()
+
+        Yields
+        ------
+        AstroFaker: each realisation in turn
+        """
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        for child in seed.spawn(nrealizations):
+            yield self.realize(np.random.default_rng(child), **kwargs)
+
+    def save(self, path):
+        """
+        Save the model to a directory, with each pixel plane in its own .npy
+        file so that it can be memory-mapped by load().
+
+        Parameters
+        ----------
+        path: str
+            name of the directory (which is created if necessary)
+        """
+        os.makedirs(path, exist_ok=True)
+        for i, planes in enumerate(self.planes):
+            for name, plane in zip(('sci', 'var', 'dq'), planes):
+                if plane is not None:
+                    np.save(os.path.join(path, '{}{}.npy'.format(name, i)),
+                            plane)
+        description = {
+            'phu': self.phu.tostring(),
+            'headers': [header.tostring() for header in self.headers],
+            'planes': [[plane is not None for plane in planes]
+                       for planes in self.planes],
+            'dtypes': self.dtypes, 'noise': self.noise,
+            'filename': self.filename, 'seeing': self.seeing,
+            'tags': None if self.tags is None else sorted(self.tags),
+            'descriptors': cache._json_overrides(self.descriptors)}
+        # Write the description last, so an incomplete model is never loaded
+        with open(os.path.join(path, MODEL_FILENAME), 'w') as f:
+            json.dump(description, f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Load a model saved by save(). Descriptor overrides that cannot be
+        stored as JSON are not saved.
+
+        Parameters
+        ----------
+        path: str
+            name of the directory
+        mmap: bool
+            memory-map the pixel planes, rather than reading them?
+
+        Returns
+        -------
+        NoiselessModel
+        """
+        with open(os.path.join(path, MODEL_FILENAME)) as f:
+            description = json.load(f)
+        model = cls()
+        model.phu = Header.fromstring(description['phu'])
+        model.headers = [Header.fromstring(s) for s in description['headers']]
+        model.planes = []
+        for i, exists in enumerate(description['planes']):
+            model.planes.append(tuple(
+                np.load(os.path.join(path, '{}{}.npy'.format(name, i)),
+                        mmap_mode='r' if mmap else None) if plane else None
+                for name, plane in zip(('sci', 'var', 'dq'), exists)))
+        model.dtypes = description['dtypes']
+        model.noise = [tuple(noise) for noise in description['noise']]
+        model.filename = description['filename']
+        model.seeing = description['seeing']
+        model.tags = (None if description['tags'] is None
+                      else set(description['tags']))
+        model.descriptors = description['descriptors']
+        return model
+
+
+def cached_model(directory, func, *args, **kwargs):
+    """
+    Return the NoiselessModel of the object created by calling a function
+    with the given arguments, loading it from a subdirectory of directory
+    (memory-mapped) if it has been saved previously, or creating, freezing,
+    and saving it otherwise. The subdirectory is named by the key that
+    cache.cache_key() returns for the function and its arguments, which
+    must therefore describe the scene completely, and concurrent processes
+    creating the same model are serialized with a file lock.
+
+    Parameters
+    ----------
+    directory: str
+        directory in which models are saved
+    func: callable
+        function that returns a noiseless AstroFaker object
+    args, kwargs:
+        arguments passed to func
+
+    Returns
+    -------
+    NoiselessModel
+    """
+    key = cache.cache_key(func, *args, **kwargs)
+    path = os.path.join(directory, key)
+    os.makedirs(os.path.join(directory, 'locks'), exist_ok=True)
+    with cache._locked(os.path.join(directory, 'locks', key)):
+        if os.path.exists(os.path.join(path, MODEL_FILENAME)):
+            return NoiselessModel.load(path)
+        model = func(*args, **kwargs).freeze()
+        model.save(path)
+    return model
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+import os
+
+import numpy as np
+import pytest
+
+import astrofaker
+from astrofaker import cache
+
+calls = []
+
+
+def _make_niri(seed, nframes=None):
+    calls.append(seed)
+    ad = astrofaker.create('NIRI', 'IMAGE')
+    ad.init_default_extensions(scale=4)
+    np.random.seed(seed)
+    ad.add_read_noise()
+    ad.seeing = 0.5
+    if nframes is None:
+        return ad
+    return [ad] * nframes
+
+
+def test_cache_key_is_canonical():
+    key = cache.cache_key(_make_niri, 1, shape=(3, 3), offset=10.)
+    assert key == cache.cache_key(_make_niri, np.int64(1), offset=10.,
+                                  shape=[3, 3])
+    assert key != cache.cache_key(_make_niri, 2, shape=(3, 3), offset=10.)
+    with pytest.raises(TypeError):
+        cache.cache_key(_make_niri, lambda ad: None)
+
+
+def test_cache_hit_and_miss(tmp_path):
+    generation_cache = cache.GenerationCache(str(tmp_path))
+    del calls[:]
+    ad = generation_cache(_make_niri, 0)
+    cached_ad = generation_cache(_make_niri, 0)
+    assert calls == [0]
+    assert isinstance(cached_ad, astrofaker.AstroFaker)
+    assert cached_ad.filename == ad.filename
+    assert cached_ad.seeing == 0.5
+    np.testing.assert_array_equal(cached_ad[0].data, ad[0].data)
+
+    adinputs = generation_cache(_make_niri, 1, nframes=2)
+    adinputs = generation_cache(_make_niri, 1, nframes=2)
+    assert calls == [0, 1]
+    assert isinstance(adinputs, list) and len(adinputs) == 2
+
+
+def _make_gmos(scale):
+    calls.append(scale)
+    ad = astrofaker.create('GMOS-S')
+    ad.init_default_extensions(num_ext=3, overscan=False, scale=scale)
+    ad.tags = ad.tags | {'PREPARED'}
+    return ad, ad
+
+
+def test_cache_hit_matches_miss(tmp_path):
+    generation_cache = cache.GenerationCache(str(tmp_path))
+    del calls[:]
+    result = generation_cache(_make_gmos, 4)
+    cached_result = generation_cache(_make_gmos, 4)
+    assert calls == [4]
+    assert isinstance(cached_result, tuple) and len(cached_result) == 2
+    ad, cached_ad = result[0], cached_result[0]
+    # init_default_extensions() overrides the pixel scale if scale != 1
+    assert cached_ad.pixel_scale() == pytest.approx(ad.pixel_scale())
+    assert cached_ad.tags == ad.tags
+    for frame in (ad, cached_ad):
+        frame.add_star(flux=1000., x=50, y=500)
+    np.testing.assert_allclose(cached_ad[0].data, ad[0].data)
+
+
+def test_lru_eviction(tmp_path):
+    generation_cache = cache.GenerationCache(str(tmp_path), max_size=None)
+    generation_cache(_make_niri, 0)
+    entry_size = generation_cache.entries()[0][1]
+    generation_cache.max_size = int(2.5 * entry_size)
+    generation_cache(_make_niri, 1)
+    generation_cache(_make_niri, 0)  # now more recently used than seed=1
+    del calls[:]
+    generation_cache(_make_niri, 2)
+    assert len(generation_cache.entries()) == 2
+    generation_cache(_make_niri, 0)
+    generation_cache(_make_niri, 1)
+    assert calls == [2, 1]
+
+    # The lock files of evicted entries are deleted too
+    keys = {key for key, _, _ in generation_cache.entries()}
+    assert set(os.listdir(tmp_path / 'locks')) == keys | {'evict'}
+
+
+def test_clear(tmp_path):
+    generation_cache = cache.GenerationCache(str(tmp_path), max_size=None)
+    generation_cache(_make_niri, 0)
+    with pytest.raises(TypeError):
+        generation_cache(_make_niri, 1, nframes=2.5)  # never stored
+    assert len(generation_cache.entries()) == 1
+    assert len(os.listdir(tmp_path / 'locks')) == 2
+
+    generation_cache.clear()
+    assert generation_cache.entries() == []
+    assert os.listdir(tmp_path / 'locks') == []
+
+
+if __name__ == '__main__':
+    pytest.main()
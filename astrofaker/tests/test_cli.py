@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+import json
+import os
+
+import pytest
+
+import astrofaker
+from astrofaker import cli
+
+SPEC = {"defaults": {"instrument": "NIRI", "extensions": {"scale": 4},
+                     "seed": 0},
+        "datasets": [{"name": "single", "stars": {"nstars": 3}},
+                     {"name": "dither", "dither": {"shape": [2, 1]},
+                      "noise": False}]}
+
+
+@pytest.fixture
+def spec_file(tmp_path):
+    path = str(tmp_path / "spec.json")
+    with open(path, "w") as f:
+        json.dump(SPEC, f)
+    return path
+
+
+def test_generate_and_resume(spec_file, tmp_path):
+    output = str(tmp_path / "corpus")
+    messages = []
+    manifest = cli.generate(spec_file, output=output, processes=1,
+                            log=messages.append)
+    assert sorted(manifest) == ["dither", "single"]
+    assert len(manifest["dither"]["files"]) == 2
+    for name, entry in manifest.items():
+        for filename, checksum in entry["files"].items():
+            path = os.path.join(output, name, filename)
+            assert cli.checksum(path) == checksum
+            assert isinstance(astrofaker.open(path), astrofaker.AstroFaker)
+
+    # Nothing is created again unless a file has changed
+    del messages[:]
+    cli.generate(spec_file, output=output, processes=1, log=messages.append)
+    assert all(message.endswith("up to date") for message in messages)
+    filename = sorted(manifest["single"]["files"])[0]
+    with open(os.path.join(output, "single", filename), "ab") as f:
+        f.write(b"\0")
+    del messages[:]
+    cli.generate(spec_file, output=output, processes=1, log=messages.append)
+    assert messages[0] == "dither: up to date"
+    assert messages[1].startswith("single: created 1 files")
+
+
+def test_main(spec_file, tmp_path):
+    output = str(tmp_path / "corpus")
+    assert cli.main(["generate", spec_file, "-o", output, "-j", "1"]) == 0
+    assert os.path.exists(os.path.join(output, cli.MANIFEST_FILENAME))
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+from copy import deepcopy
+
+import numpy as np
+import pytest
+
+import astrofaker
+from astrofaker import defects
+
+
+@pytest.fixture
+def ad():
+    ad = astrofaker.create('NIRI', 'IMAGE')
+    ad.init_default_extensions(scale=4)
+    return ad
+
+
+def test_add_cosmic_rays(ad):
+    np.random.seed(0)
+    ad.phu[ad._keyword_for('exposure_time')] = 1000.
+    ad.add_cosmic_rays(rate=1, pixel_size=27, update_mask=True)
+    affected = ad[0].data > 0
+    assert affected.sum() > 0
+    np.testing.assert_array_equal(ad[0].mask == defects.cosmic_ray, affected)
+
+
+def test_line_pixels_clipped_to_array():
+    iy, ix, segment, nsamples = defects.line_pixels((10, 10), [2, 8], [5, 5],
+                                                    [0, 5], [3, 0])
+    np.testing.assert_array_equal(nsamples, [4, 6])
+    assert list(segment) == [0] * 4 + [1] * 2
+    assert ix.max() == 9
+
+
+def test_scatter_add_integer_data():
+    data = np.full((5, 5), 65000, dtype=np.uint16)
+    defects.scatter_add(data, [1, 1, 2], [1, 1, 2], [400, 400, 100])
+    assert data[1, 1] == 65535
+    assert data[2, 2] == 65100
+    assert data[0, 0] == 65000
+
+
+def test_add_hot_and_dead_pixels(ad):
+    ad.add_read_noise()
+    ad[0].data += 100
+    ad.add_hot_pixels(fraction=0.01, update_mask=True)
+    ad.add_dead_pixels(fraction=0.01, update_mask=True)
+    assert 0 < (ad[0].data == 0).sum() <= 0.01 * ad[0].data.size
+    assert (ad[0].mask == defects.bad_pixel).sum() > (ad[0].data == 0).sum()
+
+
+def test_add_bad_columns_and_trails(ad):
+    ad.add_bad_columns(columns=[10, 20], value=-1, update_mask=True)
+    assert np.all(ad[0].data[:, [10, 20]] == -1)
+    assert np.all(ad[0].mask[:, 10] == defects.bad_pixel)
+
+    ad.add_saturated_trails(x=100, y=100, length=41, level=5000,
+                            update_mask=True)
+    assert np.all(ad[0].data[80:121, 100] == 5000)
+    assert ad[0].data[121, 100] == 0
+    assert np.all(ad[0].mask[80:121, 100] == defects.saturated)
+
+
+def test_noise_updates_variance_and_mask(ad):
+    np.random.seed(0)
+    ad.saturation_level = 5000
+    ad.non_linear_level = 4000
+    ad[0].data[:] = 1000
+    ad[0].data[:10] = 6000
+    ad.add_poisson_noise(update_variance=True)
+    ad.add_read_noise(update_variance=True)
+    gain, read_noise = ad.gain()[0], ad.read_noise()[0]
+    expected = 1000 / gain + (read_noise / gain) ** 2
+    np.testing.assert_allclose(ad[0].variance[10:], expected, rtol=1e-5)
+    assert np.all(ad[0].mask[:10] == defects.saturated | defects.non_linear)
+    assert ad[0].mask[10:].sum() == 0
+
+
+@pytest.mark.parametrize("chunk_rows", (1, 7, 1000))
+def test_chunked_noise_is_identical(ad, chunk_rows):
+    ad[0].data[:] = 1000
+    chunked = deepcopy(ad)
+    for frame, rows in ((ad, None), (chunked, chunk_rows)):
+        np.random.seed(0)
+        frame.add_poisson_noise(update_variance=True, chunk_rows=rows)
+        frame.add_read_noise(update_variance=True, chunk_rows=rows)
+    np.testing.assert_array_equal(chunked[0].data, ad[0].data)
+    np.testing.assert_array_equal(chunked[0].variance, ad[0].variance)
+
+
+def test_flag_levels():
+    data = np.array([[100, 4500, 6000]])
+    mask = np.zeros(data.shape, dtype=defects.datatype)
+    defects.flag_levels(data, mask, saturation_level=5000,
+                        non_linear_level=4000)
+    np.testing.assert_array_equal(mask, [[0, defects.non_linear,
+                                          defects.non_linear | defects.saturated]])
+
+
+if __name__ == '__main__':
+    pytest.main()
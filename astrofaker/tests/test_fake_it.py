@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+
+import warnings
+from copy import deepcopy
+
+import numpy as np
+import pytest
+
+import astrofaker
+from astrofaker import fake_it
+
+
+@pytest.fixture
+def ad_base():
+    ad = astrofaker.create('NIRI', 'IMAGE')
+    ad.init_default_extensions(scale=8)
+    return ad
+
+
+@pytest.mark.parametrize("pattern", fake_it.PATTERNS)
+def test_header_sequence(ad_base, pattern):
+    adinputs = fake_it.header_sequence(ad_base, pattern=pattern, cycles=2,
+                                       offset=6, seed=0)
+    nframes = 8 if pattern == 'abba' else 18
+    assert len(adinputs) == nframes
+    assert len({ad.filename for ad in adinputs}) == nframes
+
+    times = [ad.ut_datetime() for ad in adinputs]
+    assert all(t2 > t1 for t1, t2 in zip(times[:-1], times[1:]))
+    for ad in adinputs:
+        assert ad.phu['ORIGNAME'] == ad.filename
+        assert len(ad) == 1
+        assert ad[0].data.shape == ad_base[0].data.shape
+        assert ad[0].data.strides == (0, 0)
+
+    # The offset keywords match those set by sky_offset()
+    ad = adinputs[3]
+    ad_base.sky_offset(ad.phu['RAOFFSET'], ad.phu['DECOFFSE'])
+    for kw in ('XOFFSET', 'YOFFSET', 'POFFSET', 'QOFFSET'):
+        assert ad.phu[kw] == pytest.approx(ad_base.phu[kw])
+    assert ad[0].hdr['CRVAL1'] == pytest.approx(ad_base[0].hdr['CRVAL1'])
+    assert ad[0].hdr['CRVAL2'] == pytest.approx(ad_base[0].hdr['CRVAL2'])
+
+
+def test_header_sequence_grid_matches_dither(ad_base):
+    adinputs = fake_it.header_sequence(ad_base, pattern='grid')
+    dithered = fake_it.dither(ad_base, add_noise=False)
+    for ad, ad_dither in zip(adinputs, dithered):
+        assert ad.ut_datetime() == ad_dither.ut_datetime()
+        assert ad.phu['POFFSET'] == pytest.approx(ad_dither.phu['POFFSET'])
+        assert ad.phu['QOFFSET'] == pytest.approx(ad_dither.phu['QOFFSET'])
+
+
+def test_dither_with_variable_sky(ad_base):
+    def sky(seconds):
+        return {'level': 100. + seconds, 'gradient': (0.5, 0.),
+                'vignetting': 0.1}
+
+    adinputs = fake_it.dither(ad_base, shape=(2, 1), add_noise=False, sky=sky)
+    step = ad_base.exposure_time() + 5.
+    y, x = np.mgrid[:128, :128] - 63.5
+    for i, ad in enumerate(adinputs):
+        level = 100. + i * step
+        expected = ((level + 0.5 * x) *
+                    (1 - 0.1 * (x * x + y * y) / (2 * 63.5 ** 2)))
+        np.testing.assert_allclose(ad[0].data, expected, rtol=1e-2)
+        assert ad[0].data[64, 64] > ad[0].data[64, 63]
+
+
+def test_header_sequence_unknown_pattern(ad_base):
+    with pytest.raises(ValueError):
+        fake_it.header_sequence(ad_base, pattern='zigzag')
+
+
+def test_calibration_set_bias():
+    ad = astrofaker.create('GMOS-S')
+    ad.init_default_extensions(binning=2, scale=4)
+    biases = fake_it.calibration_set(ad, 'BIAS', nframes=5, seed=0)
+    assert len(biases) == 5
+    for bias in biases:
+        assert 'BIAS' in bias.tags
+        assert bias.exposure_time() == 0
+        assert len(bias) == len(ad)
+        assert bias[0].data.dtype == np.uint16
+        assert bias[0].data.base is biases[0][0].data.base
+
+    # Each amplifier has its own bias level, in the overscan too
+    levels = [np.mean(bias[1].data) for bias in biases]
+    overscan = [np.mean(bias[1].data[:, :bias[1].data_section().x1])
+                for bias in biases]
+    np.testing.assert_allclose(levels, overscan, atol=1)
+    assert np.std(np.mean(biases[0].data, axis=(1, 2))) > 1
+
+
+def test_calibration_set_keeps_overrides():
+    ad = astrofaker.create('GMOS-S')
+    ad.init_default_extensions(num_ext=3, binning=2, scale=4)
+    ad.seeing = 0.6
+    ad.exposure_time = 100.
+    biases = fake_it.calibration_set(ad, 'BIAS', nframes=2, seed=0)
+    for bias in biases:
+        assert bias.pixel_scale() == pytest.approx(ad.pixel_scale())
+        assert bias.seeing == 0.6
+        assert bias.exposure_time() == 0
+
+
+def test_calibration_set_flat():
+    ad = astrofaker.create('NIRI', 'IMAGE')
+    ad.init_default_extensions(scale=8)
+    flats = fake_it.calibration_set(ad, 'FLAT', nframes=3, bias_level=0,
+                                    add_noise=False, pixel_response_rms=0,
+                                    seed=0)
+    data = flats[0][0].data
+    assert data[64, 64] == pytest.approx(10000, rel=1e-3)
+    assert data[0, 0] == pytest.approx(9000, rel=1e-2)
+
+
+def test_time_series(ad_base):
+    def add_objects(ad):
+        ad.add_star(flux=1000., fwhm=fwhm, ra=ra, dec=dec)
+
+    fwhm = 4 * ad_base.pixel_scale()
+    ra, dec = ad_base[0].pix2world(60.2, 70.6)
+    offsets = [(0., 0.), (0.3, -0.2), (-0.5, 0.4)]
+    frames = fake_it.time_series(ad_base, nframes=3, add_objects=add_objects,
+                                 offsets=offsets,
+                                 flux_scale=lambda t: 1 + t / 1000,
+                                 add_noise=False)
+    assert len(frames) == 3
+    step = ad_base.exposure_time() + 5.
+    for i, ad in enumerate(frames):
+        assert ad[0].data.base is frames[0][0].data.base
+        assert ad.phu['RAOFFSET'] == pytest.approx(offsets[i][0])
+        assert ad.phu['DECOFFSE'] == pytest.approx(offsets[i][1])
+        elapsed = ad.ut_datetime() - frames[0].ut_datetime()
+        assert elapsed.total_seconds() == pytest.approx(i * step)
+
+        # The same as rendering the star on an offset frame
+        expected = deepcopy(ad_base)
+        expected.sky_offset(*offsets[i])
+        expected.add_star(flux=1000. * (1 + i * step / 1000), fwhm=fwhm,
+                          ra=ra, dec=dec)
+        np.testing.assert_allclose(ad[0].data, expected[0].data, atol=1e-2)
+
+    stacks = fake_it.time_series(ad_base, nframes=20, add_objects=add_objects,
+                                 jitter=0.1, add_noise=False, seed=0,
+                                 split=False)
+    assert len(stacks) == 1
+    assert stacks[0].shape == (20,) + ad_base[0].data.shape
+    # The pointing errors move the star
+    assert np.std(stacks[0][:, 71, 60]) > 1
+
+
+
+def test_time_series_warns_if_undersampled(ad_base):
+    ra, dec = ad_base[0].pix2world(60.2, 70.6)
+
+    def add_objects(ad):
+        ad.add_star(flux=1000., fwhm=fwhm, ra=ra, dec=dec)
+
+    fwhm = ad_base.pixel_scale()
+    with pytest.warns(UserWarning, match="undersampled"):
+        fake_it.time_series(ad_base, nframes=2, add_objects=add_objects,
+                            offsets=[(0., 0.), (0.3, -0.2)], add_noise=False)
+
+    fwhm = 3 * ad_base.pixel_scale()
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        fake_it.time_series(ad_base, nframes=2, add_objects=add_objects,
+                            offsets=[(0., 0.), (0.3, -0.2)], add_noise=False)
+    assert not any("undersampled" in str(w.message) for w in caught)
+
+
+if __name__ == '__main__':
+    pytest.main()
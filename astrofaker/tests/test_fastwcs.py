@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pytest
+from astropy.io.fits import Header
+from astropy.wcs import WCS
+
+import astrofaker
+from astrofaker import fastwcs
+
+SIP_HEADER = {'CTYPE1': 'RA---TAN-SIP', 'CTYPE2': 'DEC--TAN-SIP',
+              'CRVAL1': 359.99, 'CRVAL2': -30., 'CRPIX1': 1000.,
+              'CRPIX2': 1100., 'CD1_1': -5e-5, 'CD1_2': 1e-6,
+              'CD2_1': 1e-6, 'CD2_2': 5e-5, 'A_ORDER': 2, 'B_ORDER': 2,
+              'A_2_0': 1e-6, 'A_1_1': 5e-7, 'B_0_2': -2e-6}
+
+
+def test_fast_transform_accuracy():
+    header = Header(SIP_HEADER)
+    transform = fastwcs.FastTransform(header, (2048, 2048), tolerance=0.01)
+    assert transform.max_error <= 0.01
+
+    rng = np.random.default_rng(0)
+    x, y = rng.uniform(-0.5, 2047.5, (2, 10000))
+    ra, dec = WCS(header).all_pix2world(x, y, 0)
+    xfit, yfit = transform.world2pix(ra, dec)
+    assert np.hypot(xfit - x, yfit - y).max() < 0.01
+    rafit, decfit = transform.pix2world(x, y)
+    np.testing.assert_allclose(decfit, dec, atol=1e-7)
+    np.testing.assert_allclose((rafit - ra + 180) % 360 - 180, 0, atol=1e-7)
+
+    # Points outside the fitted region use the exact WCS
+    xfit, yfit = transform.world2pix(*WCS(header).all_pix2world(3000, 50, 0))
+    assert xfit == pytest.approx(3000) and yfit == pytest.approx(50)
+
+
+def test_fast_wcs_is_invalidated():
+    ad = astrofaker.create('GMOS-S')
+    ad.init_default_extensions(num_ext=3, scale=8)
+    ad.fast_wcs = True
+    ra, dec = ad[1].pix2world(100., 200.)
+    assert ad[1].world2pix(ra, dec) == pytest.approx((100, 200), abs=0.01)
+
+    ad.sky_offset(10, 0)
+    exact = WCS(ad[1].hdr).all_world2pix(ra, dec, 0)
+    assert ad[1].world2pix(ra, dec) == pytest.approx(exact, abs=0.01)
+    assert exact[0] != pytest.approx(100, abs=1)
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -7,7 +7,7 @@ import pytest
 import astrodata
 import astrofaker
 
-from astrofaker import gmos
+from astrofaker import defects, gmos
 
 
 def test_can_create_dataset():
@@ -29,6 +29,243 @@ def test_can_initialize_default_extensions():
     assert ad.detector_x_bin() in [1, 2, 4]
 
 
+@pytest.mark.parametrize("num_ext", (3, 6, 12))
+def test_central_stamp_roi(num_ext):
+    ad = astrofaker.create('GMOS-S')
+    ad.init_default_extensions(num_ext=num_ext, binning=2,
+                               roi="Central Stamp")
+
+    # The Central Stamp straddles two amplifiers unless they read a whole CCD
+    assert len(ad) == (1 if num_ext == 3 else 2)
+    assert ad.phu['DETRO1XS'] == ad.phu['DETRO1YS'] == 150
+    assert sum(ext.data_section().x2 - ext.data_section().x1
+               for ext in ad) == 150
+    assert ad[0].detector_section().x1 == 2922
+    assert ad[-1].detector_section().x2 == 3222
+    for ext in ad:
+        assert ext.data.shape[0] == 150
+        assert ext.overscan_section().x2 - ext.overscan_section().x1 == gmos.BIAS_WIDTH
+
+
+def test_miniature_detector():
+    full_ad = astrofaker.create('GMOS-S')
+    full_ad.init_default_extensions(binning=2, overscan=False)
+    ad = astrofaker.create('GMOS-S')
+    ad.init_default_extensions(binning=2, overscan=False, scale=16)
+
+    assert len(ad) == len(full_ad)
+    assert ad.pixel_scale() == pytest.approx(16 * full_ad.pixel_scale())
+    for ext, full_ext in zip(ad, full_ad):
+        assert ext.data.shape == (132, 16)
+        assert ext.pixel_scale() == pytest.approx(16 * full_ext.pixel_scale())
+        assert ext.detector_section().x2 == full_ext.detector_section().x2 // 16
+
+    # The corners of the detector are at the same places on the sky
+    for ext, full_ext in ((ad[0], full_ad[0]), (ad[-1], full_ad[-1])):
+        ny, nx = ext.data.shape
+        full_ny, full_nx = full_ext.data.shape
+        corner = ext.wcs(nx - 0.5, ny - 0.5)
+        full_corner = full_ext.wcs(full_nx - 0.5, full_ny - 0.5)
+        np.testing.assert_allclose(corner, full_corner, atol=1e-4)
+
+
+def test_quantize_raw_data():
+    ad = astrofaker.create('GMOS-S')
+    ad.init_default_extensions(num_ext=3, scale=16)
+    ad.make_working_buffer()
+    assert ad[0].data.dtype == np.float32
+    assert ad[0].hdr['BUNIT'] == 'electron'
+
+    ad[0].data[:] = 100
+    ad[0].data[0] = 1e6
+    ad.quantize(bias_level=1000., saturation_level=30000, update_mask=True)
+    gain = ad[0].gain()
+    assert ad[0].data.dtype == np.uint16
+    assert ad[0].hdr['BUNIT'] == 'adu'
+    assert np.all(ad[0].data[1:] == np.rint(np.float32(1000 + 100 / gain)))
+    assert np.all(ad[0].data[0] == 30000)
+    assert np.all(ad[0].mask[0] & defects.saturated)
+    assert np.all(ad[1].data == 1000)
+
+
+def test_quantize_flags_explicit_saturation_level():
+    ad = astrofaker.create('GMOS-S')
+    ad.init_default_extensions(num_ext=3, scale=16)
+    ad.make_working_buffer()
+    descriptor_level = 20000
+    ad.saturation_level = descriptor_level
+    level = 10000
+
+    ad[0].data[:] = 100
+    # Clipped at the level given, but below the descriptor's level
+    ad[0].data[0] = level + 1000
+    ad[0].quantize(saturation_level=level, update_mask=True)
+    assert np.all(ad[0].data[0] == level)
+    assert np.all(ad[0].mask[0] & defects.saturated)
+    assert not np.any(ad[0].mask[1:] & defects.saturated)
+
+    # Not clipped by a higher level given, although above the descriptor's
+    ad[1].data[:] = 100
+    ad[1].data[0] = descriptor_level + 1000
+    ad[1].quantize(saturation_level=descriptor_level + 2000,
+                   update_mask=True)
+    assert np.all(ad[1].data[0] == descriptor_level + 1000)
+    assert not np.any(ad[1].mask & defects.saturated)
+
+
+def test_roi_off_detector():
+    ad = astrofaker.create('GMOS-S')
+    with pytest.raises(ValueError):
+        ad.init_default_extensions(roi=(6000, 6200, 1, 100))
+
+
+def test_add_star_across_extensions():
+    ad = astrofaker.create('GMOS-S')
+    ad.init_default_extensions(num_ext=12, binning=2, overscan=False, scale=4)
+    ny, width = ad[0].data.shape
+    offsets = ad._mosaic_offsets()
+    assert offsets[:4] == [(i * width, 0.) for i in range(4)]
+    # The chip gap is 61 / (2 * 4) pixels
+    assert offsets[4][0] == pytest.approx(4 * width + 7.625, abs=0.01)
+
+    fwhm = 2. / 0.42466 * ad[0].pixel_scale()  # sigma of 2 pixels
+    ad.add_star(flux=1000., fwhm=fwhm, x=width - 0.5, y=100)
+    assert ad[0].data.sum() == pytest.approx(500., rel=1e-3)
+    np.testing.assert_allclose(ad[1].data[:, ::-1], ad[0].data, atol=1e-4)
+    assert ad[2].data.max() == 0
+
+    # Only the wings of a star in the chip gap are seen
+    ad.add_star(flux=1000., fwhm=fwhm, x=4 * width + 3.3125, y=200)
+    assert ad[3].data.sum() == pytest.approx(ad[4].data.sum(), rel=0.05)
+    assert 0 < ad[3].data.sum() + ad[4].data.sum() < 200.
+
+    # The same as rendering on a single extension
+    single = astrofaker.create('GMOS-S')
+    single.init_default_extensions(num_ext=12, binning=2, overscan=False,
+                                   scale=4)
+    ra, dec = ad[0].pix2world(20.3, 300.7)
+    ad.add_star(flux=1000., fwhm=fwhm, ra=ra, dec=dec)
+    single[0].add_star(flux=1000., fwhm=fwhm, x=20.3, y=300.7)
+    np.testing.assert_allclose(ad[0].data[250:350], single[0].data[250:350],
+                               atol=1e-4)
+
+
+def test_descriptors_are_cached_with_overrides():
+    ad = astrofaker.create('GMOS-S')
+    ad.init_default_extensions(num_ext=3, overscan=False, scale=4)
+    # The pixel scale is overridden for scale != 1
+    assert 'pixel_scale' in ad._descriptor_dict
+
+    def cached(name):
+        return [key for key in ad._descriptor_cache if key[0] == name]
+
+    gains = ad.gain()
+    assert len(cached('gain')) == 1
+    assert ad.gain() == gains
+    assert len(cached('gain')) == 1
+
+    # Changing an override or the tags is a change of state
+    ad.pixel_scale = 0.5
+    ad.gain()
+    assert len(cached('gain')) == 2
+    ad.tags = ad.tags | {'PROCESSED'}
+    ad.gain()
+    assert len(cached('gain')) == 3
+
+    # Nothing is cached while an override is callable
+    ad.read_noise = lambda: 5
+    ad.gain()
+    assert len(cached('gain')) == 3
+
+
+def test_mosaic_offsets_are_cached():
+    ad = astrofaker.create('GMOS-S')
+    ad.init_default_extensions(num_ext=3, overscan=False, scale=4)
+    # The pixel scale is overridden for scale != 1
+    assert 'pixel_scale' in ad._descriptor_dict
+    offsets = ad._mosaic_offsets()
+    assert ad._mosaic_offsets() is offsets
+
+    # Overrides of the descriptors that determine them are not ignored
+    ad.detector_x_bin = 2
+    assert ad._mosaic_offsets() is not offsets
+    ad[1].hdr['CRPIX1'] += 1
+    assert ad._mosaic_offsets()[1] != offsets[1]
+
+
+def test_rebin():
+    ad = astrofaker.create('GMOS-S')
+    ad.init_default_extensions(num_ext=12, binning=1, overscan=False, scale=4)
+    binned = astrofaker.create('GMOS-S')
+    binned.init_default_extensions(num_ext=12, binning=2, overscan=False,
+                                   scale=4)
+    fwhm = 12 * ad[0].pixel_scale()
+    ra, dec = ad[0].pix2world(40.3, 300.6)
+    for frame in (ad, binned):
+        frame.add_star(flux=1000., fwhm=fwhm, ra=ra, dec=dec)
+    ad[0].variance = np.ones(ad[0].data.shape, dtype=np.float32)
+    ad[0].mask = np.zeros(ad[0].data.shape, dtype=np.uint16)
+    ad[0].mask[11, 21] = defects.cosmic_ray
+
+    ad.rebin(2)
+    assert ad[0].detector_x_bin() == ad[0].detector_y_bin() == 2
+    assert ad.pixel_scale() == pytest.approx(binned.pixel_scale())
+    for ext, binned_ext in zip(ad, binned):
+        assert ext.data.shape == binned_ext.data.shape
+        for kw in ('CCDSUM', 'DATASEC', 'DETSEC'):
+            assert ext.hdr[kw] == binned_ext.hdr[kw]
+        for kw in ('CRPIX1', 'CRPIX2', 'CD1_1', 'CD1_2', 'CD2_1', 'CD2_2'):
+            assert ext.hdr[kw] == pytest.approx(binned_ext.hdr[kw])
+    # The star is the same as one rendered on binned pixels
+    assert ad[0].data.sum() == pytest.approx(binned[0].data.sum(), rel=1e-3)
+    np.testing.assert_allclose(ad[0].data, binned[0].data,
+                               atol=0.01 * binned[0].data.max())
+    np.testing.assert_array_equal(ad[0].variance, 4)
+    assert ad[0].mask[5, 10] == defects.cosmic_ray
+    assert np.count_nonzero(ad[0].mask) == 1
+
+    # The data section of alternate amplifiers follows the overscan
+    ad = astrofaker.create('GMOS-S')
+    ad.init_default_extensions(num_ext=12, overscan=True, scale=4)
+    shape = ad[1].data.shape
+    with pytest.raises(ValueError):
+        ad.rebin(3)
+    assert ad[1].data.shape == shape
+    ad.rebin(2, average=True)
+    assert ad[1].data.shape == (shape[0] // 2, shape[1] // 2)
+    assert ad[1].hdr['BIASSEC'] == '[1:4,1:{}]'.format(shape[0] // 2)
+
+
+def test_add_spectrum_across_extensions():
+    ad = astrofaker.create('GMOS-S', 'SPECT')
+    ad.init_default_extensions(overscan=False, scale=16)
+    ad.add_spectrum(continuum=100., lines=[(700., 500.)], trace=100.,
+                    wavelengths=(700., 1.), dispersion_axis=1)
+
+    columns = np.concatenate([ext.data.sum(axis=0) for ext in ad])
+    assert columns.size == 384
+    # The line is at the central pixel (191.5) so is split between two
+    np.testing.assert_allclose(columns[:150], 100., rtol=1e-5)
+    assert columns[191] == pytest.approx(columns[192])
+    assert columns.sum() == pytest.approx(384 * 100. + 500., rel=1e-5)
+    for ext in ad:
+        assert ext.data.sum(axis=1).argmax() == 100
+
+
+def test_add_sky_lines():
+    ad = astrofaker.create('GMOS-S', 'SPECT')
+    ad.init_default_extensions(num_ext=3, overscan=False, scale=16)
+    ad.add_sky_lines([(650., 40.)], continuum=2., wavelengths=(700., -0.5),
+                     dispersion_axis=1)
+
+    # A negative dispersion puts the line redward of the centre
+    assert ad[2].data[0].sum() == pytest.approx(128 * 2. + 40., rel=1e-5)
+    assert ad[2].data[0].argmax() in (35, 36)
+    assert ad[0].data.min() >= 2.
+    for row in ad[2].data:
+        np.testing.assert_array_equal(row, ad[2].data[0])
+
+
 def test_can_add_image_extension():
 
     hdu = fits.ImageHDU()
@@ -81,6 +318,43 @@ def test_can_update_descriptor_dispersion_axis_of_astrodata_extensions():
         assert ext.dispersion_axis() == 1
 
 
+def test_override_descriptor_per_extension():
+    ad = astrofaker.create('GMOS-S')
+    ad.init_default_extensions(num_ext=3, overscan=False, scale=16)
+    ad.gain = [1.5, 2.5, 3.5]
+
+    assert ad.gain() == [1.5, 2.5, 3.5]
+    assert [ext.gain() for ext in ad] == [1.5, 2.5, 3.5]
+    assert ad[1:].gain() == [2.5, 3.5]
+
+
+def test_cached_descriptor_invalidation():
+    ad = astrofaker.create('GMOS-S')
+    ad.init_default_extensions(overscan=False, scale=16)
+    assert ad.gain() == [1] * len(ad)
+    assert ad[0].gain() == 1
+
+    ad.hdr['GAIN'] = 2
+    assert ad.gain() == [2] * len(ad)
+    ad[3].hdr['GAIN'] = 3
+    assert ad[3].gain() == 3
+    assert ad.gain()[3] == 3
+
+    assert ad.ut_datetime().year != 2020
+    ad.phu['DATE-OBS'] = '2020-01-01T01:00:00'
+    assert ad.ut_datetime().year == 2020
+
+    # Returned lists can be modified without corrupting the cache
+    gains = ad.gain()
+    gains[0] = 100
+    assert ad.gain()[0] == 2
+
+    # Overrides take precedence over cached values
+    ad.gain = 7
+    assert ad.gain() == 7
+    assert ad[0].gain() == 7
+
+
 def test_override_descriptor():
     ad = astrofaker.create('GMOS-S')
     assert ad.wcs_ra() is None
@@ -92,5 +366,87 @@ def test_override_descriptor():
     assert ad.wcs_ra() == 5
 
 
+@pytest.mark.parametrize("keep_pixels", (False, True))
+def test_from_template(tmp_path, keep_pixels):
+    filename = str(tmp_path / 'template.fits')
+    ad = astrofaker.create('GMOS-S')
+    ad.init_default_extensions(binning=4)
+    ad[0].data[10, 10] = 100
+    ad.write(filename)
+
+    new_ad = astrofaker.from_template(filename, keep_pixels=keep_pixels)
+    assert isinstance(new_ad, gmos.AstroFakerGmos)
+    assert len(new_ad) == len(ad)
+    assert new_ad.detector_x_bin() == 4
+    for ext, new_ext in zip(ad, new_ad):
+        assert new_ext.data.shape == ext.data.shape
+        assert new_ext.data.dtype == ext.data.dtype
+        assert new_ext.detector_section() == ext.detector_section()
+    assert new_ad[0].data[10, 10] == (100 if keep_pixels else 0)
+
+    # The template file is not modified
+    new_ad[0].data[10, 10] = 1
+    assert astrofaker.open(filename)[0].data[10, 10] == 100
+
+
+@pytest.mark.parametrize("overscan", (True, False))
+def test_from_template_maps_pixels(tmp_path, overscan):
+    # Raw uint16 frames are stored with BZERO=32768, processed ones as float
+    filename = str(tmp_path / 'template.fits')
+    ad = astrofaker.create('GMOS-S')
+    ad.init_default_extensions(num_ext=3, overscan=overscan, scale=4)
+    for ext in ad:
+        ext.data[:] = 40000 if overscan else 1000.5
+    ad.write(filename)
+
+    new_ad = astrofaker.from_template(filename, keep_pixels=True)
+    for ext, new_ext in zip(ad, new_ad):
+        assert isinstance(new_ext.data, np.memmap)
+        assert new_ext.data.dtype.type == ext.data.dtype.type
+        np.testing.assert_array_equal(new_ext.data, ext.data)
+
+
+def test_write_compressed_integer_is_lossless(tmp_path):
+    filename = str(tmp_path / 'raw.fits')
+    ad = astrofaker.create('GMOS-S')
+    ad.init_default_extensions(num_ext=3, scale=4)
+    np.random.seed(0)
+    for ext in ad:
+        ext.data[:] = np.random.randint(900, 1100, size=ext.data.shape)
+    ad.write(filename, compression='RICE_1')
+
+    new_ad = astrofaker.open(filename)
+    assert len(new_ad) == len(ad)
+    for ext, new_ext in zip(ad, new_ad):
+        assert new_ext.data.dtype.type == np.uint16  # any byte order
+        assert new_ext.hdr['DATASEC'] == ext.hdr['DATASEC']
+        assert new_ext.hdr['DETSEC'] == ext.hdr['DETSEC']
+        np.testing.assert_array_equal(new_ext.data, ext.data)
+
+
+@pytest.mark.parametrize("quantize_level", (16., 0.))
+def test_write_compressed_float(tmp_path, quantize_level):
+    filename = str(tmp_path / 'image.fits')
+    ad = astrofaker.create('GMOS-S')
+    ad.init_default_extensions(num_ext=3, overscan=False, scale=4)
+    np.random.seed(0)
+    for ext in ad:
+        ext.data[:] = 1000 + 10 * np.random.randn(*ext.data.shape)
+    ad.write(filename, compression='RICE_1', quantize_level=quantize_level)
+
+    new_ad = astrofaker.open(filename)
+    assert len(new_ad) == len(ad)
+    for ext, new_ext in zip(ad, new_ad):
+        assert new_ext.data.dtype.type == np.float32
+        assert new_ext.hdr['DATASEC'] == ext.hdr['DATASEC']
+        assert new_ext.hdr['CRPIX1'] == pytest.approx(ext.hdr['CRPIX1'])
+        if quantize_level:
+            # The quantization step is about sigma / quantize_level
+            np.testing.assert_allclose(new_ext.data, ext.data,
+                                       atol=10 / quantize_level)
+        else:
+            np.testing.assert_array_equal(new_ext.data, ext.data)
+
+
 if __name__ == '__main__':
     pytest.main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+
+import warnings
+
+import numpy as np
+import pytest
+
+from astropy.modeling import models
+
+from astrofaker import kernels
+from astrofaker.astrofaker import Sersic
+
+
+@pytest.mark.parametrize("n, axis_ratio, angle", [(4, 1, 0), (1, 0.5, 30),
+                                                  (0.7, 2, -70)])
+def test_sersic_stamp_matches_model(n, axis_ratio, angle):
+    shape = (300, 200)
+    x, y = 80.3, 120.7
+    obj = ((models.Shift(-x) & models.Shift(-y)) |
+           models.Rotation2D(angle) |
+           (models.Scale(axis_ratio) & models.Identity(1)) |
+           Sersic(amplitude=100, r_e=6.2, n=n))
+    ygrid, xgrid = np.mgrid[:shape[0], :shape[1]]
+    expected = obj(xgrid, ygrid)
+
+    stamp, slices = kernels.sersic_stamp(shape, x, y, 100, 6.2, n=n,
+                                         axis_ratio=axis_ratio, angle=angle)
+    result = np.zeros(shape)
+    result[slices] = stamp
+
+    # The central pixels are averaged over the pixel, so exclude them
+    outside_core = np.ones(shape, dtype=bool)
+    outside_core[118:124, 78:84] = False
+    np.testing.assert_allclose(result[outside_core], expected[outside_core],
+                               atol=1e-4)
+
+
+def test_sersic_table_is_cached():
+    assert kernels.sersic_table(4.0) is kernels.sersic_table(4.0)
+    q, profile = kernels.sersic_table(2.5)
+    assert profile[0] == 1
+    assert profile[-1] <= kernels.SERSIC_TRUNCATION * 1.0001
+
+
+def test_add_gaussians_matches_model():
+    shape = (300, 200)
+    ygrid, xgrid = np.mgrid[:shape[0], :shape[1]]
+    expected = models.Gaussian2D(50, 100.2, 150.7, 2., 2.)(xgrid, ygrid)
+    image = np.zeros(shape)
+    kernels.add_gaussians(image, 100.2, 150.7, 50, 2.)
+    np.testing.assert_allclose(image, expected, atol=1e-10)
+
+
+@pytest.fixture
+def numba_backend():
+    pytest.importorskip("numba")
+    kernels.set_backend('numba')
+    yield
+    kernels.set_backend('numpy')
+
+
+def _run_with_backends(fn):
+    results = []
+    for backend in ('numpy', 'numba'):
+        kernels.set_backend(backend)
+        results.append(fn())
+    return results
+
+
+def test_numba_gaussians_match_numpy(numba_backend):
+    rng = np.random.default_rng(0)
+    x, y = rng.uniform(-10, 210, 50), rng.uniform(-10, 310, 50)
+    amplitude, sigma = rng.uniform(1, 100, 50), rng.uniform(0.5, 4, 50)
+
+    def render():
+        image = np.zeros((1, 300, 200), dtype=np.float32)
+        kernels.add_gaussians(image, x, y, amplitude, sigma)
+        return image
+
+    expected, result = _run_with_backends(render)
+    np.testing.assert_allclose(result, expected, rtol=1e-6, atol=1e-4)
+
+
+def test_numba_sersic_matches_numpy(numba_backend):
+    expected, result = _run_with_backends(
+        lambda: kernels.sersic_stamp((300, 200), 80.3, 120.7, 100, 6.2,
+                                     n=1.5, axis_ratio=0.6, angle=20))
+    assert result[1] == expected[1]
+    np.testing.assert_allclose(result[0], expected[0], atol=1e-12)
+
+
+def test_numba_noise_matches_numpy(numba_backend):
+    rng = np.random.default_rng(0)
+    data = rng.uniform(-5, 100, (100, 120)).astype(np.float32)
+    z = rng.standard_normal(data.shape)
+
+    def noisy():
+        poisson, read = data.copy(), data.copy()
+        variance = np.zeros_like(data)
+        kernels.add_poisson_noise(poisson, 0.7, z, variance=variance)
+        kernels.add_read_noise(read, 3., z, variance=variance)
+        return poisson, read, variance
+
+    expected, result = _run_with_backends(noisy)
+    for r, e in zip(result, expected):
+        np.testing.assert_allclose(r, e, rtol=1e-6, atol=1e-4)
+
+
+@pytest.mark.parametrize("chunk_rows", (1, 7, 1000))
+@pytest.mark.parametrize("dtype,high,saturation,data_dtype",
+                         ((np.uint16, 70000, 40000, np.float32),
+                          (np.int32, 6e9, None, np.float64)))
+def test_quantize_matches_direct_calculation(chunk_rows, dtype, high,
+                                             saturation, data_dtype):
+    rng = np.random.default_rng(0)
+    data = rng.uniform(-100, high, (50, 60)).astype(data_dtype)
+
+    def nonlinearity(x):
+        return x * (1 - 0.07 * x / high)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")  # no overflows in the cast
+        result = kernels.quantize(data, dtype=dtype, scale=0.5, offset=1000.,
+                                  nonlinearity=nonlinearity,
+                                  saturation=saturation,
+                                  chunk_rows=chunk_rows)
+    info = np.iinfo(dtype)
+    upper = info.max if saturation is None else saturation
+    expected = np.clip(np.rint(nonlinearity(0.5 * data) + 1000),
+                       info.min, upper)
+    assert result.dtype == dtype
+    np.testing.assert_array_equal(result, expected)
+
+
+@pytest.mark.parametrize("chunk_rows", (1, 7, 1000))
+def test_add_upsampled_is_exact_for_bilinear_functions(chunk_rows):
+    def func(x, y):
+        return 3 + 0.01 * x - 0.02 * y + 1e-5 * x * y
+
+    xcoarse, ycoarse = kernels.coarse_grid(100, 16), kernels.coarse_grid(70, 16)
+    assert xcoarse[-1] == 99 and np.diff(xcoarse).max() <= 16
+    image = np.ones((2, 70, 100))
+    kernels.add_upsampled(image, func(*np.meshgrid(xcoarse, ycoarse)),
+                          xcoarse, ycoarse, chunk_rows=chunk_rows)
+    y, x = np.mgrid[:70, :100]
+    for plane in image:
+        np.testing.assert_allclose(plane, 1 + func(x, y), rtol=1e-12)
+
+
+def test_add_shifted_matches_rendered_gaussians():
+    image = np.zeros((60, 80))
+    kernels.add_gaussians(image, 30.2, 25.6, 10., 1.5)
+    dx, dy = [0., 0.3, -1.7, 2.5], [0., -0.4, 0.9, 1.1]
+    scale = [1., 2., 0.5, 1.]
+    stack = np.ones((4, 60, 80), dtype=np.float32)
+    kernels.add_shifted(stack, image, dx, dy, scale, batch=3)
+    for plane, x, y, s in zip(stack, dx, dy, scale):
+        expected = np.ones_like(image)
+        kernels.add_gaussians(expected, 30.2 + x, 25.6 + y, 10. * s, 1.5)
+        np.testing.assert_allclose(plane, expected, atol=1e-3)
+
+
+
+@pytest.mark.parametrize("fwhm", (1., 3., 6.))
+def test_spectral_fwhm_of_gaussians(fwhm):
+    image = np.zeros((100, 120))
+    sigma = fwhm / np.sqrt(8 * np.log(2))
+    kernels.add_gaussians(image, [30.2, 70.5, 90.1], [25.6, 60.3, 80.8],
+                          [10., 3., 5.], sigma)
+    assert kernels.spectral_fwhm(image) == pytest.approx(fwhm, rel=0.1)
+    assert kernels.spectral_fwhm(np.zeros((10, 10))) == np.inf
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+import os
+import pytest
+
+from astrofaker import planner
+
+
+def test_plan_matches_created_frames(tmp_path):
+    result = planner.plan('NIRI', extensions={'scale': 4},
+                          stars={'nstars': 5}, dither={'shape': (2, 1)},
+                          seed=0)
+    assert result.nframes == 2
+    assert [name for name, _, _ in result.steps] == [
+        'init_default_extensions', 'copy', 'stars', 'poisson_noise',
+        'read_noise']
+    assert result.seconds > 0
+
+    adinputs = result.frames()
+    assert len(adinputs) == 2
+    assert result.frame_bytes == adinputs[0][0].data.nbytes
+    sizes = []
+    for ad in adinputs:
+        path = str(tmp_path / ad.filename)
+        ad.write(path)
+        sizes.append(os.path.getsize(path))
+    assert sum(sizes) == pytest.approx(result.output_bytes, rel=0.05)
+
+
+def test_memory_budget():
+    kwargs = dict(extensions={'num_ext': 12, 'overscan': False},
+                  dither={'shape': (3, 3)})
+    unlimited = planner.plan('GMOS-S', **kwargs)
+    frame_bytes = unlimited.frame_bytes
+    assert unlimited.resident_bytes == 10 * frame_bytes
+    assert not unlimited.stream and unlimited.chunk_rows is None
+
+    # Streaming keeps only the base frame and the current one in memory
+    streamed = planner.plan('GMOS-S', memory_budget=3 * frame_bytes, **kwargs)
+    assert streamed.stream and streamed.chunk_rows is None
+    assert streamed.resident_bytes == 2 * frame_bytes
+    assert streamed.within_budget
+
+    # A tighter budget is met by drawing the noise a few rows at a time
+    budget = 2 * frame_bytes + unlimited.temporary_bytes // 10
+    chunked = planner.plan('GMOS-S', memory_budget=budget, **kwargs)
+    assert chunked.stream and chunked.chunk_rows is not None
+    assert chunked.within_budget
+    assert chunked.temporary_bytes < unlimited.temporary_bytes
+
+    impossible = planner.plan('GMOS-S', memory_budget=frame_bytes, **kwargs)
+    assert not impossible.within_budget
+    assert 'WARNING' in impossible.summary()[-1]
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pytest
+
+import astrofaker
+from astrofaker.pytest_plugin import FrameFactory, copy_frame
+
+
+def test_frame_factory_builds_once_and_copies():
+    factory = FrameFactory()
+    ad = factory('NIRI', stars=5, seed=1, scale=4)
+    ad[0].data[:] = 0
+    new_ad = factory('NIRI', stars=5, seed=1, scale=4)
+
+    assert isinstance(new_ad, astrofaker.AstroFaker)
+    assert len(factory.build_times) == 1
+    assert factory.ncopies == 2
+    assert new_ad[0].data.max() > 0
+    np.testing.assert_array_equal(
+        new_ad[0].data, factory('NIRI', stars=5, seed=1, scale=4)[0].data)
+
+    factory('NIRI', stars=5, seed=2, scale=4)
+    assert len(factory.build_times) == 2
+    summary = factory.summary()
+    assert summary[0].startswith('built 2 configurations')
+    assert "scale=4" in summary[1]
+
+
+def test_copy_frame_does_not_share_caches():
+    ad = astrofaker.create('GMOS-S')
+    ad.init_default_extensions(num_ext=3, overscan=False, scale=4)
+    ad.seeing = 0.6
+    ad.add_star(flux=1000., x=600, y=500)  # fills the mosaic cache
+    ad.gain()
+
+    new_ad = copy_frame(ad)
+    assert new_ad._mosaic_cache is None
+    assert new_ad._descriptor_cache == {}
+    assert new_ad.seeing == 0.6
+    assert new_ad.pixel_scale() == pytest.approx(ad.pixel_scale())
+    for ext, new_ext in zip(ad, new_ad):
+        assert new_ext.hdr['DATASEC'] == ext.hdr['DATASEC']
+        np.testing.assert_array_equal(new_ext.data, ext.data)
+        assert not np.shares_memory(new_ext.data, ext.data)
+    assert new_ad[0].wcs(10, 10) == pytest.approx(ad[0].wcs(10, 10))
+
+
+def test_merge_worker_times():
+    factory = FrameFactory()
+    factory('NIRI', noise=False, scale=4)
+    worker = FrameFactory()
+    worker('NIRI', stars=5, seed=1, scale=4)
+    worker('NIRI', stars=5, seed=1, scale=4)
+    factory.merge(**{'build_times': [list(x) for x in worker.build_times],
+                     'ncopies': worker.ncopies,
+                     'copy_time': worker.copy_time})
+    assert len(factory.build_times) == 2
+    assert factory.ncopies == 3
+    assert factory.summary()[0].startswith('built 2 configurations')
+
+
+if __name__ == '__main__':
+    pytest.main()
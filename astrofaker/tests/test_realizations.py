@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pytest
+
+import astrofaker
+from astrofaker import realizations
+
+
+def _make_scene(flux=1e5):
+    ad = astrofaker.create('NIRI', 'IMAGE')
+    ad.init_default_extensions(scale=4)
+    ad[0].data += 500
+    ad[0].add_star(flux=flux, x=100, y=100)
+    return ad
+
+
+def test_realizations_are_independent_and_reproducible():
+    ad = _make_scene()
+    model = ad.freeze()
+    first, second = model.realizations(2, seed=0)
+    assert isinstance(first, astrofaker.AstroFaker)
+    assert first.tags == ad.tags
+    assert not np.array_equal(first[0].data, second[0].data)
+    np.testing.assert_array_equal(first[0].data,
+                                  next(model.realizations(5, seed=0))[0].data)
+    # The model itself is not changed
+    np.testing.assert_array_equal(model.planes[0][0], ad[0].data)
+
+
+def test_realization_noise_matches_noise_methods():
+    ad = _make_scene()
+    model = ad.freeze()
+    noisy = model.realize(0, update_variance=True)
+    gain, read_noise = ad.gain()[0], ad.read_noise()[0]
+    expected = 500 / gain + (read_noise / gain) ** 2
+    np.testing.assert_allclose(noisy[0].variance[:50, :50], expected,
+                               rtol=1e-5)
+    residuals = noisy[0].data[:50, :50] - 500
+    assert residuals.std() == pytest.approx(np.sqrt(expected), rel=0.05)
+
+
+def test_save_and_load(tmp_path):
+    ad = _make_scene()
+    ad.pixel_scale = 0.5
+    model = ad.freeze()
+    model.save(str(tmp_path))
+    loaded = realizations.NoiselessModel.load(str(tmp_path))
+    assert isinstance(loaded.planes[0][0], np.memmap)
+    realization = loaded.realize(1)
+    np.testing.assert_array_equal(realization[0].data,
+                                  model.realize(1)[0].data)
+    assert realization.pixel_scale() == 0.5
+    assert realization.tags == ad.tags
+
+
+def test_cached_model(tmp_path):
+    model = realizations.cached_model(str(tmp_path), _make_scene, flux=1e4)
+    cached = realizations.cached_model(str(tmp_path), _make_scene, flux=1e4)
+    assert isinstance(cached.planes[0][0], np.memmap)
+    np.testing.assert_array_equal(cached.planes[0][0], model.planes[0][0])
+    other = realizations.cached_model(str(tmp_path), _make_scene, flux=2e4)
+    assert not isinstance(other.planes[0][0], np.memmap)
+    assert len([path for path in tmp_path.iterdir()
+                if path.name != 'locks']) == 2
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+import os
+
+import numpy as np
+import pytest
+
+import astrofaker
+from astrofaker import transport
+
+
+def _make_niri(seed):
+    ad = astrofaker.create('NIRI', 'IMAGE')
+    ad.init_default_extensions(roi_size=512)
+    np.random.seed(seed)
+    ad.add_read_noise()
+    return ad
+
+
+def _make_niri_or_fail(seed):
+    if seed == 1:
+        raise ValueError("Failed to make frame {}".format(seed))
+    return _make_niri(seed)
+
+
+def test_share_and_attach():
+    ad = _make_niri(0)
+    ad[0].variance = np.ones_like(ad[0].data)
+    ad.seeing = 0.5
+
+    new_ad = transport.attach(transport.share(ad))
+
+    assert isinstance(new_ad, astrofaker.AstroFaker)
+    assert new_ad.tags == ad.tags
+    assert new_ad.seeing == 0.5
+    assert new_ad[0].mask is None
+    np.testing.assert_array_equal(new_ad[0].data, ad[0].data)
+    np.testing.assert_array_equal(new_ad[0].variance, ad[0].variance)
+    assert new_ad[0].hdr['HIROW'] == ad[0].hdr['HIROW']
+
+
+def test_generate_in_worker_processes():
+    adinputs = transport.generate(_make_niri, [(seed,) for seed in range(3)],
+                                  processes=2)
+    assert len(adinputs) == 3
+    for seed, ad in enumerate(adinputs):
+        np.testing.assert_array_equal(ad[0].data, _make_niri(seed)[0].data)
+
+
+@pytest.mark.skipif(not os.path.isdir('/dev/shm'),
+                    reason="shared memory blocks are not visible as files")
+def test_generate_releases_shared_memory_on_error():
+    before = set(os.listdir('/dev/shm'))
+    with pytest.raises(ValueError, match="frame 1"):
+        transport.generate(_make_niri_or_fail,
+                           [(seed,) for seed in range(6)], processes=2)
+    assert set(os.listdir('/dev/shm')) <= before
+
+
+if __name__ == '__main__':
+    pytest.main()
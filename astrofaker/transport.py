@@ -0,0 +1,221 @@
+# This module contains functions for moving AstroFaker objects between
+# processes without pickling their pixel data. Headers are sent as lists of
+# cards, while the pixel, variance and mask planes are placed in
+# multiprocessing.shared_memory blocks, which the receiving process maps
+# directly into the arrays of the reconstructed object.
+import os
+from functools import partial
+from multiprocessing import Pool, resource_tracker, shared_memory
+
+import numpy as np
+from astropy.io.fits import Header
+
+from .astrofaker import AstroFaker
+
+
+class _SharedBlock(shared_memory.SharedMemory):
+    """
+    A SharedMemory block whose mapping lives as long as the arrays that use
+    it. Arrays constructed on the buffer keep a reference to it (rather than
+    a buffer export) so the standard close() on garbage collection would
+    unmap memory that is still in use. Instead, the file descriptor is closed
+    immediately and the memory is unmapped when the last reference to the
+    buffer disappears.
+    """
+    def __init__(self, name):
+        super().__init__(name=name)
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def __del__(self):
+        pass
+
+
+def _header_cards(header):
+    return [(card.keyword, card.value, card.comment) for card in header.cards]
+
+
+class SharedPlane(object):
+    """
+    Picklable description of an array held in a shared-memory block.
+    """
+    def __init__(self, array):
+        array = np.ascontiguousarray(array)
+        self.shape = array.shape
+        self.dtype = array.dtype.str
+        # A block cannot have zero size
+        block = shared_memory.SharedMemory(create=True,
+                                           size=max(array.nbytes, 1))
+        self.name = block.name
+        np.ndarray(self.shape, dtype=self.dtype, buffer=block.buf)[...] = array
+        block.close()
+
+    def attach(self):
+        """
+        Return an array using the shared memory, and remove the block's name
+        so that the memory is freed once the array is no longer in use.
+        """
+        block = _SharedBlock(name=self.name)
+        array = np.ndarray(self.shape, dtype=self.dtype, buffer=block.buf)
+        block.unlink()
+        return array
+
+    def discard(self):
+        """Free the shared memory without using it"""
+        block = _SharedBlock(name=self.name)
+        block.unlink()
+
+
+class SharedAstroFaker(object):
+    """
+    Picklable description of an AstroFaker object whose pixel planes have
+    been placed in shared memory. Each instance must be passed to attach()
+    or have its discard() method called exactly once, or the shared memory
+    will not be released until the resource tracker cleans it up.
+
+    Only the headers, pixel planes, seeing, tags, and non-callable
+    descriptor overrides are transported; tables are not.
+    """
+    def __init__(self, ad):
+        self.phu = _header_cards(ad.phu)
+        self.filename = ad.filename
+        self.extensions = []
+        for ext in ad:
+            planes = [None if plane is None else SharedPlane(plane)
+                      for plane in (ext.data, ext.variance, ext.mask)]
+            self.extensions.append((_header_cards(ext.hdr), planes))
+        self.seeing = ad.seeing
+        self.tags = getattr(ad, '_tags', None)
+        self.descriptors = {k: v for k, v in ad._descriptor_dict.items()
+                            if not callable(v)}
+
+    def discard(self):
+        """Free the shared memory without reconstructing the object"""
+        for _, planes in self.extensions:
+            for plane in planes:
+                if plane is not None:
+                    plane.discard()
+
+
+def share(ad):
+    """
+    Place the pixel planes of an AstroFaker object (or of each object in a
+    list) in shared memory, and return a picklable description of it.
+
+    Parameters
+    ----------
+    ad: AstroFaker/list
+        object(s) to share
+
+    Returns
+    -------
+    SharedAstroFaker/list
+    """
+    if isinstance(ad, (list, tuple)):
+        return [share(x) for x in ad]
+    return SharedAstroFaker(ad)
+
+
+def attach(shared):
+    """
+    Reconstruct an AstroFaker object (or a list of them) from the
+    description returned by share(). The arrays are mapped directly onto
+    the shared memory, which is released when they are no longer in use.
+
+    Parameters
+    ----------
+    shared: SharedAstroFaker/list
+        description(s) returned by share()
+
+    Returns
+    -------
+    AstroFaker/list
+    """
+    if isinstance(shared, (list, tuple)):
+        return [attach(x) for x in shared]
+    extensions = [(Header(cards), *[None if plane is None else plane.attach()
+                                    for plane in planes])
+                  for cards, planes in shared.extensions]
+    ad = AstroFaker._assemble(Header(shared.phu), extensions,
+                              filename=shared.filename)
+    ad.seeing = shared.seeing
+    if shared.tags is not None:
+        ad.tags = shared.tags
+    for name, value in shared.descriptors.items():
+        setattr(ad, name, value)
+    return ad
+
+
+def discard(shared):
+    """
+    Release the shared memory of the description returned by share() (or
+    of each description in a list) without reconstructing the object(s).
+
+    Parameters
+    ----------
+    shared: SharedAstroFaker/list
+        description(s) returned by share()
+    """
+    if isinstance(shared, (list, tuple)):
+        for x in shared:
+            discard(x)
+    else:
+        shared.discard()
+
+
+def _share_result(func, args):
+    return share(func(*args))
+
+
+def generate(func, iterable, processes=None):
+    """
+    Call a function that creates AstroFaker objects in a pool of worker
+    processes, and return the objects it creates in this process, having
+    transported their pixel planes through shared memory rather than by
+    pickling them.
+
+    Parameters
+    ----------
+    func: callable
+        picklable (i.e., module-level) function returning an AstroFaker
+        object or a list of them
+    iterable: iterable
+        sequence of argument tuples with which func is called, as for
+        multiprocessing.Pool.starmap()
+    processes: int/None
+        number of worker processes (None means the number of CPUs)
+
+    Returns
+    -------
+    list: the return values of func, in the order of iterable
+
+    If func raises an exception, the remaining calls are completed and the
+    shared memory of their return values is released before the exception
+    is re-raised in this process.
+    """
+    # Make sure the worker processes share this process's resource tracker,
+    # rather than starting their own which would unlink the blocks they
+    # create when they exit
+    resource_tracker.ensure_running()
+    results = []
+    with Pool(processes) as pool:
+        pending = pool.imap(partial(_share_result, func), iterable)
+        try:
+            for shared in pending:
+                results.append(attach(shared))
+        except Exception:
+            # The blocks of results that have not been attached would only
+            # be unlinked when this process exits
+            while True:
+                try:
+                    discard(next(pending))
+                except StopIteration:
+                    break
+                except Exception:
+                    pass
+            raise
+        except BaseException:
+            pool.terminate()
+            raise
+    return results
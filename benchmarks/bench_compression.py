@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""
+Compare the write and read throughput, and file sizes, of uncompressed and
+tile-compressed output for a GMOS frame of noise around a constant
+background (like most of our synthetic regression data).
+
+Usage: python bench_compression.py [--overscan] [--repeat N]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import astrofaker
+
+SETTINGS = [(None, 16.), ('RICE_1', 16.), ('RICE_1', 4.), ('GZIP_2', 16.),
+            ('GZIP_2', 0.)]
+
+
+def make_frame(overscan):
+    ad = astrofaker.create('GMOS-S', 'IMAGE')
+    ad.init_default_extensions(overscan=overscan)
+    if overscan:
+        # raw data: integer ADU
+        for ext in ad:
+            ext.data[:] = np.random.poisson(1000, ext.data.shape)
+    else:
+        ad.add(1000.)
+        ad.add_poisson_noise()
+        ad.add_read_noise()
+    return ad
+
+
+def best_time(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--overscan', action='store_true',
+                        help='use raw uint16 frames with overscan')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    ad = make_frame(args.overscan)
+    nbytes = sum(ext.data.nbytes for ext in ad)
+    print("Frame: {} extensions, {:.1f} MB of pixels ({})".format(
+        len(ad), nbytes / 1e6, ad[0].data.dtype))
+    print("{:>12s} {:>9s} {:>10s} {:>8s} {:>12s} {:>12s}".format(
+        "compression", "quantize", "size (MB)", "ratio", "write (MB/s)",
+        "read (MB/s)"))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for compression, quantize_level in SETTINGS:
+            filename = os.path.join(tmpdir, 'bench.fits')
+
+            def write():
+                ad.write(filename, overwrite=True, compression=compression,
+                         quantize_level=quantize_level)
+
+            def read():
+                for ext in astrofaker.open(filename):
+                    ext.data.sum()
+
+            t_write = best_time(write, args.repeat)
+            t_read = best_time(read, args.repeat)
+            size = os.path.getsize(filename)
+            print("{:>12s} {:>9s} {:>10.1f} {:>8.2f} {:>12.1f} {:>12.1f}".format(
+                compression or "none",
+                "-" if compression is None else str(quantize_level),
+                size / 1e6, nbytes / size, nbytes / 1e6 / t_write,
+                nbytes / 1e6 / t_read))
+
+
+if __name__ == '__main__':
+    main()
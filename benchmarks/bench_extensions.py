@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+"""
+Time the construction of the extensions of a 12-amplifier GMOS frame. The
+detector is shrunk so that the time is dominated by building the headers
+and WCS objects rather than by allocating pixels.
+
+Usage: python bench_extensions.py [--scale N] [--repeat N]
+"""
+import argparse
+import time
+
+import astrofaker
+
+
+def best_time(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scale', type=int, default=16,
+                        help='factor by which to shrink the detectors')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    ad = astrofaker.create('GMOS-S', 'IMAGE')
+
+    def build():
+        ad.init_default_extensions(num_ext=12, scale=args.scale)
+
+    seconds = best_time(build, args.repeat)
+    print("{} extensions in {:.1f} ms ({:.2f} ms per extension)".format(
+        len(ad), seconds * 1e3, seconds * 1e3 / len(ad)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+"""
+Measure the rates used by the planner to estimate the time needed to
+create data (see astrofaker.planner.calibrate), and optionally save them as
+a JSON file that can be passed to "astrofaker generate --timings".
+
+Usage: python bench_planner.py [--repeat N] [--output FILE]
+"""
+import argparse
+import json
+
+from astrofaker import planner
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='JSON file in which to save the rates')
+    args = parser.parse_args()
+
+    timings = planner.calibrate(repeat=args.repeat)
+    for name, seconds in sorted(timings.items()):
+        print("{:15s} {:.3g}s (default {:.3g}s)".format(
+            name, seconds, planner.DEFAULT_TIMINGS[name]))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(timings, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()